@@ -0,0 +1,812 @@
+"""
+Motor assíncrono de revisão de MRs (asyncio + aiohttp).
+
+Executa o mesmo pipeline do main.py (diffs paginados, contexto do arquivo, IA,
+resolução de linhas e comentários) sem uma thread por chamada em andamento:
+todas as requisições compartilham uma única ClientSession e são limitadas por
+um controle de concorrência adaptativo (AIMD) por backend (GitLab e OpenAI). Permite revisar vários MRs no mesmo processo:
+
+    python async_review.py <url_mr> [<url_mr> ...]
+"""
+import asyncio
+import json
+import os
+import posixpath
+import sys
+import time
+from contextlib import asynccontextmanager
+from urllib.parse import quote
+
+import aiohttp
+
+import main as review
+from llm_backends import get_llm_backend, llm_headers, llm_stage_enabled, stub_completion
+from main import debug_log, trace_span
+
+GITLAB_CONCURRENCY = int(os.getenv("MR_REVIEW_ASYNC_GITLAB_CONCURRENCY", "32"))  # Teto de requisições simultâneas ao GitLab
+OPENAI_CONCURRENCY = int(os.getenv("MR_REVIEW_ASYNC_OPENAI_CONCURRENCY", "16"))  # Teto de chamadas simultâneas à OpenAI
+INITIAL_CONCURRENCY = int(os.getenv("MR_REVIEW_ASYNC_INITIAL_CONCURRENCY", "4"))  # Ponto de partida do AIMD
+LATENCY_SPIKE_FACTOR = float(os.getenv("MR_REVIEW_ASYNC_LATENCY_SPIKE_FACTOR", "3.0"))  # Latência > N x média = sobrecarga
+LATENCY_EWMA_ALPHA = 0.1
+LATENCY_MIN_SAMPLES = 5
+MAX_CONNECTIONS = int(os.getenv("MR_REVIEW_ASYNC_MAX_CONNECTIONS", "200"))
+GITLAB_MAX_RETRIES = int(os.getenv("MR_REVIEW_ASYNC_GITLAB_MAX_RETRIES", "3"))
+
+def create_limiter(name, maximum):
+    """
+    Limite de concorrência adaptativo (AIMD) de um backend: cresce +1 a cada janela de
+    chamadas saudáveis e cai pela metade em 429/503, timeout ou pico de latência.
+    """
+    initial = max(1, min(INITIAL_CONCURRENCY, maximum))
+    return {
+        "name": name,
+        "limit": float(initial),
+        "minimum": 1,
+        "maximum": max(1, maximum),
+        "in_flight": 0,
+        "condition": asyncio.Condition(),
+        "latency_ewma": None,
+        "samples": 0,
+        "last_decrease": 0.0,
+        "decreases": 0,
+    }
+
+async def acquire_slot(limiter):
+    async with limiter["condition"]:
+        await limiter["condition"].wait_for(lambda: limiter["in_flight"] < int(limiter["limit"]))
+        limiter["in_flight"] += 1
+
+async def release_slot(limiter, latency, overloaded, cancelled=False):
+    """
+    Devolve o slot e ajusta o limite conforme o resultado da chamada. Chamada cancelada (ex.: a
+    perdedora de um hedge) só devolve o slot: a latência truncada não vira amostra nem aumento.
+    """
+    async with limiter["condition"]:
+        if cancelled:
+            limiter["in_flight"] -= 1
+            limiter["condition"].notify_all()
+            return
+        saturated = limiter["in_flight"] >= int(limiter["limit"])
+        limiter["in_flight"] -= 1
+        baseline = limiter["latency_ewma"]
+        if (
+            not overloaded
+            and baseline is not None
+            and limiter["samples"] >= LATENCY_MIN_SAMPLES
+            and latency > baseline * LATENCY_SPIKE_FACTOR
+        ):
+            debug_log(f"Pico de latência em {limiter['name']}: {latency:.2f}s (média {baseline:.2f}s)")
+            overloaded = True
+
+        now = time.monotonic()
+        if overloaded:
+            # Uma rajada de erros da mesma janela reduz o limite uma única vez
+            if now - limiter["last_decrease"] >= max(1.0, baseline or 0.0):
+                limiter["limit"] = max(limiter["minimum"], limiter["limit"] / 2)
+                limiter["last_decrease"] = now
+                limiter["decreases"] += 1
+                debug_log(f"Concorrência de {limiter['name']} reduzida para {int(limiter['limit'])}")
+        else:
+            limiter["latency_ewma"] = latency if baseline is None else (
+                baseline + LATENCY_EWMA_ALPHA * (latency - baseline)
+            )
+            limiter["samples"] += 1
+            # Só cresce quando o limite atual está de fato sendo usado
+            if saturated and limiter["limit"] < limiter["maximum"]:
+                previous = int(limiter["limit"])
+                limiter["limit"] = min(limiter["maximum"], limiter["limit"] + 1 / limiter["limit"])
+                if int(limiter["limit"]) > previous:
+                    debug_log(f"Concorrência de {limiter['name']} aumentada para {int(limiter['limit'])}")
+        limiter["condition"].notify_all()
+
+@asynccontextmanager
+async def limited_call(engine, backend):
+    """
+    Ocupa um slot do backend durante a chamada. O chamador marca outcome["overloaded"]
+    em respostas 429/503; timeouts são detectados aqui.
+    """
+    limiter = engine["limiters"][backend]
+    await acquire_slot(limiter)
+    started = time.monotonic()
+    outcome = {"overloaded": False}
+    cancelled = False
+    try:
+        yield outcome
+    except asyncio.TimeoutError:
+        outcome["overloaded"] = True
+        raise
+    except asyncio.CancelledError:
+        cancelled = True
+        raise
+    finally:
+        await release_slot(limiter, time.monotonic() - started, outcome["overloaded"], cancelled)
+
+def get_concurrency_limits(engine):
+    """Limites atuais por backend: {backend: {"limit", "in_flight", "maximum", "decreases"}}."""
+    return {
+        backend: {
+            "limit": int(limiter["limit"]),
+            "in_flight": limiter["in_flight"],
+            "maximum": limiter["maximum"],
+            "decreases": limiter["decreases"],
+        }
+        for backend, limiter in engine["limiters"].items()
+    }
+
+def task_trace_id():
+    """No trace, cada tarefa asyncio vira uma "thread" própria para os spans aninharem corretamente."""
+    task = asyncio.current_task()
+    return id(task) if task is not None else None
+
+async def create_engine():
+    """Cria a sessão HTTP compartilhada e os controles de concorrência por backend."""
+    connector = aiohttp.TCPConnector(limit=MAX_CONNECTIONS, limit_per_host=MAX_CONNECTIONS)
+    return {
+        "session": aiohttp.ClientSession(connector=connector),
+        "limiters": {
+            "gitlab": create_limiter("gitlab", GITLAB_CONCURRENCY),
+            "openai": create_limiter("openai", OPENAI_CONCURRENCY),
+        },
+        # aiohttp não aceita headers None (requests simplesmente os omite)
+        "gitlab_headers": {key: value for key, value in review.HEADERS.items() if value is not None},
+        # Listagens de tree em andamento/concluídas: (project_id, ref, diretório) -> Task
+        "tree_tasks": {},
+    }
+
+async def close_engine(engine):
+    await engine["session"].close()
+
+async def gitlab_request(engine, method, path, params=None, json_body=None, raw=False):
+    """
+    Requisição ao GitLab com retry em 429/5xx/erros de conexão (espera com asyncio.sleep).
+    Retorna (status, headers, corpo) — corpo em bytes se raw, senão JSON (ou texto em erro).
+    """
+    url = f"{review.GITLAB_API_URL}{path}"
+    timeout = aiohttp.ClientTimeout(total=review.GITLAB_TIMEOUT_SECONDS)
+    for attempt in range(1, GITLAB_MAX_RETRIES + 1):
+        try:
+            async with limited_call(engine, "gitlab") as outcome:
+                with trace_span(f"gitlab {method}", "http", tid=task_trace_id(), path=path, attempt=attempt) as span:
+                    async with engine["session"].request(
+                        method, url, headers=engine["gitlab_headers"], params=params, json=json_body, timeout=timeout
+                    ) as resp:
+                        outcome["overloaded"] = resp.status in (429, 503)
+                        span["status"] = resp.status
+                        if (resp.status == 429 or resp.status >= 500) and attempt < GITLAB_MAX_RETRIES:
+                            wait_s = review.get_retry_wait_seconds(attempt, resp, base_seconds=2, max_seconds=60)
+                            debug_log(f"GitLab {method} {path} status={resp.status}; nova tentativa em {wait_s}s")
+                        elif resp.status >= 400:
+                            return resp.status, resp.headers, await resp.text()
+                        elif raw:
+                            body = await resp.read()
+                            span["bytes"] = len(body)
+                            return resp.status, resp.headers, body
+                        else:
+                            body = await resp.read()
+                            span["bytes"] = len(body)
+                            return resp.status, resp.headers, json.loads(body)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            if attempt >= GITLAB_MAX_RETRIES:
+                raise
+            wait_s = review.get_retry_wait_seconds(attempt, base_seconds=2, max_seconds=30)
+            debug_log(f"GitLab {method} {path} falhou ({e}); nova tentativa em {wait_s}s")
+        await asyncio.sleep(wait_s)
+    raise RuntimeError(f"Falha após {GITLAB_MAX_RETRIES} tentativas: {method} {path}")
+
+async def post_openai(engine, payload):
+    """
+    Uma requisição de chat ao backend de revisão sob o limite adaptativo. Retorna (status, corpo
+    em texto); o provider stub responde localmente.
+    """
+    backend = get_llm_backend("review")
+    if backend["provider"] == "stub":
+        return 200, json.dumps(stub_completion(backend, payload), ensure_ascii=False)
+    timeout = aiohttp.ClientTimeout(total=review.OPENAI_TIMEOUT_SECONDS)
+    prompt_chars = sum(len(message["content"]) for message in payload["messages"])
+    async with limited_call(engine, "openai") as outcome:
+        started = time.monotonic()
+        with trace_span("openai_request", "http", tid=task_trace_id(), prompt_chars=prompt_chars) as span:
+            async with engine["session"].post(
+                backend["chat_url"], headers=llm_headers(backend), json=payload, timeout=timeout
+            ) as resp:
+                outcome["overloaded"] = resp.status in (429, 503)
+                body = await resp.text()
+                span.update(status=resp.status, response_chars=len(body))
+    if resp.status == 200:
+        review.record_openai_latency(time.monotonic() - started)
+    return resp.status, body
+
+async def post_openai_hedged(engine, payload):
+    """
+    Como main.post_openai_hedged: passado o p95 observado, dispara uma cópia da requisição
+    e fica com a primeira resposta 200; a outra é cancelada.
+    """
+    first = asyncio.ensure_future(post_openai(engine, payload))
+    if not review.OPENAI_HEDGE_ENABLED:
+        return await first
+    hedge_delay = review.get_openai_hedge_delay()
+    done, _pending = await asyncio.wait({first}, timeout=hedge_delay)
+    if done:
+        return first.result()
+
+    print(f"⏳ OpenAI acima do p95 ({hedge_delay:.1f}s); enviando requisição duplicada...")
+    pending = {first, asyncio.ensure_future(post_openai(engine, payload))}
+    last_task = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                last_task = task
+                if task.exception() is None and task.result()[0] == 200:
+                    return task.result()
+        return last_task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+
+async def openai_chat(engine, messages, temperature=0.3):
+    """Equivalente assíncrono de main.openai_chat (mesma política de retry, hedge e circuit breaker)."""
+    payload = {"model": get_llm_backend("review")["model"], "messages": messages, "temperature": temperature}
+    for attempt in range(1, review.OPENAI_MAX_RETRIES + 1):
+        if not review.openai_circuit_allows():
+            raise review.OpenAICircuitOpen("Circuit breaker da OpenAI aberto")
+        try:
+            status, body = await post_openai_hedged(engine, payload)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"❌ Erro: {str(e)[:200]}")
+            if review.record_openai_result(False):
+                raise review.OpenAICircuitOpen("OpenAI indisponível; circuit breaker aberto") from e
+            if attempt >= review.OPENAI_MAX_RETRIES:
+                raise
+            await asyncio.sleep(review.OPENAI_RETRY_WAIT_SECONDS)
+            continue
+        if status == 200:
+            review.record_openai_result(True)
+            data = json.loads(body)
+            return data["choices"][0]["message"]["content"]
+        if status == 429 or status >= 500:
+            if review.record_openai_result(False):
+                raise review.OpenAICircuitOpen(f"OpenAI retornou {status}; circuit breaker aberto")
+        if status == 429 and attempt < review.OPENAI_MAX_RETRIES:
+            print(f"⚠️  Rate limit (429). Aguardando {review.OPENAI_RETRY_WAIT_SECONDS}s...")
+            await asyncio.sleep(review.OPENAI_RETRY_WAIT_SECONDS)
+            continue
+        # Outros erros (5xx inclusive): como no main.openai_chat, nova tentativa após a espera
+        print(f"❌ Erro {status}: {body[:200]}")
+        if attempt >= review.OPENAI_MAX_RETRIES:
+            raise RuntimeError(f"OpenAI retornou {status}")
+        await asyncio.sleep(review.OPENAI_RETRY_WAIT_SECONDS)
+    raise RuntimeError(f"❌ Falha após {review.OPENAI_MAX_RETRIES} tentativas")
+
+async def list_tree_blob_ids(engine, project_id, directory, ref):
+    """Versão assíncrona de main.list_tree_blob_ids. Retorna {file_path: blob_sha}."""
+    blob_ids = {}
+    page = 1
+    while page:
+        params = {"ref": ref, "per_page": 100, "page": page}
+        if directory:
+            params["path"] = directory
+        try:
+            status, headers, items = await gitlab_request(
+                engine, "GET", f"/projects/{project_id}/repository/tree", params=params
+            )
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            debug_log(f"Falha ao listar tree path={directory} ref={ref}: {e}")
+            return blob_ids
+        if status != 200:
+            debug_log(f"Falha ao listar tree path={directory} ref={ref} status={status}")
+            return blob_ids
+        for item in items:
+            if item.get("type") == "blob":
+                blob_ids[item["path"]] = item["id"]
+        next_page = headers.get("X-Next-Page", "")
+        page = int(next_page) if next_page.strip() else None
+    return blob_ids
+
+async def get_blob_id(engine, project_id, file_path, ref):
+    """Resolve o SHA do blob; arquivos do mesmo diretório compartilham uma única listagem de tree."""
+    key = (project_id, ref, posixpath.dirname(file_path))
+    task = engine["tree_tasks"].get(key)
+    if task is None:
+        task = asyncio.ensure_future(list_tree_blob_ids(engine, project_id, key[2], ref))
+        engine["tree_tasks"][key] = task
+    return (await task).get(file_path)
+
+async def get_file_content(engine, project_id, file_path, ref):
+    """Equivalente assíncrono de main.get_file_content; o cache de blobs em disco é lido/gravado em threads."""
+    blob_id = await get_blob_id(engine, project_id, file_path, ref) if review.BLOB_CACHE_MAX_BYTES > 0 else None
+    if blob_id:
+        cached = await asyncio.to_thread(review.read_cached_blob, blob_id)
+        if cached is not None:
+            debug_log(f"Cache hit do blob {blob_id[:12]} path={file_path}")
+            return cached
+        path = f"/projects/{project_id}/repository/blobs/{blob_id}/raw"
+        params = None
+    else:
+        path = f"/projects/{project_id}/repository/files/{quote(file_path, safe='')}/raw"
+        params = {"ref": ref}
+    try:
+        status, _headers, content = await gitlab_request(engine, "GET", path, params=params, raw=True)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        debug_log(f"Falha ao buscar arquivo completo path={file_path} ref={ref}: {e}")
+        return None
+    if status != 200:
+        debug_log(f"Falha ao buscar arquivo completo path={file_path} ref={ref} status={status}")
+        return None
+    if blob_id:
+        await asyncio.to_thread(review.store_cached_blob, blob_id, content)
+    return str(content, "utf-8", errors="replace")
+
+async def get_context_file_content(engine, project_id, file_path, ref):
+    """Com MR_REVIEW_USE_ARCHIVE o snapshot (download + mmap) é lido numa thread; senão busca assíncrona."""
+    if review.USE_REPOSITORY_ARCHIVE:
+        return await asyncio.to_thread(review.get_context_file_content, project_id, file_path, ref)
+    return await get_file_content(engine, project_id, file_path, ref)
+
+async def get_path_filter(engine, project_id, ref):
+    """Equivalente assíncrono de main.get_path_filter; compartilha o cache por (projeto, head_sha)."""
+    key = (project_id, ref)
+    if key not in review._path_filters:
+        ignore_text = ""
+        if review.REVIEW_IGNORE_FILE:
+            ignore_text = await get_file_content(engine, project_id, review.REVIEW_IGNORE_FILE, ref)
+        # Outra tarefa pode ter preenchido durante o await; a primeira prevalece
+        if key not in review._path_filters:
+            review._path_filters[key] = review.build_path_filter(ignore_text) if ignore_text else None
+            if ignore_text:
+                print(f"🙈 {review.REVIEW_IGNORE_FILE}: {review._path_filters[key]['rules']} regra(s) do projeto")
+    return review._path_filters[key] or review._default_path_filter
+
+async def get_mr_metadata(engine, project_id, mr_id):
+    try:
+        status, _headers, data = await gitlab_request(
+            engine, "GET", f"/projects/{project_id}/merge_requests/{mr_id}"
+        )
+        if status != 200:
+            raise RuntimeError(f"status={status}")
+        return {
+            "title": data.get("title", ""),
+            "description": data.get("description", ""),
+            "labels": data.get("labels", []),
+            "diff_refs": data.get("diff_refs"),
+            "changes_count": data.get("changes_count", "")
+        }
+    except Exception as e:
+        debug_log(f"Falha ao buscar metadata do MR: {e}")
+        return {"title": "", "description": "", "labels": [], "diff_refs": None, "changes_count": ""}
+
+async def get_existing_comments(engine, project_id, mr_id):
+    """Retorna o set (file_path, line_number) dos comentários já existentes no MR."""
+    existing_comments = set()
+    try:
+        status, _headers, discussions = await gitlab_request(
+            engine, "GET", f"/projects/{project_id}/merge_requests/{mr_id}/discussions"
+        )
+    except Exception as e:
+        debug_log(f"⚠️  Erro ao buscar comentários existentes: {e}")
+        return existing_comments
+    if status != 200:
+        debug_log(f"⚠️  Não foi possível buscar comentários existentes: {status}")
+        return existing_comments
+    for discussion in discussions:
+        for note in discussion.get("notes", []):
+            position = note.get("position")
+            if position:
+                file_path = position.get("new_path") or position.get("old_path")
+                line_number = position.get("new_line") or position.get("old_line")
+                if file_path and line_number:
+                    existing_comments.add((file_path, line_number))
+    return existing_comments
+
+async def get_mr_diff_page(engine, project_id, mr_id, page, per_page=None):
+    """Versão assíncrona de main.get_mr_diff_page: (changes, próxima página ou None)."""
+    per_page = per_page or review.DIFFS_PAGE_SIZE
+    status, headers, changes = await gitlab_request(
+        engine, "GET", f"/projects/{project_id}/merge_requests/{mr_id}/diffs",
+        params={"page": page, "per_page": per_page}
+    )
+    if status != 200:
+        raise RuntimeError(f"Falha ao buscar diffs do MR {mr_id} (página {page}): {status}")
+    next_page = headers.get("X-Next-Page")
+    if next_page is not None:
+        next_page = int(next_page) if next_page.strip() else None
+    elif len(changes) >= per_page:
+        next_page = page + 1
+    return changes, next_page
+
+async def iter_mr_diff_pages(engine, project_id, mr_id, per_page=None):
+    """Versão assíncrona de main.iter_mr_diff_pages: gera (page, changes) página a página."""
+    page = 1
+    while page:
+        changes, next_page = await get_mr_diff_page(engine, project_id, mr_id, page, per_page)
+        if not changes:
+            return
+        yield page, changes
+        page = next_page
+
+async def resolve_collapsed_diff(engine, project_id, change, diff_refs):
+    """
+    Reconstrói localmente o diff de arquivos colapsados pelo GitLab (base e head em paralelo).
+    Retorna None se alguma das versões não puder ser baixada.
+    """
+    if change.get("diff") or not (change.get("collapsed") or change.get("too_large")):
+        return change
+    debug_log(f"Diff colapsado para {change['new_path']}; reconstruindo a partir de base/head")
+
+    async def empty():
+        return ""
+
+    old_text, new_text = await asyncio.gather(
+        empty() if change.get("new_file")
+        else get_file_content(engine, project_id, change["old_path"], diff_refs["base_sha"]),
+        empty() if change.get("deleted_file")
+        else get_context_file_content(engine, project_id, change["new_path"], diff_refs["head_sha"]),
+    )
+    if old_text is None or new_text is None:
+        print(f"⚠️  Não foi possível baixar base/head de {change['new_path']}; arquivo não será revisado")
+        return None
+    resolved = dict(change)
+    resolved["diff"] = review.build_diff_from_file_versions(old_text, new_text)
+    if not resolved["diff"]:
+        print(f"⚠️  Não foi possível reconstruir o diff colapsado de {change['new_path']}")
+    return resolved
+
+async def build_file_context(engine, project_id, change, head_sha):
+    if change.get("deleted_file", False):
+        return ""
+    file_content = await get_context_file_content(engine, project_id, change["new_path"], head_sha)
+    rendered = review.render_file_with_line_numbers(file_content)
+    if rendered and len(rendered) > review.MAX_FILE_CONTEXT_CHARS:
+        rendered = rendered[:review.MAX_FILE_CONTEXT_CHARS] + "\n...[arquivo truncado por limite de contexto]..."
+    return rendered
+
+async def comment_on_mr(engine, project_id, mr_id, old_path, new_path, line, body, diff_refs, line_type="new"):
+    """Posta o comentário com a posição calculada localmente (main.build_comment_position)."""
+    position = review.build_comment_position(old_path, new_path, line, diff_refs, line_type)
+    status, _headers, data = await gitlab_request(
+        engine, "POST", f"/projects/{project_id}/merge_requests/{mr_id}/discussions",
+        json_body={"body": body, "position": position}
+    )
+    if status == 201:
+        return data
+    print(f"Resposta da API: {data}")
+    raise RuntimeError(f"GitLab retornou {status} ao comentar")
+
+async def post_unreviewed_summary(engine, project_id, mr_id, unreviewed):
+    """Equivalente assíncrono de main.post_unreviewed_summary."""
+    try:
+        status, _headers, _data = await gitlab_request(
+            engine, "POST", f"/projects/{project_id}/merge_requests/{mr_id}/notes",
+            json_body={"body": review.format_unreviewed_summary(unreviewed)}
+        )
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        status = str(e)
+    if status != 201:
+        print(f"[!{mr_id}] ⚠️  Não foi possível postar o resumo de arquivos não revisados: {status}")
+
+async def review_change(engine, review_state, entry):
+    """Revisa um arquivo (metadados de main.describe_review_change) registrando o span no trace."""
+    with trace_span("review_change", "file", tid=task_trace_id(), path=entry["new_path"], diff_chars=entry["diff_chars"]):
+        await review_change_pipeline(engine, review_state, entry)
+
+async def review_change_pipeline(engine, review_state, entry):
+    """Pipeline de um arquivo (diff, contexto, IA, linhas, comentários), reutilizando os estágios puros do main.py."""
+    project_id = review_state["project_id"]
+    mr_id = review_state["mr_id"]
+    diff_refs = review_state["diff_refs"]
+    totals = review_state["totals"]
+    file_path = entry["new_path"]
+    prefix = f"[!{mr_id}]"
+
+    # Com a OpenAI degradada (circuito aberto) não vale nem montar o contexto
+    if not review.openai_circuit_allows():
+        review_state["deferred"].append(file_path)
+        return
+    budget = review_state["budget"]
+    stop_reason = review.get_budget_stop_reason(budget)
+    if stop_reason is not None:
+        review_state["unreviewed"].append((file_path, stop_reason))
+        return
+    started = time.monotonic()
+    change = review.load_review_change(review_state["diff_spool"], entry)
+
+    prepared = review.prepare_file_review(change, diff_refs)
+    # Hunks idênticos a outros já revisados (rebase/force-push) reaproveitam as sugestões
+    reusable = await asyncio.to_thread(review.split_reusable_hunks, change, prepared["diff_refs"])
+    reused_targets = []
+    if reusable and reusable["reused_hunks"]:
+        reused_targets = reusable["reused_targets"]
+        print(
+            f"{prefix} ♻️  {file_path}: {reusable['reused_hunks']}/{reusable['hunks']} hunk(s) sem mudança, "
+            f"{len(reused_targets)} sugestão(ões) reaproveitada(s)"
+        )
+        if not reusable["pending"]:
+            totals["arquivos"] += 1
+            await post_review_targets(engine, review_state, change, reused_targets, [])
+            return
+        change = dict(change)
+        change["diff"] = reusable["pending_diff"]
+        prepared = review.prepare_file_review(change, diff_refs)
+
+    context_coro = build_file_context(engine, project_id, change, diff_refs["head_sha"])
+    if review.SYMBOL_CONTEXT_ENABLED:
+        # O índice de símbolos usa o cliente síncrono; roda numa thread sem bloquear o loop
+        symbol_coro = asyncio.to_thread(review.build_symbol_context, project_id, diff_refs["head_sha"], change)
+        full_file_context, symbol_context = await asyncio.gather(context_coro, symbol_coro, return_exceptions=True)
+        if isinstance(symbol_context, Exception):
+            debug_log(f"Falha ao montar contexto de símbolos para {file_path}: {symbol_context}")
+            symbol_context = ""
+        if isinstance(full_file_context, Exception):
+            debug_log(f"Falha ao buscar contexto de {file_path}: {full_file_context}")
+            full_file_context = ""
+    else:
+        full_file_context, symbol_context = await context_coro, ""
+
+    file_specific_rules = review.get_file_specific_rules(file_path)
+    # Diffs muito grandes: grupos de hunks revisados em paralelo, cada um com contexto local
+    groups = []
+    if review.CHUNK_MAX_LINES > 0 and len(prepared["diff_for_ai"].splitlines()) > review.CHUNK_MAX_LINES:
+        groups = review.split_diff_into_hunk_groups(change)
+    if len(groups) > 1:
+        print(f"{prefix} ✂️  Diff grande em {file_path}: {len(groups)} grupos de hunks em paralelo")
+        requests_to_send = []
+        for group in groups:
+            group_change = dict(change)
+            group_change["diff"] = group["diff"]
+            group_prepared = review.prepare_file_review(group_change, diff_refs)
+            local_context = review.slice_file_context(full_file_context, group["new_start"], group["new_end"])
+            if file_specific_rules:
+                local_context = file_specific_rules + "\n\n" + local_context
+            requests_to_send.append((
+                review.fit_review_prompt(
+                    review_state["review_messages"], file_path, group_prepared["diff_for_ai"],
+                    local_context, symbol_context
+                ),
+                group_prepared
+            ))
+    else:
+        if file_specific_rules:
+            full_file_context = file_specific_rules + "\n\n" + full_file_context
+        requests_to_send = [(
+            review.fit_review_prompt(
+                review_state["review_messages"], file_path, prepared["diff_for_ai"],
+                full_file_context, symbol_context
+            ),
+            prepared
+        )]
+    del full_file_context
+
+    session_tokens = review.estimate_messages_tokens(review_state["review_messages"])
+    estimated_tokens = sum(
+        session_tokens + review.estimate_messages_tokens([user_msg]) + review.REVIEW_RESPONSE_TOKENS_ESTIMATE
+        for user_msg, _prepared in requests_to_send
+    )
+    stop_reason = review.get_budget_stop_reason(budget, estimated_tokens)
+    if stop_reason is not None:
+        review_state["unreviewed"].append((file_path, stop_reason))
+        return
+    # Reserva os tokens antes do await: as outras tarefas já enxergam o orçamento consumido
+    budget["tokens_used"] += estimated_tokens
+
+    results = await asyncio.gather(
+        *(
+            openai_chat(engine, review_state["review_messages"] + [user_msg], temperature=0.3)
+            for user_msg, _prepared in requests_to_send
+        ),
+        return_exceptions=True
+    )
+    reviews = []
+    for (_user_msg, request_prepared), result in zip(requests_to_send, results):
+        if isinstance(result, review.OpenAICircuitOpen):
+            continue
+        if isinstance(result, Exception):
+            print(f"{prefix} ⚠️  Erro ao analisar {file_path}: {result}")
+            continue
+        reviews.append((result, request_prepared))
+    if not reviews:
+        if any(isinstance(result, review.OpenAICircuitOpen) for result in results):
+            print(f"{prefix} ⏸️  OpenAI degradada; {file_path} adiado")
+            review_state["deferred"].append(file_path)
+        else:
+            review_state["unreviewed"].append((file_path, "falha"))
+        # Nenhuma revisão aproveitada: devolve ao orçamento os tokens reservados
+        budget["tokens_used"] -= estimated_tokens
+        return
+    review.record_budget_usage(budget, 0, time.monotonic() - started)
+    totals["arquivos"] += 1
+
+    targets, missing = review.resolve_suggestion_targets(review.merge_review_suggestions(reviews))
+    if reusable:
+        await asyncio.to_thread(review.remember_hunk_suggestions, reusable["pending"], targets, reviews)
+    await post_review_targets(engine, review_state, change, reused_targets + targets, missing)
+
+async def post_review_targets(engine, review_state, change, targets, missing):
+    """Posta as sugestões já localizadas no diff (da IA ou reaproveitadas) e atualiza os totais."""
+    project_id = review_state["project_id"]
+    mr_id = review_state["mr_id"]
+    existing_comments = review_state["existing_comments"]
+    previous_suggestions = review_state["previous_suggestions"]
+    totals = review_state["totals"]
+    file_path = change["new_path"]
+    prefix = f"[!{mr_id}]"
+
+    for line_number in missing:
+        print(f"{prefix} ⚠️ Não foi possível localizar uma linha válida no diff para a Linha {line_number}.")
+    if not targets and not missing:
+        print(f"{prefix} ✅ Nenhuma sugestão para {file_path}")
+        return
+
+    comentarios_postados = 0
+    for target in sorted(targets, key=lambda item: item["line"]):
+        target_line_type = target["line_type"]
+        target_line = target["line"]
+        suggestion_block = target["suggestion"]["block"]
+        if review.detect_duplicate_suggestion(suggestion_block, previous_suggestions):
+            totals["duplicadas"] += 1
+            continue
+        # Triagem (modelo local, cliente síncrono) numa thread, só quando configurada
+        if llm_stage_enabled("triage") and not await asyncio.to_thread(
+            review.validate_suggestion_relevance, suggestion_block, review_state["review_messages"]
+        ):
+            totals["irrelevantes"] += 1
+            continue
+        comment_key = (change["new_path"] if target_line_type == "new" else change["old_path"], target_line)
+        if comment_key in existing_comments:
+            debug_log(f"Comentário duplicado ignorado na linha {target_line}")
+            continue
+        # Reserva antes do await: outras tarefas do mesmo MR não postam a mesma sugestão/linha
+        existing_comments.add(comment_key)
+        previous_suggestions.append(suggestion_block)
+        try:
+            await comment_on_mr(
+                engine, project_id, mr_id,
+                change["old_path"], change["new_path"],
+                target_line, suggestion_block, target["diff_refs"],
+                line_type=target_line_type
+            )
+            comentarios_postados += 1
+        except Exception as e:
+            existing_comments.discard(comment_key)
+            previous_suggestions.remove(suggestion_block)
+            print(f"{prefix} ⚠️ Erro ao comentar: {e}")
+
+    total_suggestions = len(targets) + len(missing)
+    totals["sugestoes"] += total_suggestions
+    totals["comentarios"] += comentarios_postados
+    print(f"{prefix} 📊 {comentarios_postados}/{total_suggestions} sugestões postadas para {file_path}")
+
+async def review_merge_request(engine, mr_url, observacoes=""):
+    """Revisa um MR inteiro: os arquivos, ordenados por risco, são revisados concorrentemente em lotes."""
+    project_id, mr_id = review.parse_mr_url(mr_url)
+    prefix = f"[!{mr_id}]"
+    mr_metadata, existing_comments = await asyncio.gather(
+        get_mr_metadata(engine, project_id, mr_id),
+        get_existing_comments(engine, project_id, mr_id),
+    )
+    diff_refs = mr_metadata.get("diff_refs")
+    if not diff_refs:
+        print(f"{prefix} ❌ Erro: não foi possível obter os diff_refs do MR.")
+        return None
+    print(f"{prefix} 🔍 {mr_metadata.get('title', '')} ({len(existing_comments)} comentário(s) existente(s))")
+
+    changes_summary = review.generate_streaming_summary(mr_metadata)
+    review_messages = review.create_review_session(observacoes, mr_metadata)
+    review_messages.append({"role": "user", "content": changes_summary})
+    review_messages.append({"role": "assistant", "content": "Resumo registrado. Pronto para análise."})
+
+    review_state = {
+        "project_id": project_id,
+        "mr_id": mr_id,
+        "diff_refs": diff_refs,
+        "review_messages": review_messages,
+        "existing_comments": existing_comments,
+        "previous_suggestions": [],
+        "deferred": [],
+        "unreviewed": [],
+        "budget": review.create_review_budget(),
+        "totals": {
+            "sugestoes": 0,
+            "comentarios": 0,
+            "duplicadas": 0,
+            "irrelevantes": 0,
+            "arquivos": 0,
+            "ignorados_padrao": 0,
+            "ignorados_tamanho": 0,
+        },
+    }
+    totals = review_state["totals"]
+
+    path_filter = await get_path_filter(engine, project_id, diff_refs["head_sha"])
+    with review.open_diff_spool() as spool:
+        review_state["diff_spool"] = spool
+        selected = []
+        async for page, page_changes in iter_mr_diff_pages(engine, project_id, mr_id):
+            candidates = []
+            for change in page_changes:
+                if review.should_skip_file(change["new_path"], path_filter):
+                    totals["ignorados_padrao"] += 1
+                    continue
+                candidates.append(change)
+            del page_changes
+            resolved = await asyncio.gather(
+                *(resolve_collapsed_diff(engine, project_id, change, diff_refs) for change in candidates)
+            )
+            page_selected = 0
+            for candidate, change in zip(candidates, resolved):
+                if change is None:
+                    review_state["unreviewed"].append((candidate["new_path"], "download"))
+                    continue
+                if review.should_skip_by_size(change):
+                    totals["ignorados_tamanho"] += 1
+                    continue
+                selected.append(review.describe_review_change(change, spool))
+                page_selected += 1
+            debug_log(f"{prefix} Página {page}: {page_selected} arquivo(s) selecionado(s)")
+            del resolved
+
+        # Do maior para o menor risco, em lotes do tamanho da página; os limites por backend
+        # controlam o que realmente sai para a rede. O diff de cada arquivo é lido do spool no lote
+        ranked = review.prioritize_changes(selected)
+        del selected
+        review.print_review_estimate(review_state["review_messages"], ranked)
+        for start in range(0, len(ranked), review.DIFFS_PAGE_SIZE):
+            batch = ranked[start:start + review.DIFFS_PAGE_SIZE]
+            results = await asyncio.gather(
+                *(review_change(engine, review_state, entry) for entry in batch),
+                return_exceptions=True
+            )
+            for entry, result in zip(batch, results):
+                if isinstance(result, Exception):
+                    print(f"{prefix} ⚠️  Erro ao revisar {entry['new_path']}: {result}")
+
+    unreviewed = review.collect_unreviewed(review_state)
+    if unreviewed:
+        print(f"{prefix} ⏸️  {len(unreviewed)} arquivo(s) não revisado(s):")
+        for path, reason in unreviewed:
+            print(f"{prefix}    - {path} ({review.UNREVIEWED_REASONS.get(reason, reason)})")
+        if review.POST_UNREVIEWED_SUMMARY:
+            await post_unreviewed_summary(engine, project_id, mr_id, unreviewed)
+    print(
+        f"{prefix} ✨ Análise concluída: {totals['arquivos']} arquivo(s), "
+        f"{totals['sugestoes']} sugestão(ões), {totals['comentarios']} comentário(s) postado(s)"
+    )
+    return totals
+
+async def review_merge_request_traced(engine, mr_url, observacoes=""):
+    with trace_span("review_merge_request", "mr", tid=task_trace_id(), mr_url=mr_url):
+        return await review_merge_request(engine, mr_url, observacoes)
+
+async def review_merge_requests(mr_urls, observacoes=""):
+    """Revisa vários MRs concorrentemente na mesma sessão HTTP."""
+    engine = await create_engine()
+    try:
+        results = await asyncio.gather(
+            *(review_merge_request_traced(engine, url, observacoes) for url in mr_urls),
+            return_exceptions=True
+        )
+        for backend, state in get_concurrency_limits(engine).items():
+            print(
+                f"🎚️  Concorrência {backend}: limite atual {state['limit']}/{state['maximum']} "
+                f"({state['decreases']} redução(ões))"
+            )
+    finally:
+        await close_engine(engine)
+        if review.TRACE_FILE:
+            review.write_trace()
+    for url, result in zip(mr_urls, results):
+        if isinstance(result, Exception):
+            print(f"❌ Falha ao revisar {url}: {result}")
+    return results
+
+def main():
+    mr_urls = sys.argv[1:]
+    if not mr_urls:
+        mr_urls = input("🔗 Cole as URLs dos Merge Requests (separadas por espaço): ").split()
+    observacoes = os.getenv("MR_REVIEW_OBSERVACOES", "")
+    if not mr_urls:
+        print("❌ Nenhuma URL informada.")
+        return
+    asyncio.run(review_merge_requests(mr_urls, observacoes))
+
+if __name__ == "__main__":
+    main()
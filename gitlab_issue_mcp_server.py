@@ -8,49 +8,296 @@ import json
 import sys
 import os
 import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_EXCEPTION, Future, ThreadPoolExecutor, wait
+from difflib import SequenceMatcher
 from typing import Any
+from urllib.parse import quote
 import requests
+from requests.adapters import HTTPAdapter
+
+from llm_backends import get_llm_backend, llm_headers, llm_requires_api_key, stub_content
 
 # Configurações
 GITLAB_TOKEN = os.getenv("GITLAB_TOKEN")
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 GITLAB_API_URL = os.getenv("GITLAB_API_URL", "http://gitlab.dimed.com.br/api/v4")
 DEFAULT_GROUP = os.getenv("GITLAB_DEFAULT_GROUP", "grupopanvel/varejo/crm")
 DEFAULT_ASSIGNEE = os.getenv("GITLAB_DEFAULT_ASSIGNEE", "lanschau")
 
 HEADERS = {"PRIVATE-TOKEN": GITLAB_TOKEN}
 OPENAI_TIMEOUT_SECONDS = 90
+HTTP_POOL_SIZE = 16
+WARM_UP_ENABLED = os.getenv("MCP_WARM_UP", "1") == "1"
+
+_process_started_at = time.monotonic()
+_warm_up_lock = threading.Lock()
+_warm_up_started = False
+_first_tool_result_reported = False
+PROJECTS_CACHE_TTL_SECONDS = int(os.getenv("GITLAB_PROJECTS_CACHE_TTL_SECONDS", "600"))
+
+# Cache de projetos por grupo: {"projects", "index", "fetched_at"}
+_projects_cache: dict[str, dict] = {}
+_projects_refreshing: set[str] = set()
+_projects_cache_lock = threading.Lock()
+
+USERS_CACHE_TTL_SECONDS = int(os.getenv("GITLAB_USERS_CACHE_TTL_SECONDS", "3600"))
+
+# Cache username (minúsculo) -> (user_id, momento da busca)
+_user_ids_cache: dict[str, tuple[int, float]] = {}
+_user_ids_lock = threading.Lock()
+
+# Pool para consultas ao GitLab feitas em paralelo
+_lookup_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="gitlab-lookup")
+
+TOOL_WORKERS = int(os.getenv("MCP_TOOL_WORKERS", "4"))
+CANCEL_POLL_SECONDS = 0.2
+STREAM_PROGRESS_INTERVAL_SECONDS = 0.5
+VALIDATION_HEAD_START_SECONDS = float(os.getenv("MCP_VALIDATION_HEAD_START_SECONDS", "0.3"))
+BATCH_CONCURRENCY = int(os.getenv("MCP_BATCH_CONCURRENCY", "4"))
+
+GENERATION_CACHE_TTL_SECONDS = int(os.getenv("MCP_GENERATION_CACHE_TTL_SECONDS", "1800"))  # 0 desativa
+GENERATION_CACHE_SIMILARITY = float(os.getenv("MCP_GENERATION_CACHE_SIMILARITY", "1.0"))  # < 1.0 aceita contexto quase idêntico
+GENERATION_CACHE_MAX_ENTRIES = 128
+
+# Cache de gerações: (prefixo, contexto normalizado) -> {"context", "title", "description", "created_at"}
+_generation_cache: OrderedDict[tuple[str, str], dict] = OrderedDict()
+_generation_cache_lock = threading.Lock()
+
+ISSUE_INDEX_PATH = os.getenv(
+    "MCP_ISSUE_INDEX_PATH", os.path.join(os.path.expanduser("~"), ".cache", "ai-mr-review", "issues.sqlite3")
+)
+ISSUE_INDEX_SYNC_INTERVAL_SECONDS = int(os.getenv("MCP_ISSUE_INDEX_SYNC_INTERVAL_SECONDS", "300"))
+DUPLICATE_CHECK_DEFAULT = os.getenv("MCP_DUPLICATE_CHECK", "0") == "1"
+DUPLICATE_SIMILARITY_THRESHOLD = float(os.getenv("MCP_DUPLICATE_SIMILARITY", "0.6"))
+ISSUE_INDEX_STOPWORDS = {
+    "que", "para", "com", "uma", "dos", "das", "nos", "nas", "por", "como", "mais", "não", "sem",
+    "ser", "deve", "the", "and", "for", "with", "issue", "criar", "crie", "sobre"
+}
+
+# Índice local de issues: conexão SQLite compartilhada e momento da última sincronização por grupo
+_issue_index_conn: sqlite3.Connection | None = None
+_issue_index_lock = threading.Lock()
+_issue_sync_lock = threading.Lock()
+_issue_index_synced_at: dict[str, float] = {}
+
+# Dispatcher JSON-RPC: tools/call em paralelo, respostas casadas pelo id
+_tool_executor = ThreadPoolExecutor(max_workers=TOOL_WORKERS, thread_name_prefix="mcp-tool")
+_stdout_lock = threading.Lock()
+_inflight_requests: dict[Any, threading.Event] = {}
+_inflight_lock = threading.Lock()
+_request_context = threading.local()
+
+class RequestCancelled(Exception):
+    """A requisição MCP em andamento foi cancelada pelo cliente (notifications/cancelled)"""
 
 def log_error(message: str):
     """Log para stderr (não interfere com MCP stdout)"""
     print(f"ERROR: {message}", file=sys.stderr)
 
-def openai_chat(messages, temperature=0.7):
-    """Chama OpenAI para gerar conteúdo"""
-    response = requests.post(
-        "https://api.openai.com/v1/chat/completions",
-        headers={
-            "Authorization": f"Bearer {OPENAI_API_KEY}",
-            "Content-Type": "application/json"
-        },
+def log_info(message: str):
+    """Log informativo para stderr (não interfere com MCP stdout)"""
+    print(f"INFO: {message}", file=sys.stderr)
+
+def elapsed_ms_since_start() -> int:
+    return int((time.monotonic() - _process_started_at) * 1000)
+
+def create_http_session(headers: dict) -> requests.Session:
+    """Sessão HTTP com pool de conexões reaproveitado entre chamadas e threads"""
+    session = requests.Session()
+    session.headers.update(headers)
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+_gitlab_session = create_http_session(HEADERS)
+# Backend de LLM do estágio de geração de issues (LLM_ISSUE_*: OpenAI, servidor compatível ou stub)
+_issue_llm = get_llm_backend("issue")
+_openai_session = create_http_session(llm_headers(_issue_llm))
+
+def report_progress(message: str, total: int | None = None):
+    """
+    Envia notifications/progress para a requisição MCP da thread atual,
+    se o cliente informou um progressToken. Sem token, não faz nada.
+    """
+    token = getattr(_request_context, "progress_token", None)
+    if token is None:
+        return
+    _request_context.progress_value += 1
+    params = {"progressToken": token, "progress": _request_context.progress_value, "message": message}
+    if total is not None:
+        params["total"] = total
+    send_message({"jsonrpc": "2.0", "method": "notifications/progress", "params": params})
+
+def check_cancelled():
+    """Interrompe o processamento se a requisição MCP da thread atual foi cancelada"""
+    cancel_event = getattr(_request_context, "cancel_event", None)
+    if cancel_event is not None and cancel_event.is_set():
+        raise RequestCancelled()
+
+def start_in_thread(func, *args, **kwargs) -> Future:
+    """Executa func em uma thread daemon dedicada e devolve um Future com o resultado"""
+    future = Future()
+    def worker():
+        try:
+            future.set_result(func(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+    threading.Thread(target=worker, daemon=True).start()
+    return future
+
+def wait_for_futures(futures: list[Future]):
+    """
+    Aguarda todos os futures, levantando a primeira exceção assim que ela ocorrer.
+    Verifica o cancelamento da requisição MCP enquanto espera.
+    """
+    pending = set(futures)
+    while pending:
+        done, pending = wait(pending, timeout=CANCEL_POLL_SECONDS, return_when=FIRST_EXCEPTION)
+        for future in done:
+            if future.exception() is not None:
+                raise future.exception()
+        check_cancelled()
+
+def run_cancellable(func, *args, **kwargs):
+    """
+    Executa uma chamada bloqueante (HTTP) de forma que o cancelamento da requisição MCP
+    libere o worker imediatamente; o resultado da chamada abandonada é descartado.
+    """
+    cancel_event = getattr(_request_context, "cancel_event", None)
+    if cancel_event is None:
+        return func(*args, **kwargs)
+    check_cancelled()
+    
+    future = start_in_thread(func, *args, **kwargs)
+    wait_for_futures([future])
+    return future.result()
+
+def openai_chat(messages, temperature=0.7, on_partial=None):
+    """
+    Chama o LLM de geração de issues para gerar conteúdo.
+    Com on_partial, usa streaming e repassa o texto acumulado até o momento
+    (no máximo a cada STREAM_PROGRESS_INTERVAL_SECONDS).
+    """
+    if _issue_llm["provider"] == "stub":
+        content = stub_content(_issue_llm, messages)
+        if on_partial is not None:
+            on_partial(content)
+        return content
+    response = run_cancellable(
+        _openai_session.post,
+        _issue_llm["chat_url"],
         json={
-            "model": "gpt-4.1",
+            "model": _issue_llm["model"],
             "messages": messages,
-            "temperature": temperature
+            "temperature": temperature,
+            "stream": on_partial is not None
         },
-        timeout=OPENAI_TIMEOUT_SECONDS
+        timeout=OPENAI_TIMEOUT_SECONDS,
+        stream=on_partial is not None
     )
     response.raise_for_status()
-    return response.json()["choices"][0]["message"]["content"]
+    if on_partial is None:
+        return response.json()["choices"][0]["message"]["content"]
+    
+    parts = []
+    last_report = 0.0
+    try:
+        for raw_line in response.iter_lines(decode_unicode=False):
+            check_cancelled()
+            line = raw_line.decode("utf-8").strip() if raw_line else ""
+            if not line.startswith("data:"):
+                continue
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                break
+            choices = json.loads(data).get("choices") or [{}]
+            delta = choices[0].get("delta", {}).get("content")
+            if not delta:
+                continue
+            parts.append(delta)
+            now = time.monotonic()
+            if now - last_report >= STREAM_PROGRESS_INTERVAL_SECONDS:
+                on_partial("".join(parts))
+                last_report = now
+    finally:
+        response.close()
+    return "".join(parts)
+
+def normalize_context(context: str) -> str:
+    """Normaliza o contexto para chave de cache (espaços e caixa não importam)"""
+    return " ".join(context.split()).lower()
+
+def get_cached_generation(context: str, title_prefix: str) -> tuple[str, str] | None:
+    """
+    Busca uma geração anterior para o mesmo contexto e prefixo dentro do TTL.
+    Sem match exato, aceita um contexto quase idêntico (similaridade >= GENERATION_CACHE_SIMILARITY).
+    """
+    if GENERATION_CACHE_TTL_SECONDS <= 0:
+        return None
+    normalized = normalize_context(context)
+    now = time.monotonic()
+    with _generation_cache_lock:
+        for key in [k for k, entry in _generation_cache.items() if now - entry["created_at"] > GENERATION_CACHE_TTL_SECONDS]:
+            del _generation_cache[key]
+        
+        entry = _generation_cache.get((title_prefix, normalized))
+        if entry is None and GENERATION_CACHE_SIMILARITY < 1.0:
+            best_ratio = 0.0
+            for (prefix, cached_context), candidate in _generation_cache.items():
+                if prefix != title_prefix:
+                    continue
+                matcher = SequenceMatcher(None, normalized, cached_context)
+                if matcher.quick_ratio() < GENERATION_CACHE_SIMILARITY:
+                    continue
+                ratio = matcher.ratio()
+                if ratio >= GENERATION_CACHE_SIMILARITY and ratio > best_ratio:
+                    best_ratio = ratio
+                    entry = candidate
+        if entry is None:
+            return None
+        _generation_cache.move_to_end((title_prefix, entry["context"]))
+    
+    log_info("Conteúdo da issue reaproveitado do cache de geração")
+    return entry["title"], entry["description"]
+
+def store_cached_generation(context: str, title_prefix: str, title: str, description: str):
+    """Guarda uma geração bem-sucedida no cache (LRU limitado a GENERATION_CACHE_MAX_ENTRIES)"""
+    if GENERATION_CACHE_TTL_SECONDS <= 0:
+        return
+    normalized = normalize_context(context)
+    with _generation_cache_lock:
+        _generation_cache[(title_prefix, normalized)] = {
+            "context": normalized,
+            "title": title,
+            "description": description,
+            "created_at": time.monotonic()
+        }
+        _generation_cache.move_to_end((title_prefix, normalized))
+        while len(_generation_cache) > GENERATION_CACHE_MAX_ENTRIES:
+            _generation_cache.popitem(last=False)
 
-def generate_issue_content(context: str) -> tuple[str, str]:
-    """Gera título e descrição usando IA"""
+def generate_issue_content(context: str, on_partial=None, reuse_cached: bool = False) -> tuple[str, str]:
+    """
+    Gera título e descrição usando IA (on_partial recebe a resposta parcial em streaming).
+    Com reuse_cached (criação de issue) reaproveita a geração de um preview anterior; o preview
+    em si sempre gera de novo, para que pedir outra versão não devolva a mesma.
+    """
     # Detecta prefixo no contexto
     title_prefix = ""
     prefix_match = re.search(r'prefixo\s*["\']([^"\']+)["\']', context, re.IGNORECASE)
     if prefix_match:
         title_prefix = prefix_match.group(1).strip()
     
+    # Preview seguido de create com o mesmo contexto reaproveita a geração anterior
+    if reuse_cached:
+        cached = get_cached_generation(context, title_prefix)
+        if cached:
+            return cached
+    
     system_prompt = (
         "Você é um assistente especializado em criar issues técnicas bem estruturadas para GitLab.\n"
         "Seu trabalho é transformar contextos em issues claras, objetivas e bem formatadas.\n"
@@ -81,7 +328,7 @@ def generate_issue_content(context: str) -> tuple[str, str]:
         {"role": "user", "content": user_prompt}
     ]
     
-    response = openai_chat(messages, temperature=0.7)
+    response = openai_chat(messages, temperature=0.7, on_partial=on_partial)
     
     # Parse JSON response
     try:
@@ -94,15 +341,16 @@ def generate_issue_content(context: str) -> tuple[str, str]:
             response_clean = response_clean[:-3]
         
         issue_data = json.loads(response_clean.strip())
+        store_cached_generation(context, title_prefix, issue_data["title"], issue_data["description"])
         return issue_data["title"], issue_data["description"]
     except (json.JSONDecodeError, KeyError) as e:
         log_error(f"Erro ao parsear resposta da IA: {e}")
         return "Issue criada por IA", response
 
-def get_user_id(username: str) -> int:
+def fetch_user_id(username: str) -> int:
     """Busca ID do usuário no GitLab"""
     url = f"{GITLAB_API_URL}/users"
-    resp = requests.get(url, headers=HEADERS, params={"username": username}, timeout=30)
+    resp = _gitlab_session.get(url, params={"username": username}, timeout=30)
     resp.raise_for_status()
     users = resp.json()
     
@@ -111,21 +359,68 @@ def get_user_id(username: str) -> int:
     
     return users[0]["id"]
 
-def get_projects_from_group(group_path: str) -> list[dict]:
-    """Lista todos os projetos do grupo incluindo subgrupos"""
-    from urllib.parse import quote
+def get_user_id(username: str) -> int:
+    """Busca ID do usuário no GitLab (com cache em memória por USERS_CACHE_TTL_SECONDS)"""
+    key = username.lower()
+    with _user_ids_lock:
+        cached = _user_ids_cache.get(key)
+    if cached and time.monotonic() - cached[1] <= USERS_CACHE_TTL_SECONDS:
+        return cached[0]
     
+    user_id = fetch_user_id(username)
+    with _user_ids_lock:
+        _user_ids_cache[key] = (user_id, time.monotonic())
+    return user_id
+
+def submit_user_lookups(usernames: list[str]) -> dict[str, Future]:
+    """Dispara as buscas de usuários em paralelo no pool de consultas"""
+    return {username: _lookup_executor.submit(get_user_id, username) for username in dict.fromkeys(usernames)}
+
+def collect_user_ids(futures: dict[str, Future]) -> list[int]:
+    """Aguarda as buscas disparadas por submit_user_lookups e reporta todos os não encontrados"""
+    user_ids = []
+    not_found = []
+    for username, future in futures.items():
+        try:
+            user_ids.append(future.result())
+        except ValueError:
+            not_found.append(username)
+    
+    if not_found:
+        raise ValueError(f"Usuário(s) não encontrado(s) no GitLab: {', '.join(not_found)}")
+    
+    return user_ids
+
+def get_user_ids(usernames: list[str]) -> list[int]:
+    """Resolve vários usernames de uma vez, consultando o GitLab em paralelo"""
+    return collect_user_ids(submit_user_lookups(usernames))
+
+def parse_assignees(arguments: dict) -> list[str]:
+    """Lê 'assignees' (lista) e/ou 'assignee' (string, aceita vírgulas); padrão DEFAULT_ASSIGNEE"""
+    assignees = list(arguments.get("assignees") or [])
+    if arguments.get("assignee"):
+        assignees.extend(arguments["assignee"].split(","))
+    assignees = list(dict.fromkeys(a.strip().lstrip("@") for a in assignees if a and a.strip()))
+    return assignees or [DEFAULT_ASSIGNEE]
+
+def fetch_projects_from_group(group_path: str) -> list[dict]:
+    """Busca todos os projetos do grupo (incluindo subgrupos), percorrendo todas as páginas"""
     encoded_group = quote(group_path, safe='')
     url = f"{GITLAB_API_URL}/groups/{encoded_group}/projects"
     
-    resp = requests.get(
-        url, 
-        headers=HEADERS, 
-        params={"per_page": 100, "include_subgroups": "true"}, 
-        timeout=30
-    )
-    resp.raise_for_status()
-    projects = resp.json()
+    projects = []
+    page = 1
+    while page:
+        resp = _gitlab_session.get(
+            url, 
+            params={"per_page": 100, "page": page, "include_subgroups": "true"}, 
+            timeout=30
+        )
+        resp.raise_for_status()
+        batch = resp.json()
+        projects.extend(batch)
+        next_page = resp.headers.get("X-Next-Page", "")
+        page = int(next_page) if next_page.strip() and batch else None
     
     if not projects:
         raise ValueError(f"Nenhum projeto encontrado no grupo '{group_path}'")
@@ -135,14 +430,71 @@ def get_projects_from_group(group_path: str) -> list[dict]:
     
     return projects
 
+def build_project_index(projects: list[dict]) -> dict[str, dict]:
+    """Índice nome/path/path_with_namespace (minúsculo) -> projeto para busca exata"""
+    index = {}
+    for proj in projects:
+        for key in (proj.get('path_with_namespace'), proj['path'], proj['name']):
+            if key:
+                index.setdefault(key.lower(), proj)
+    return index
+
+def refresh_projects_cache(group_path: str) -> dict:
+    """Recarrega a lista de projetos do grupo e atualiza o cache"""
+    projects = fetch_projects_from_group(group_path)
+    entry = {
+        "projects": projects,
+        "index": build_project_index(projects),
+        "fetched_at": time.monotonic()
+    }
+    with _projects_cache_lock:
+        _projects_cache[group_path] = entry
+        _projects_refreshing.discard(group_path)
+    return entry
+
+def refresh_projects_cache_in_background(group_path: str):
+    """Dispara a atualização do cache em uma thread, no máximo uma por grupo"""
+    with _projects_cache_lock:
+        if group_path in _projects_refreshing:
+            return
+        _projects_refreshing.add(group_path)
+    
+    def worker():
+        try:
+            refresh_projects_cache(group_path)
+        except Exception as e:
+            log_error(f"Falha ao atualizar cache de projetos do grupo '{group_path}': {e}")
+            with _projects_cache_lock:
+                _projects_refreshing.discard(group_path)
+    
+    threading.Thread(target=worker, name=f"projects-refresh-{group_path}", daemon=True).start()
+
+def get_projects_cache_entry(group_path: str) -> dict:
+    """
+    Retorna a entrada de cache do grupo. Sem cache, busca de forma síncrona;
+    com cache expirado, devolve o valor atual e atualiza em background.
+    """
+    with _projects_cache_lock:
+        entry = _projects_cache.get(group_path)
+    if entry is None:
+        return refresh_projects_cache(group_path)
+    if time.monotonic() - entry["fetched_at"] > PROJECTS_CACHE_TTL_SECONDS:
+        refresh_projects_cache_in_background(group_path)
+    return entry
+
+def get_projects_from_group(group_path: str) -> list[dict]:
+    """Lista todos os projetos do grupo incluindo subgrupos (com cache)"""
+    return get_projects_cache_entry(group_path)["projects"]
+
 def find_project_by_name(project_name: str, group_path: str) -> dict:
     """Busca projeto por nome"""
-    projects = get_projects_from_group(group_path)
+    entry = get_projects_cache_entry(group_path)
+    projects = entry["projects"]
     
     # Busca exata
-    for proj in projects:
-        if proj['name'].lower() == project_name.lower() or proj['path'].lower() == project_name.lower():
-            return proj
+    proj = entry["index"].get(project_name.lower())
+    if proj:
+        return proj
     
     # Busca parcial
     matches = [p for p in projects if project_name.lower() in p['name'].lower() or project_name.lower() in p['path'].lower()]
@@ -156,22 +508,187 @@ def find_project_by_name(project_name: str, group_path: str) -> dict:
     available = ', '.join([p['name'] for p in projects[:10]])
     raise ValueError(f"Projeto '{project_name}' não encontrado. Disponíveis: {available}")
 
-def create_issue(project_id: int, title: str, description: str, assignee_id: int, labels: list[str]) -> dict:
+def create_issue(project_id: int, title: str, description: str, assignee_ids: list[int], labels: list[str]) -> dict:
     """Cria issue no GitLab"""
     url = f"{GITLAB_API_URL}/projects/{project_id}/issues"
     
     data = {
         "title": title,
         "description": description,
-        "assignee_ids": [assignee_id],
+        "assignee_ids": assignee_ids,
         "labels": labels
     }
     
-    resp = requests.post(url, headers=HEADERS, json=data, timeout=30)
+    resp = _gitlab_session.post(url, json=data, timeout=30)
     resp.raise_for_status()
     
     return resp.json()
 
+# ============================================================================
+# Índice local de issues (SQLite FTS5) para detecção de duplicadas
+# ============================================================================
+
+def get_issue_index() -> sqlite3.Connection:
+    """Abre (uma vez) o banco SQLite do índice de issues, criando o schema se necessário"""
+    global _issue_index_conn
+    with _issue_index_lock:
+        if _issue_index_conn is None:
+            os.makedirs(os.path.dirname(ISSUE_INDEX_PATH), exist_ok=True)
+            conn = sqlite3.connect(ISSUE_INDEX_PATH, check_same_thread=False)
+            conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS issues (
+                    id INTEGER PRIMARY KEY,
+                    group_path TEXT NOT NULL,
+                    project_id INTEGER,
+                    iid INTEGER,
+                    title TEXT,
+                    state TEXT,
+                    web_url TEXT,
+                    updated_at TEXT
+                );
+                CREATE VIRTUAL TABLE IF NOT EXISTS issues_fts USING fts5(title, description);
+                CREATE TABLE IF NOT EXISTS sync_state (group_path TEXT PRIMARY KEY, updated_after TEXT);
+                """
+            )
+            _issue_index_conn = conn
+        return _issue_index_conn
+
+def sync_issue_index(group_path: str) -> int:
+    """
+    Sincroniza incrementalmente o índice com as issues do grupo alteradas desde a última
+    sincronização (updated_after). Retorna quantas issues foram gravadas.
+    """
+    with _issue_sync_lock:
+        return sync_issue_index_locked(group_path)
+
+def sync_issue_index_locked(group_path: str) -> int:
+    """Corpo de sync_issue_index; quem chama já detém _issue_sync_lock"""
+    conn = get_issue_index()
+    with _issue_index_lock:
+        row = conn.execute("SELECT updated_after FROM sync_state WHERE group_path = ?", (group_path,)).fetchone()
+    updated_after = row[0] if row else None
+    
+    url = f"{GITLAB_API_URL}/groups/{quote(group_path, safe='')}/issues"
+    params = {"scope": "all", "state": "all", "order_by": "updated_at", "sort": "asc", "per_page": 100}
+    if updated_after:
+        params["updated_after"] = updated_after
+    
+    synced = 0
+    page = 1
+    while page:
+        params["page"] = page
+        resp = _gitlab_session.get(url, params=params, timeout=30)
+        resp.raise_for_status()
+        issues = resp.json()
+        with _issue_index_lock, conn:
+            for issue in issues:
+                conn.execute(
+                    "INSERT OR REPLACE INTO issues (id, group_path, project_id, iid, title, state, web_url, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (issue["id"], group_path, issue.get("project_id"), issue.get("iid"), issue.get("title", ""),
+                     issue.get("state", ""), issue.get("web_url", ""), issue.get("updated_at", ""))
+                )
+                conn.execute("DELETE FROM issues_fts WHERE rowid = ?", (issue["id"],))
+                conn.execute(
+                    "INSERT INTO issues_fts (rowid, title, description) VALUES (?, ?, ?)",
+                    (issue["id"], issue.get("title", ""), issue.get("description") or "")
+                )
+                updated_after = max(updated_after or "", issue.get("updated_at") or "")
+            # Marca d'água gravada por página: uma falha no meio retoma daqui
+            if updated_after:
+                conn.execute(
+                    "INSERT OR REPLACE INTO sync_state (group_path, updated_after) VALUES (?, ?)",
+                    (group_path, updated_after)
+                )
+        synced += len(issues)
+        next_page = resp.headers.get("X-Next-Page", "")
+        page = int(next_page) if next_page.strip() and issues else None
+    
+    _issue_index_synced_at[group_path] = time.monotonic()
+    if synced:
+        log_info(f"Índice de issues de '{group_path}' sincronizado: {synced} issue(s) atualizada(s)")
+    return synced
+
+def sync_issue_index_in_background(group_path: str):
+    """Dispara a sincronização do índice em uma thread (ignorada se já houver uma rodando)"""
+    # acquire não bloqueante em vez de locked(): dois chamadores não disparam duas threads
+    if not _issue_sync_lock.acquire(blocking=False):
+        return
+    
+    def worker():
+        try:
+            sync_issue_index_locked(group_path)
+        except Exception as e:
+            log_error(f"Falha ao sincronizar índice de issues de '{group_path}': {e}")
+        finally:
+            _issue_sync_lock.release()
+    
+    threading.Thread(target=worker, name="issue-index-sync", daemon=True).start()
+
+def issue_index_tokens(text: str) -> set[str]:
+    """Palavras relevantes (>= 3 letras, sem stopwords) para busca e similaridade"""
+    words = re.findall(r"\w{3,}", text.lower())
+    return {w for w in words if w not in ISSUE_INDEX_STOPWORDS and not w.isdigit()}
+
+def find_similar_issues(text: str, group_path: str, limit: int = 5, state: str = "all", wait_sync: bool = True) -> list[dict]:
+    """
+    Busca issues parecidas no índice local (FTS5/bm25). Na primeira vez o índice é
+    sincronizado de forma síncrona (se wait_sync); depois, sincroniza em background
+    a cada ISSUE_INDEX_SYNC_INTERVAL_SECONDS e responde direto do SQLite.
+    """
+    synced_at = _issue_index_synced_at.get(group_path)
+    if synced_at is None and wait_sync:
+        sync_issue_index(group_path)
+    elif synced_at is None or time.monotonic() - synced_at > ISSUE_INDEX_SYNC_INTERVAL_SECONDS:
+        sync_issue_index_in_background(group_path)
+    
+    tokens = issue_index_tokens(text)
+    if not tokens:
+        return []
+    match_query = " OR ".join(f'"{token}"' for token in sorted(tokens))
+    sql = (
+        "SELECT i.id, i.iid, i.project_id, i.title, i.state, i.web_url, issues_fts.description, bm25(issues_fts) AS rank "
+        "FROM issues_fts JOIN issues i ON i.id = issues_fts.rowid "
+        "WHERE issues_fts MATCH ? AND i.group_path = ?"
+    )
+    params = [match_query, group_path]
+    if state != "all":
+        sql += " AND i.state = ?"
+        params.append(state)
+    sql += " ORDER BY rank LIMIT ?"
+    params.append(limit)
+    
+    conn = get_issue_index()
+    with _issue_index_lock:
+        rows = conn.execute(sql, params).fetchall()
+    
+    results = []
+    for issue_id, iid, project_id, title, issue_state, web_url, description, _rank in rows:
+        issue_tokens = issue_index_tokens(f"{title} {description}")
+        # Coeficiente de Dice entre as palavras da busca e as da issue
+        overlap = 2 * len(tokens & issue_tokens) / max(1, len(tokens) + len(issue_tokens))
+        results.append({
+            "id": issue_id,
+            "iid": iid,
+            "project_id": project_id,
+            "title": title,
+            "state": issue_state,
+            "web_url": web_url,
+            "similarity": round(overlap, 2)
+        })
+    results.sort(key=lambda r: r["similarity"], reverse=True)
+    return results
+
+def format_similar_issues(similar: list[dict]) -> str:
+    lines = []
+    for issue in similar:
+        lines.append(
+            f"- [#{issue['iid']}]({issue['web_url']}) {issue['title']} "
+            f"({issue['state']}, similaridade {int(issue['similarity'] * 100)}%)"
+        )
+    return "\n".join(lines)
+
 # ============================================================================
 # MCP Protocol Implementation
 # ============================================================================
@@ -207,15 +724,86 @@ def handle_list_tools() -> dict:
                             "type": "string",
                             "description": f"Username do responsável (opcional, padrão: {DEFAULT_ASSIGNEE})"
                         },
+                        "assignees": {
+                            "type": "array",
+                            "items": {"type": "string"},
+                            "description": "Usernames dos responsáveis, para mais de um assignee (opcional)"
+                        },
                         "labels": {
                             "type": "array",
                             "items": {"type": "string"},
                             "description": "Labels da issue (opcional, padrão: ['Grupo Panvel :: Analyze', 'User Story'])"
+                        },
+                        "check_duplicates": {
+                            "type": "boolean",
+                            "description": "Verifica issues parecidas antes de criar e, se houver, não cria (opcional)"
                         }
                     },
                     "required": ["project_name", "context"]
                 }
             },
+            {
+                "name": "create_gitlab_issues_batch",
+                "description": "Cria várias issues no GitLab de uma vez (ex.: lista de user stories). A IA gera título e descrição de cada item em paralelo; retorna o resultado por item, incluindo falhas parciais.",
+                "inputSchema": {
+                    "type": "object",
+                    "properties": {
+                        "items": {
+                            "type": "array",
+                            "description": "Issues a criar; cada item tem 'context' e opcionalmente 'project_name', 'labels', 'assignee'/'assignees'",
+                            "items": {
+                                "type": "object",
+                                "properties": {
+                                    "context": {"type": "string"},
+                                    "project_name": {"type": "string"},
+                                    "labels": {"type": "array", "items": {"type": "string"}},
+                                    "assignee": {"type": "string"},
+                                    "assignees": {"type": "array", "items": {"type": "string"}}
+                                },
+                                "required": ["context"]
+                            }
+                        },
+                        "project_name": {
+                            "type": "string",
+                            "description": "Projeto padrão para itens sem 'project_name'"
+                        },
+                        "assignees": {
+                            "type": "array",
+                            "items": {"type": "string"},
+                            "description": f"Responsáveis padrão para itens sem assignee (padrão: {DEFAULT_ASSIGNEE})"
+                        },
+                        "labels": {
+                            "type": "array",
+                            "items": {"type": "string"},
+                            "description": "Labels padrão para itens sem 'labels'"
+                        }
+                    },
+                    "required": ["items"]
+                }
+            },
+            {
+                "name": "find_similar_issues",
+                "description": "Busca issues parecidas no grupo GitLab configurado (índice local, resposta em milissegundos). Use antes de criar uma issue para evitar duplicadas.",
+                "inputSchema": {
+                    "type": "object",
+                    "properties": {
+                        "query": {
+                            "type": "string",
+                            "description": "Texto ou contexto da issue a procurar"
+                        },
+                        "limit": {
+                            "type": "integer",
+                            "description": "Quantidade máxima de resultados (padrão: 5)"
+                        },
+                        "state": {
+                            "type": "string",
+                            "enum": ["all", "opened", "closed"],
+                            "description": "Filtra por estado (padrão: all)"
+                        }
+                    },
+                    "required": ["query"]
+                }
+            },
             {
                 "name": "generate_issue_content",
                 "description": "Gera apenas conteúdo (título e descrição) para uma issue usando IA, sem criar a issue",
@@ -240,6 +828,10 @@ def handle_call_tool(tool_name: str, arguments: dict) -> dict:
             return handle_list_projects()
         elif tool_name == "create_gitlab_issue":
             return handle_create_issue(arguments)
+        elif tool_name == "create_gitlab_issues_batch":
+            return handle_create_issues_batch(arguments)
+        elif tool_name == "find_similar_issues":
+            return handle_find_similar_issues(arguments)
         elif tool_name == "generate_issue_content":
             return handle_generate_content(arguments)
         else:
@@ -247,6 +839,8 @@ def handle_call_tool(tool_name: str, arguments: dict) -> dict:
                 "content": [{"type": "text", "text": f"❌ Tool desconhecida: {tool_name}"}],
                 "isError": True
             }
+    except RequestCancelled:
+        raise
     except Exception as e:
         log_error(f"Erro ao executar tool {tool_name}: {e}")
         return {
@@ -276,20 +870,56 @@ def handle_create_issue(arguments: dict) -> dict:
     """Cria issue no GitLab"""
     project_name = arguments["project_name"]
     context = arguments["context"]
-    assignee = arguments.get("assignee", DEFAULT_ASSIGNEE)
+    assignees = parse_assignees(arguments)
     labels = arguments.get("labels", ["Grupo Panvel :: Analyze", "User Story"])
     
-    # Gera título e descrição com IA
-    title, description = generate_issue_content(context)
+    # Checagem de duplicadas no índice local, antes de gastar com a IA
+    if arguments.get("check_duplicates", DUPLICATE_CHECK_DEFAULT):
+        similar = [
+            issue for issue in find_similar_issues(context, DEFAULT_GROUP, limit=5, state="opened", wait_sync=False)
+            if issue["similarity"] >= DUPLICATE_SIMILARITY_THRESHOLD
+        ]
+        if similar:
+            result = (
+                "⚠️ Issue não criada: encontrei issues abertas parecidas.\n\n"
+                f"{format_similar_issues(similar)}\n\n"
+                "Se não for duplicada, chame novamente com `check_duplicates: false`."
+            )
+            return {
+                "content": [{"type": "text", "text": result}],
+                "isError": False
+            }
+    
+    # Busca projeto e usuários em paralelo (não dependem do conteúdo gerado)
+    project_future = _lookup_executor.submit(find_project_by_name, project_name, DEFAULT_GROUP)
+    user_futures = submit_user_lookups(assignees)
+    lookups = [project_future, *user_futures.values()]
     
-    # Busca projeto
-    project = find_project_by_name(project_name, DEFAULT_GROUP)
+    report_progress("🔎 Resolvendo projeto e responsáveis...", total=4)
     
-    # Busca usuário
-    assignee_id = get_user_id(assignee)
+    # Vantagem curta para as buscas: com cache quente, projeto/usuário inválido aborta antes da IA
+    done, _pending = wait(lookups, timeout=VALIDATION_HEAD_START_SECONDS, return_when=FIRST_EXCEPTION)
+    if any(future.exception() is not None for future in done):
+        collect_user_ids(user_futures)
+        project_future.result()
+    
+    # Gera título e descrição com IA enquanto as buscas restantes terminam;
+    # uma falha de validação no meio do caminho interrompe a espera pela IA
+    report_progress("🤖 Gerando título e descrição com IA...", total=4)
+    generation_future = start_in_thread(generate_issue_content, context, reuse_cached=True)
+    wait_for_futures([*lookups, generation_future])
+    
+    project = project_future.result()
+    assignee_ids = collect_user_ids(user_futures)
+    title, description = generation_future.result()
+    
+    # Último ponto de cancelamento: depois daqui a issue é criada de fato
+    check_cancelled()
     
     # Cria issue
-    issue = create_issue(project['id'], title, description, assignee_id, labels)
+    report_progress(f"📝 Criando issue em {project['name']}...", total=4)
+    issue = create_issue(project['id'], title, description, assignee_ids, labels)
+    report_progress("✅ Issue criada", total=4)
     
     result = (
         f"✅ Issue criada com sucesso!\n\n"
@@ -297,7 +927,7 @@ def handle_create_issue(arguments: dict) -> dict:
         f"🆔 **ID:** #{issue['iid']}\n"
         f"📌 **Título:** {issue['title']}\n"
         f"📂 **Projeto:** {project['name']}\n"
-        f"👤 **Assignee:** {assignee}\n"
+        f"👤 **Assignee:** {', '.join(assignees)}\n"
         f"🏷️ **Labels:** {', '.join(labels)}"
     )
     
@@ -306,11 +936,110 @@ def handle_create_issue(arguments: dict) -> dict:
         "isError": False
     }
 
+def create_batch_item(item: dict, project_future: Future, user_futures: dict[str, Future], cancel_event) -> dict:
+    """Gera e cria uma issue do lote; roda em uma thread do pool do lote"""
+    _request_context.cancel_event = cancel_event
+    try:
+        project = project_future.result()
+        assignee_ids = collect_user_ids({u: user_futures[u] for u in item["assignees"]})
+        check_cancelled()
+        title, description = generate_issue_content(item["context"], reuse_cached=True)
+        check_cancelled()
+        issue = create_issue(project['id'], title, description, assignee_ids, item["labels"])
+        return {"issue": issue, "project": project}
+    finally:
+        _request_context.cancel_event = None
+
+def handle_create_issues_batch(arguments: dict) -> dict:
+    """Cria várias issues: resolve projetos/usuários uma vez e faz geração + criação em paralelo"""
+    default_labels = arguments.get("labels", ["Grupo Panvel :: Analyze", "User Story"])
+    items = []
+    for raw in arguments["items"]:
+        project_name = raw.get("project_name") or arguments.get("project_name")
+        if not project_name:
+            raise ValueError("Informe 'project_name' no item ou no nível do lote")
+        items.append({
+            "context": raw["context"],
+            "project_name": project_name,
+            "labels": raw.get("labels", default_labels),
+            "assignees": parse_assignees(raw) if raw.get("assignee") or raw.get("assignees") else parse_assignees(arguments)
+        })
+    if not items:
+        raise ValueError("Nenhum item informado para criação")
+    
+    # Resolução compartilhada: cada projeto e cada usuário é buscado uma única vez
+    project_futures = {
+        name: _lookup_executor.submit(find_project_by_name, name, DEFAULT_GROUP)
+        for name in dict.fromkeys(item["project_name"] for item in items)
+    }
+    user_futures = submit_user_lookups([u for item in items for u in item["assignees"]])
+    
+    cancel_event = getattr(_request_context, "cancel_event", None)
+    with ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY, thread_name_prefix="mcp-batch") as batch_executor:
+        futures = [
+            batch_executor.submit(
+                create_batch_item, item, project_futures[item["project_name"]], user_futures, cancel_event
+            )
+            for item in items
+        ]
+        report_progress(f"🤖 Gerando e criando {len(items)} issue(s)...", total=len(items) + 1)
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=CANCEL_POLL_SECONDS)
+            for _future in done:
+                report_progress(f"📝 {len(futures) - len(pending)}/{len(futures)} item(ns) processado(s)", total=len(items) + 1)
+            check_cancelled()
+    
+    lines = []
+    created = 0
+    for idx, (item, future) in enumerate(zip(items, futures), start=1):
+        try:
+            outcome = future.result()
+        except Exception as e:
+            log_error(f"Falha ao criar item {idx} do lote: {e}")
+            lines.append(f"{idx}. ❌ **Erro** ({item['project_name']}): {e}")
+            continue
+        issue = outcome["issue"]
+        created += 1
+        lines.append(
+            f"{idx}. ✅ [#{issue['iid']}]({issue['web_url']}) {issue['title']} "
+            f"— {outcome['project']['name']}"
+        )
+    
+    result = f"📦 **{created}/{len(items)} issue(s) criada(s)**\n\n" + "\n".join(lines)
+    
+    return {
+        "content": [{"type": "text", "text": result}],
+        "isError": created == 0
+    }
+
+def handle_find_similar_issues(arguments: dict) -> dict:
+    """Busca issues parecidas no índice local"""
+    query = arguments["query"]
+    limit = int(arguments.get("limit", 5))
+    state = arguments.get("state", "all")
+    
+    similar = find_similar_issues(query, DEFAULT_GROUP, limit=limit, state=state)
+    if not similar:
+        result = f"🔍 Nenhuma issue parecida encontrada no grupo '{DEFAULT_GROUP}'."
+    else:
+        result = f"🔍 Issues parecidas no grupo '{DEFAULT_GROUP}':\n\n{format_similar_issues(similar)}"
+    
+    return {
+        "content": [{"type": "text", "text": result}],
+        "isError": False
+    }
+
 def handle_generate_content(arguments: dict) -> dict:
     """Gera apenas conteúdo da issue sem criar"""
     context = arguments["context"]
     
-    title, description = generate_issue_content(context)
+    on_partial = None
+    if getattr(_request_context, "progress_token", None) is not None:
+        report_progress("🤖 Gerando título e descrição com IA...")
+        on_partial = report_progress
+    
+    title, description = generate_issue_content(context, on_partial=on_partial)
     
     result = f"📌 **TÍTULO:**\n{title}\n\n📄 **DESCRIÇÃO:**\n{description}"
     
@@ -319,8 +1048,39 @@ def handle_generate_content(arguments: dict) -> dict:
         "isError": False
     }
 
+def warm_up():
+    """
+    Aquecimento em background após o initialize: abre as conexões com GitLab e OpenAI,
+    pré-carrega a lista de projetos do grupo e o ID do assignee padrão e sincroniza o índice de issues.
+    """
+    started_at = time.monotonic()
+    tasks = {
+        "projetos": _lookup_executor.submit(get_projects_from_group, DEFAULT_GROUP),
+        "assignee padrão": _lookup_executor.submit(get_user_id, DEFAULT_ASSIGNEE),
+        "conexão LLM": _lookup_executor.submit(_openai_session.get, f"{_issue_llm['base_url']}/models", timeout=30),
+        "índice de issues": _lookup_executor.submit(sync_issue_index, DEFAULT_GROUP),
+    }
+    for name, future in tasks.items():
+        try:
+            future.result()
+        except Exception as e:
+            log_error(f"Warm-up de {name} falhou: {e}")
+    log_info(f"Warm-up concluído em {int((time.monotonic() - started_at) * 1000)} ms")
+
+def start_warm_up():
+    """Dispara o warm-up uma única vez, sem atrasar a resposta do initialize"""
+    global _warm_up_started
+    with _warm_up_lock:
+        if _warm_up_started:
+            return
+        _warm_up_started = True
+    threading.Thread(target=warm_up, name="mcp-warm-up", daemon=True).start()
+
 def handle_initialize(params: dict) -> dict:
     """Responde à inicialização do MCP"""
+    if WARM_UP_ENABLED:
+        start_warm_up()
+    log_info(f"Initialize recebido {elapsed_ms_since_start()} ms após o start")
     return {
         "protocolVersion": "2024-11-05",
         "capabilities": {
@@ -361,6 +1121,86 @@ def process_message(message: dict) -> dict:
         "result": result
     }
 
+def send_message(message: dict):
+    """Escreve uma mensagem JSON-RPC no stdout (serializado entre workers)"""
+    line = json.dumps(message)
+    with _stdout_lock:
+        print(line, flush=True)
+
+def error_response(request_id, code: int, message: str) -> dict:
+    return {
+        "jsonrpc": "2.0",
+        "id": request_id,
+        "error": {
+            "code": code,
+            "message": message
+        }
+    }
+
+def cancel_request(request_id):
+    """Marca uma requisição em andamento como cancelada"""
+    with _inflight_lock:
+        cancel_event = _inflight_requests.get(request_id)
+    if cancel_event is not None:
+        log_error(f"Cancelando requisição {request_id}")
+        cancel_event.set()
+
+def run_request(message: dict, cancel_event: threading.Event):
+    """Processa uma requisição no worker pool e responde (fora de ordem, casada pelo id)"""
+    request_id = message.get("id")
+    _request_context.cancel_event = cancel_event
+    _request_context.progress_token = ((message.get("params") or {}).get("_meta") or {}).get("progressToken")
+    _request_context.progress_value = 0
+    try:
+        response = process_message(message)
+        # Requisições canceladas não recebem resposta (spec MCP)
+        if not cancel_event.is_set():
+            send_message(response)
+            record_first_tool_result()
+    except RequestCancelled:
+        log_error(f"Requisição {request_id} cancelada pelo cliente")
+    except Exception as e:
+        log_error(f"Erro inesperado: {e}")
+        send_message(error_response(request_id, -32603, f"Internal error: {str(e)}"))
+    finally:
+        _request_context.cancel_event = None
+        _request_context.progress_token = None
+        with _inflight_lock:
+            _inflight_requests.pop(request_id, None)
+
+def record_first_tool_result():
+    """Reporta no stderr o tempo até o primeiro resultado de tool (uma vez por processo)"""
+    global _first_tool_result_reported
+    with _warm_up_lock:
+        if _first_tool_result_reported:
+            return
+        _first_tool_result_reported = True
+    log_info(f"Primeiro resultado de tool {elapsed_ms_since_start()} ms após o start")
+
+def dispatch_message(message: dict):
+    """
+    Encaminha uma mensagem recebida: tools/call vai para o worker pool,
+    as demais requisições são respondidas direto e notificações não têm resposta.
+    """
+    method = message.get("method")
+    params = message.get("params") or {}
+    
+    if method == "notifications/cancelled":
+        cancel_request(params.get("requestId"))
+        return
+    if method is None or "id" not in message:
+        # Notificações (ex.: notifications/initialized) e respostas do cliente
+        return
+    
+    if method == "tools/call":
+        cancel_event = threading.Event()
+        with _inflight_lock:
+            _inflight_requests[message["id"]] = cancel_event
+        _tool_executor.submit(run_request, message, cancel_event)
+        return
+    
+    send_message(process_message(message))
+
 def main():
     """Main loop do MCP server"""
     log_error("GitLab Issue Creator MCP Server iniciado")
@@ -369,11 +1209,13 @@ def main():
     if not GITLAB_TOKEN:
         log_error("ERRO: GITLAB_TOKEN não configurado")
         sys.exit(1)
-    if not OPENAI_API_KEY:
+    if llm_requires_api_key(_issue_llm) and not _issue_llm["api_key"]:
         log_error("ERRO: OPENAI_API_KEY não configurado")
         sys.exit(1)
     
-    # Loop principal: lê mensagens do stdin e responde no stdout
+    log_info(f"Servidor pronto em {elapsed_ms_since_start()} ms")
+    
+    # Loop principal: lê mensagens do stdin; tools/call roda em paralelo no worker pool
     for line in sys.stdin:
         try:
             line = line.strip()
@@ -381,33 +1223,17 @@ def main():
                 continue
             
             message = json.loads(line)
-            response = process_message(message)
-            
-            # Envia resposta no stdout
-            print(json.dumps(response), flush=True)
+            dispatch_message(message)
             
         except json.JSONDecodeError as e:
             log_error(f"Erro ao parsear JSON: {e}")
-            error_response = {
-                "jsonrpc": "2.0",
-                "id": None,
-                "error": {
-                    "code": -32700,
-                    "message": "Parse error"
-                }
-            }
-            print(json.dumps(error_response), flush=True)
+            send_message(error_response(None, -32700, "Parse error"))
         except Exception as e:
             log_error(f"Erro inesperado: {e}")
-            error_response = {
-                "jsonrpc": "2.0",
-                "id": None,
-                "error": {
-                    "code": -32603,
-                    "message": f"Internal error: {str(e)}"
-                }
-            }
-            print(json.dumps(error_response), flush=True)
+            send_message(error_response(None, -32603, f"Internal error: {str(e)}"))
+    
+    # stdin fechado: aguarda as tools em andamento responderem antes de sair
+    _tool_executor.shutdown(wait=True)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,117 @@
+"""
+Backends de LLM por estágio: triagem (triage), revisão (review) e geração de issues (issue).
+
+Cada estágio tem provider, base URL, modelo e chave próprios, lidos de LLM_<ESTÁGIO>_* com
+fallback para LLM_* e, para a chave, OPENAI_API_KEY. Assim a revisão pode continuar na OpenAI
+enquanto a triagem roda num servidor compatível com a API da OpenAI nos nossos nós
+(vLLM, llama.cpp server):
+
+    LLM_TRIAGE_BASE_URL=http://gpu-01:8000/v1 LLM_TRIAGE_MODEL=qwen2.5-coder-7b python main.py
+
+A triagem é opcional: só é ativada por LLM_TRIAGE_MODEL explícito (LLM_MODEL não vale para
+ela), para que um modelo global não passe a filtrar sugestões sem ninguém pedir.
+
+O provider "stub" responde localmente, sem rede, com um texto determinístico
+(LLM_<ESTÁGIO>_STUB_RESPONSE ou o padrão do estágio), para testes do pipeline.
+"""
+import hashlib
+import json
+import os
+
+OPENAI_BASE_URL = "https://api.openai.com/v1"
+
+# Modelo padrão de cada estágio; estágio sem padrão (triagem) só é ativado por LLM_<ESTÁGIO>_MODEL
+STAGE_DEFAULT_MODELS = {
+    "triage": "",
+    "review": "gpt-4o",
+    "issue": "gpt-4.1",
+}
+
+# Backends resolvidos por estágio (as variáveis de ambiente são lidas uma vez)
+_backends = {}
+
+def get_stage_setting(stage, name, default=None, inherit=True):
+    """LLM_<ESTÁGIO>_<NOME>, senão LLM_<NOME> (se inherit), senão o padrão."""
+    value = os.getenv(f"LLM_{stage.upper()}_{name}")
+    if value is None:
+        value = os.getenv(f"LLM_{name}", default) if inherit else default
+    return value
+
+def get_llm_backend(stage):
+    """Configuração do backend de um estágio: provider, base_url, chat_url, modelo e chave."""
+    if stage not in _backends:
+        provider = get_stage_setting(stage, "PROVIDER", "openai")
+        if provider not in ("openai", "stub"):
+            raise ValueError(f"Provider de LLM desconhecido para {stage}: {provider} (use openai ou stub)")
+        base_url = get_stage_setting(stage, "BASE_URL", OPENAI_BASE_URL).rstrip("/")
+        default_model = STAGE_DEFAULT_MODELS.get(stage, "")
+        _backends[stage] = {
+            "stage": stage,
+            "provider": provider,
+            "base_url": base_url,
+            "chat_url": f"{base_url}/chat/completions",
+            "model": get_stage_setting(stage, "MODEL", default_model, inherit=bool(default_model)),
+            "api_key": get_stage_setting(stage, "API_KEY", os.getenv("OPENAI_API_KEY")),
+        }
+    return _backends[stage]
+
+def llm_stage_enabled(stage):
+    """Estágio ativo quando tem modelo; para a triagem, só com LLM_TRIAGE_MODEL (inclusive no stub)."""
+    return bool(get_llm_backend(stage)["model"])
+
+def llm_requires_api_key(backend):
+    """Só a API da OpenAI exige chave; servidores locais compatíveis costumam rodar sem autenticação."""
+    return backend["provider"] == "openai" and backend["base_url"] == OPENAI_BASE_URL
+
+def llm_headers(backend):
+    headers = {"Content-Type": "application/json"}
+    if backend["api_key"]:
+        headers["Authorization"] = f"Bearer {backend['api_key']}"
+    return headers
+
+def stub_content(backend, messages):
+    """Resposta determinística do stub: a configurada para o estágio ou uma derivada do prompt."""
+    configured = get_stage_setting(backend["stage"], "STUB_RESPONSE")
+    if configured is not None:
+        return configured
+    if backend["stage"] == "triage":
+        return "SIM"
+    if backend["stage"] == "issue":
+        digest = hashlib.sha256(json.dumps(messages, ensure_ascii=False).encode("utf-8")).hexdigest()[:8]
+        return json.dumps({
+            "title": f"Issue gerada pelo stub {digest}",
+            "description": messages[-1]["content"][:500] if messages else "",
+        }, ensure_ascii=False)
+    return "Nenhum problema encontrado."
+
+def stub_completion(backend, payload):
+    """Corpo no formato de chat/completions da OpenAI, gerado localmente pelo stub."""
+    return {
+        "id": "stub",
+        "object": "chat.completion",
+        "model": payload.get("model") or "stub",
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": stub_content(backend, payload["messages"])},
+            "finish_reason": "stop",
+        }],
+    }
+
+class StubResponse:
+    """Resposta HTTP mínima (interface do requests usada no projeto) para o provider stub."""
+
+    def __init__(self, data):
+        self.status_code = 200
+        self.headers = {}
+        self.content = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.text = self.content.decode("utf-8")
+        self._data = data
+
+    def json(self):
+        return self._data
+
+    def raise_for_status(self):
+        return None
+
+    def close(self):
+        return None
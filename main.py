@@ -1,14 +1,40 @@
 import requests
+import functools
+import hashlib
+import json
+import math
+import mmap
 import os
+import posixpath
 import re
+import struct
+import sys
+import tempfile
+import threading
 import time
-from difflib import SequenceMatcher
+import zipfile
+import zlib
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from difflib import SequenceMatcher, unified_diff
 from urllib.parse import quote
 from unidiff import PatchSet
 
+from llm_backends import StubResponse, get_llm_backend, llm_headers, llm_stage_enabled, stub_completion
+
+try:
+    import resource  # Pico de memória (RSS) nos spans do trace; indisponível no Windows
+except ImportError:
+    resource = None
+
+try:
+    import tiktoken  # Contagem exata de tokens; opcional (sem ele usa a estimativa local)
+except ImportError:
+    tiktoken = None
+
 # Configure suas variáveis
 GITLAB_TOKEN = os.getenv("GITLAB_TOKEN")
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 GITLAB_API_URL = "http://gitlab.dimed.com.br/api/v4"
 
 HEADERS = {
@@ -24,6 +50,119 @@ GITLAB_TIMEOUT_SECONDS = int(os.getenv("MR_REVIEW_GITLAB_TIMEOUT_SECONDS", "30")
 REVIEW_MODE = os.getenv("MR_REVIEW_MODE", "balanced")  # strict, balanced, lenient
 MIN_DIFF_SIZE_TO_REVIEW = int(os.getenv("MR_REVIEW_MIN_DIFF_SIZE", "50"))  # Pular diffs muito pequenos
 DELAY_BETWEEN_CALLS = float(os.getenv("MR_REVIEW_DELAY_SECONDS", "3.0"))  # Delay entre chamadas
+DIFFS_PAGE_SIZE = int(os.getenv("MR_REVIEW_DIFFS_PAGE_SIZE", "20"))  # Arquivos por página do endpoint /diffs
+BLOB_CACHE_DIR = os.getenv(
+    "MR_REVIEW_BLOB_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "ai-mr-review", "blobs")
+)
+BLOB_CACHE_MAX_BYTES = int(os.getenv("MR_REVIEW_BLOB_CACHE_MAX_MB", "512")) * 1024 * 1024  # 0 desativa o cache
+# Sugestões por hunk (fingerprint do conteúdo) reaproveitadas após rebase/force-push
+SUGGESTION_STORE_DIR = os.getenv(
+    "MR_REVIEW_SUGGESTION_STORE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "ai-mr-review", "suggestions")
+)
+REUSE_HUNK_SUGGESTIONS = os.getenv("MR_REVIEW_REUSE_SUGGESTIONS", "1") == "1"
+USE_REPOSITORY_ARCHIVE = os.getenv("MR_REVIEW_USE_ARCHIVE", "0") == "1"  # Um download do repo em vez de N arquivos
+ARCHIVE_DIR = os.getenv(
+    "MR_REVIEW_ARCHIVE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "ai-mr-review", "archives")
+)
+ARCHIVE_KEEP = int(os.getenv("MR_REVIEW_ARCHIVE_KEEP", "5"))
+
+# Total em bytes do cache de blobs (None até a primeira gravação do processo)
+_blob_cache_size = {"bytes": None}
+_blob_cache_lock = threading.Lock()
+
+# Snapshots do repositório abertos por (projeto, sha), em LRU limitado a ARCHIVE_KEEP (mesmo limite
+# dos archives em disco); o lock por chave garante um download só
+_repository_snapshots = OrderedDict()
+_repository_snapshot_locks = {}
+_repository_snapshots_lock = threading.Lock()
+
+# SHA do blob por (projeto, ref, diretório), resolvido via API de tree (LRU limitado, compartilhado entre threads)
+TREE_BLOB_IDS_MAX_ENTRIES = 512
+_tree_blob_ids = OrderedDict()
+_tree_blob_ids_lock = threading.Lock()
+OPENAI_HEDGE_ENABLED = os.getenv("MR_REVIEW_OPENAI_HEDGE", "1") == "1"  # Duplica chamadas lentas (acima do p95)
+OPENAI_HEDGE_DEFAULT_DELAY_SECONDS = float(os.getenv("MR_REVIEW_OPENAI_HEDGE_DELAY_SECONDS", "45"))  # Antes de haver amostras
+OPENAI_HEDGE_MIN_SAMPLES = 5
+OPENAI_CIRCUIT_FAILURES = int(os.getenv("MR_REVIEW_OPENAI_CIRCUIT_FAILURES", "3"))  # Falhas seguidas que abrem o circuito
+OPENAI_CIRCUIT_COOLDOWN_SECONDS = int(os.getenv("MR_REVIEW_OPENAI_CIRCUIT_COOLDOWN_SECONDS", "120"))
+
+# Latências recentes das chamadas à OpenAI (base do p95 para o hedge)
+_openai_latencies = deque(maxlen=200)
+_openai_hedge_executor = ThreadPoolExecutor(max_workers=4)
+
+# Circuit breaker da OpenAI: closed -> open (falha rápida) -> half_open (uma nova tentativa)
+# (compartilhado pelas threads de chunk e de hedge; só é lido/alterado com _openai_circuit_lock)
+_openai_circuit = {"state": "closed", "failures": 0, "opened_at": 0.0}
+_openai_circuit_lock = threading.Lock()
+
+SYMBOL_CONTEXT_ENABLED = os.getenv("MR_REVIEW_SYMBOL_CONTEXT", "1") == "1"  # Assinaturas de classes relacionadas
+SYMBOL_CONTEXT_MAX_TOKENS = int(os.getenv("MR_REVIEW_SYMBOL_CONTEXT_MAX_TOKENS", "1200"))
+
+# Índices de símbolos Java por (projeto, head_sha)
+_java_symbol_indexes = {}
+
+JAVA_TYPE_RE = re.compile(r"\b(class|interface|enum|record)\s+([A-Za-z_]\w*)")
+JAVA_METHOD_RE = re.compile(r"^(?:[\w.<>\[\]?,\s]+?\s)?(\w+)\s*\(.*\)(?:\s*throws\s+[\w.,\s]+)?$")
+JAVA_FIELD_RE = re.compile(r"^([\w.<>\[\]?,\s]+?)\s+(\w+)$")
+JAVA_NON_MEMBER_WORDS = {
+    "return", "new", "throw", "else", "if", "for", "while", "switch", "case", "catch", "try",
+    "do", "synchronized", "assert", "super", "this", "package", "import"
+}
+
+MODEL_CONTEXT_TOKENS = int(os.getenv("MR_REVIEW_MODEL_CONTEXT_TOKENS", "128000"))  # Janela do gpt-4o
+RESPONSE_TOKENS_RESERVE = int(os.getenv("MR_REVIEW_RESPONSE_TOKENS_RESERVE", "4096"))  # Espaço reservado para a resposta
+TOKENIZER_ENCODING = os.getenv("MR_REVIEW_TOKENIZER_ENCODING", "o200k_base")
+# O tiktoken baixa o arquivo BPE no primeiro uso (sem timeout); acima disso usa a estimativa local
+TOKENIZER_LOAD_TIMEOUT_SECONDS = float(os.getenv("MR_REVIEW_TOKENIZER_LOAD_TIMEOUT_SECONDS", "10"))
+PRICE_INPUT_PER_MTOK = float(os.getenv("MR_REVIEW_PRICE_INPUT_PER_MTOK", "2.50"))  # US$ por 1M tokens de entrada
+PRICE_OUTPUT_PER_MTOK = float(os.getenv("MR_REVIEW_PRICE_OUTPUT_PER_MTOK", "10.00"))  # US$ por 1M tokens de saída
+ESTIMATED_TOKENS_PER_FILE_LINE = 10  # Para estimar o contexto antes de baixar o arquivo
+REVIEW_PROMPT_OVERHEAD_TOKENS = 350  # Instruções fixas do prompt de cada arquivo
+HUNK_HEADER_RE = re.compile(r"^@@ -\d+(?:,\d+)? \+(\d+)(?:,(\d+))? @@", re.MULTILINE)
+TOKEN_PIECE_RE = re.compile(r"[A-Za-z]+|\d{1,3}|[^\W\d_A-Za-z]+|\s+|[^\w\s]+|_")
+METHOD_SLICE_MAX_LINES = 150  # Tamanho máximo de um trecho de método no contexto reduzido
+CONTEXT_LINE_RE = re.compile(r"^L(\d+) \| ")  # Linha do arquivo renderizado com numeração
+CONTROL_BLOCK_RE = re.compile(r"^\s*(?:}\s*)?(?:if|else|for|while|do|try|catch|finally|switch|synchronized)\b")
+DIFF_ADDED_LINE_RE = re.compile(r"^NEW\s+(\d+) \|")  # Linha adicionada no diff numerado
+DIFF_NEW_LINE_RE = re.compile(r"^NEW\s+(\d+)\s")  # Linha NEW (adicionada ou contexto) do diff numerado
+
+# Encoder do tiktoken (None = ainda não carregado, False = indisponível)
+_token_encoder = None
+
+CHUNK_MAX_LINES = int(os.getenv("MR_REVIEW_CHUNK_MAX_LINES", "400"))  # Diff numerado maior que isso é revisado em grupos de hunks; 0 desativa
+CHUNK_CONTEXT_LINES = int(os.getenv("MR_REVIEW_CHUNK_CONTEXT_LINES", "40"))  # Linhas do arquivo ao redor de cada grupo
+CHUNK_WORKERS = int(os.getenv("MR_REVIEW_CHUNK_WORKERS", "4"))  # Grupos de hunks revisados em paralelo
+_chunk_executor = ThreadPoolExecutor(max_workers=max(1, CHUNK_WORKERS))
+
+REVIEW_DEADLINE_SECONDS = int(os.getenv("MR_REVIEW_DEADLINE_SECONDS", "0"))  # Tempo máximo da revisão; 0 = sem limite
+REVIEW_TOKEN_BUDGET = int(os.getenv("MR_REVIEW_TOKEN_BUDGET", "0"))  # Tokens (estimados) para o MR inteiro; 0 = sem limite
+REVIEW_RESPONSE_TOKENS_ESTIMATE = 600  # Resposta típica da IA por arquivo
+POST_UNREVIEWED_SUMMARY = os.getenv("MR_REVIEW_POST_UNREVIEWED_SUMMARY", "1") == "1"
+
+# Peso de risco por tipo de arquivo (mesmos tipos de get_file_specific_rules)
+FILE_TYPE_RISK = {
+    "repository": 3.0,
+    "sql": 3.0,
+    "service": 2.5,
+    "controller": 2.0,
+    "config": 2.0,
+    "test": 0.5,
+}
+SQL_RISK_RE = re.compile(
+    r"\b(select|insert|update|delete|join|where)\b.*\b(from|into|set|on)\b|@Query|createQuery|nativeQuery|jdbcTemplate",
+    re.IGNORECASE
+)
+SECURITY_RISK_RE = re.compile(
+    r"password|senha|secret|token|credential|authoriz|authenticat|@PreAuthorize|@Secured|permission|"
+    r"crypt|Runtime\.getRuntime|ProcessBuilder|ObjectInputStream|deserializ|setAccessible",
+    re.IGNORECASE
+)
+
+TRACE_FILE = os.getenv("MR_REVIEW_TRACE_FILE", "")  # Grava um trace da execução (Chrome trace JSON); vazio desativa
+
+# Eventos do trace no formato Chrome trace (abre no Perfetto/speedscope/chrome://tracing)
+_trace_events = []
+_trace_started_at = time.perf_counter()
 
 # Padrões de arquivos que devem ser ignorados na análise
 SKIP_FILES_PATTERNS = [
@@ -36,10 +175,79 @@ SKIP_FILES_PATTERNS = [
     r'\.generated\.',
 ]
 
+# Regras por projeto (sintaxe .gitignore) na raiz do repositório; vazio desativa
+REVIEW_IGNORE_FILE = os.getenv("MR_REVIEW_IGNORE_FILE", ".mrreviewignore")
+
+# Filtros de caminho compilados por (projeto, head_sha); None = só os padrões embutidos
+_path_filters = {}
+
 def debug_log(message):
     if DEBUG_MODE:
         print(f"DEBUG: {message}")
 
+def trace_now_us():
+    return int((time.perf_counter() - _trace_started_at) * 1_000_000)
+
+def get_peak_rss_kb():
+    """Pico de memória residente do processo em KB (None se indisponível)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reporta em bytes, Linux em KB
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+@contextmanager
+def trace_span(name, category, tid=None, **args):
+    """
+    Span aninhado do trace (evento "X"): duração, args livres (tamanhos, status) e pico de memória.
+    O corpo pode completar os args pelo dict retornado. Sem MR_REVIEW_TRACE_FILE não registra nada.
+    """
+    if not TRACE_FILE:
+        yield args
+        return
+    started = trace_now_us()
+    try:
+        yield args
+    except BaseException as e:
+        args["error"] = type(e).__name__
+        raise
+    finally:
+        ended = trace_now_us()
+        peak_rss_kb = get_peak_rss_kb()
+        args["peak_rss_kb"] = peak_rss_kb
+        thread_id = tid if tid is not None else threading.get_ident()
+        _trace_events.append({
+            "name": name, "cat": category, "ph": "X", "ts": started, "dur": ended - started,
+            "pid": os.getpid(), "tid": thread_id, "args": args
+        })
+        if peak_rss_kb is not None:
+            _trace_events.append({
+                "name": "peak_rss_kb", "ph": "C", "ts": ended, "pid": os.getpid(),
+                "args": {"peak_rss_kb": peak_rss_kb}
+            })
+
+def traced(category, name=None):
+    """Decorator: registra cada chamada da função como um span do trace."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not TRACE_FILE:
+                return func(*args, **kwargs)
+            with trace_span(name or func.__name__, category):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def write_trace(path=None):
+    """Grava os spans coletados como Chrome trace JSON."""
+    path = os.path.expanduser(path or TRACE_FILE)
+    try:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": _trace_events, "displayTimeUnit": "ms"}, f)
+        print(f"🧭 Trace gravado em {path} ({len(_trace_events)} eventos) - abra no Perfetto ou speedscope")
+    except OSError as e:
+        print(f"⚠️  Não foi possível gravar o trace em {path}: {e}")
+
 def format_line_no(line_no):
     return f"{line_no:>6}" if line_no is not None else "  None"
 
@@ -54,20 +262,332 @@ def get_retry_wait_seconds(attempt, response=None, base_seconds=15, max_seconds=
                 pass
     return min(max_seconds, base_seconds * attempt)
 
+@traced("http")
+def list_tree_blob_ids(project_id, directory, ref):
+    """
+    Lista os blobs de um diretório do repositório (não recursivo) via API de tree.
+    Retorna {file_path: blob_sha}.
+    """
+    url = f"{GITLAB_API_URL}/projects/{project_id}/repository/tree"
+    blob_ids = {}
+    page = 1
+    while page:
+        params = {"ref": ref, "per_page": 100, "page": page}
+        if directory:
+            params["path"] = directory
+        try:
+            resp = requests.get(url, headers=HEADERS, params=params, timeout=GITLAB_TIMEOUT_SECONDS)
+        except requests.RequestException as e:
+            debug_log(f"Falha ao listar tree path={directory} ref={ref}: {e}")
+            return blob_ids
+        if resp.status_code != 200:
+            debug_log(f"Falha ao listar tree path={directory} ref={ref} status={resp.status_code}")
+            return blob_ids
+        for item in resp.json():
+            if item.get("type") == "blob":
+                blob_ids[item["path"]] = item["id"]
+        next_page = resp.headers.get("X-Next-Page", "")
+        page = int(next_page) if next_page.strip() else None
+    return blob_ids
+
+def get_blob_id(project_id, file_path, ref):
+    """Resolve o SHA do blob de um arquivo em um ref (uma listagem de tree por diretório)."""
+    directory = posixpath.dirname(file_path)
+    key = (project_id, ref, directory)
+    with _tree_blob_ids_lock:
+        blob_ids = _tree_blob_ids.get(key)
+        if blob_ids is not None:
+            _tree_blob_ids.move_to_end(key)
+    if blob_ids is None:
+        # A listagem roda fora do lock; duas threads no mesmo diretório listam em dobro, sem corromper o cache
+        blob_ids = list_tree_blob_ids(project_id, directory, ref)
+        with _tree_blob_ids_lock:
+            _tree_blob_ids[key] = blob_ids
+            while len(_tree_blob_ids) > TREE_BLOB_IDS_MAX_ENTRIES:
+                _tree_blob_ids.popitem(last=False)
+    return blob_ids.get(file_path)
+
+def blob_cache_path(blob_id):
+    return os.path.join(BLOB_CACHE_DIR, blob_id[:2], blob_id)
+
+def read_cached_blob(blob_id):
+    """
+    Lê um blob do cache em disco via mmap: o str é decodificado direto do mapeamento (via
+    memoryview), sem cópia intermediária em bytes. Retorna None se não existir.
+    """
+    path = blob_cache_path(blob_id)
+    try:
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                data = ""
+            else:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as view:
+                    data = str(view, "utf-8", errors="replace")
+    except FileNotFoundError:
+        return None
+    except OSError as e:
+        debug_log(f"Falha ao ler blob {blob_id} do cache: {e}")
+        return None
+    # Atualiza mtime para a política LRU
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return data
+
+def store_cached_blob(blob_id, content):
+    """
+    Grava um blob no cache em disco (escrita atômica) e mantém o total em bytes; a varredura
+    do diretório para despejo só roda quando o total passa de BLOB_CACHE_MAX_BYTES.
+    """
+    path = blob_cache_path(blob_id)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            replaced_size = os.path.getsize(path)
+        except OSError:
+            replaced_size = 0
+        # pid + thread: blobs iguais (mesmo SHA) podem ser gravados por várias threads ao mesmo tempo
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        debug_log(f"Falha ao gravar blob {blob_id} no cache: {e}")
+        return
+    with _blob_cache_lock:
+        if _blob_cache_size["bytes"] is None:
+            # Primeira gravação do processo: o total vem de uma varredura (que já inclui este blob)
+            _blob_cache_size["bytes"] = scan_blob_cache()[1]
+        else:
+            _blob_cache_size["bytes"] += len(content) - replaced_size
+        if _blob_cache_size["bytes"] > BLOB_CACHE_MAX_BYTES:
+            _blob_cache_size["bytes"] = evict_blob_cache()
+
+def scan_blob_cache():
+    """Lista os blobs do cache: ([(mtime, tamanho, path)], total em bytes)."""
+    entries = []
+    total = 0
+    for root, _dirs, files in os.walk(BLOB_CACHE_DIR):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+    return entries, total
+
+def evict_blob_cache():
+    """Remove os blobs menos usados recentemente até o cache caber em BLOB_CACHE_MAX_BYTES. Retorna o total."""
+    entries, total = scan_blob_cache()
+    if total <= BLOB_CACHE_MAX_BYTES:
+        return total
+    entries.sort()
+    for _mtime, size, path in entries:
+        if total <= BLOB_CACHE_MAX_BYTES:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            continue
+    debug_log(f"Cache de blobs reduzido para {total} bytes")
+    return total
+
 def get_file_content(project_id, file_path, ref):
     """
     Busca o conteúdo bruto de um arquivo no GitLab em um commit/ref específico.
+    O conteúdo é cacheado em disco pelo SHA do blob; o download só acontece em cache miss.
+    Retorna None se o arquivo não puder ser baixado (diferente de um arquivo vazio).
     """
-    encoded_file_path = quote(file_path, safe="")
-    url = f"{GITLAB_API_URL}/projects/{project_id}/repository/files/{encoded_file_path}/raw"
-    resp = requests.get(url, headers=HEADERS, params={"ref": ref}, timeout=GITLAB_TIMEOUT_SECONDS)
+    blob_id = get_blob_id(project_id, file_path, ref) if BLOB_CACHE_MAX_BYTES > 0 else None
+    if blob_id:
+        cached = read_cached_blob(blob_id)
+        if cached is not None:
+            debug_log(f"Cache hit do blob {blob_id[:12]} path={file_path}")
+            return cached
+        url = f"{GITLAB_API_URL}/projects/{project_id}/repository/blobs/{blob_id}/raw"
+        params = None
+    else:
+        encoded_file_path = quote(file_path, safe="")
+        url = f"{GITLAB_API_URL}/projects/{project_id}/repository/files/{encoded_file_path}/raw"
+        params = {"ref": ref}
+    with trace_span("get_file_content", "http", path=file_path) as span:
+        resp = requests.get(url, headers=HEADERS, params=params, timeout=GITLAB_TIMEOUT_SECONDS)
+        span.update(status=resp.status_code, bytes=len(resp.content))
     if resp.status_code != 200:
         debug_log(
             f"Falha ao buscar arquivo completo path={file_path} ref={ref} status={resp.status_code}"
         )
-        return ""
+        return None
+    if blob_id:
+        store_cached_blob(blob_id, resp.content)
+        return str(resp.content, "utf-8", errors="replace")
     return resp.text
 
+@traced("http")
+def download_repository_archive(project_id, sha):
+    """
+    Baixa o archive (zip) do repositório no SHA informado, uma única vez por projeto/SHA.
+    Mantém apenas os ARCHIVE_KEEP archives mais recentes em ARCHIVE_DIR. Retorna o caminho ou None.
+    """
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    safe_project = re.sub(r"[^A-Za-z0-9_.-]", "_", str(project_id))
+    archive_path = os.path.join(ARCHIVE_DIR, f"{safe_project}-{sha}.zip")
+    if os.path.exists(archive_path):
+        os.utime(archive_path)
+        return archive_path
+
+    url = f"{GITLAB_API_URL}/projects/{project_id}/repository/archive.zip"
+    tmp_path = f"{archive_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    print(f"📦 Baixando snapshot do repositório em {sha[:12]}...")
+    try:
+        with requests.get(
+            url, headers=HEADERS, params={"sha": sha}, timeout=GITLAB_TIMEOUT_SECONDS, stream=True
+        ) as resp:
+            if resp.status_code != 200:
+                debug_log(f"Falha ao baixar archive sha={sha} status={resp.status_code}")
+                return None
+            with open(tmp_path, "wb") as f:
+                for chunk in resp.iter_content(chunk_size=1024 * 1024):
+                    f.write(chunk)
+        os.replace(tmp_path, archive_path)
+    except (requests.RequestException, OSError) as e:
+        debug_log(f"Falha ao baixar archive sha={sha}: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return None
+
+    archives = sorted(
+        (os.path.join(ARCHIVE_DIR, name) for name in os.listdir(ARCHIVE_DIR) if name.endswith(".zip")),
+        key=os.path.getmtime,
+        reverse=True
+    )
+    for old_archive in archives[ARCHIVE_KEEP:]:
+        try:
+            os.remove(old_archive)
+        except OSError:
+            pass
+    return archive_path
+
+def get_repository_snapshot(project_id, sha):
+    """
+    Abre (uma vez por execução) o archive do repositório via mmap e indexa seus arquivos por path.
+    Retorna um dict com o índice de entradas e o mmap subjacente, ou None se indisponível.
+    Threads concorrentes pedindo o mesmo (projeto, sha) esperam o primeiro download.
+    """
+    key = (project_id, sha)
+    with _repository_snapshots_lock:
+        if key in _repository_snapshots:
+            _repository_snapshots.move_to_end(key)
+            return _repository_snapshots[key]
+        key_lock = _repository_snapshot_locks.setdefault(key, threading.Lock())
+    with key_lock:
+        with _repository_snapshots_lock:
+            if key in _repository_snapshots:
+                return _repository_snapshots[key]
+        snapshot = open_repository_snapshot(project_id, sha)
+        with _repository_snapshots_lock:
+            _repository_snapshots[key] = snapshot
+            evict_repository_snapshots()
+    return snapshot
+
+def evict_repository_snapshots():
+    """
+    Descarta os snapshots menos usados além de ARCHIVE_KEEP (chamar com _repository_snapshots_lock).
+    O mmap e o arquivo são fechados na hora se ninguém estiver lendo, senão pelo último leitor.
+    """
+    while len(_repository_snapshots) > ARCHIVE_KEEP:
+        key, snapshot = _repository_snapshots.popitem(last=False)
+        _repository_snapshot_locks.pop(key, None)
+        if snapshot is None:
+            continue
+        snapshot["evicted"] = True
+        if snapshot["readers"] == 0:
+            close_repository_snapshot(snapshot)
+
+def close_repository_snapshot(snapshot):
+    """Fecha o mmap e o arquivo de um snapshot."""
+    snapshot["mmap"].close()
+    snapshot["file"].close()
+
+def open_repository_snapshot(project_id, sha):
+    """Baixa o archive do (projeto, sha) e indexa suas entradas; None se indisponível."""
+    snapshot = None
+    archive_path = download_repository_archive(project_id, sha)
+    if archive_path:
+        archive_file = mapped = None
+        try:
+            archive_file = open(archive_path, "rb")
+            mapped = mmap.mmap(archive_file.fileno(), 0, access=mmap.ACCESS_READ)
+            # Só o diretório central é lido aqui; o conteúdo é lido direto do mmap sob demanda
+            with zipfile.ZipFile(mapped) as archive:
+                infos = archive.infolist()
+            # O GitLab coloca tudo dentro de uma pasta "<projeto>-<sha>-<sha>/"
+            entries = {}
+            for info in infos:
+                if info.is_dir() or "/" not in info.filename:
+                    continue
+                entries[info.filename.split("/", 1)[1]] = info
+            snapshot = {"file": archive_file, "mmap": mapped, "entries": entries, "readers": 0, "evicted": False}
+            debug_log(f"Snapshot do repositório indexado com {len(entries)} arquivo(s)")
+        except (OSError, ValueError, zipfile.BadZipFile) as e:
+            debug_log(f"Falha ao abrir archive {archive_path}: {e}")
+            if mapped is not None:
+                mapped.close()
+            if archive_file is not None:
+                archive_file.close()
+            snapshot = None
+    return snapshot
+
+def read_snapshot_file(snapshot, file_path):
+    """Lê um arquivo do snapshot. Retorna None se o arquivo não estiver no archive ou o snapshot já foi fechado."""
+    info = snapshot["entries"].get(file_path)
+    if info is None:
+        return None
+    with _repository_snapshots_lock:
+        # Snapshot já descartado do LRU e fechado: quem chamou cai no download individual
+        if snapshot["evicted"] and snapshot["readers"] == 0:
+            return None
+        snapshot["readers"] += 1
+    try:
+        return read_snapshot_entry(snapshot["mmap"], info, file_path)
+    finally:
+        with _repository_snapshots_lock:
+            snapshot["readers"] -= 1
+            if snapshot["evicted"] and snapshot["readers"] == 0:
+                close_repository_snapshot(snapshot)
+
+def read_snapshot_entry(mapped, info, file_path):
+    """Lê e descomprime uma entrada do zip direto do mmap."""
+    # Cabeçalho local do zip: 30 bytes fixos + nome + campo extra, seguidos dos dados
+    offset = info.header_offset
+    name_len, extra_len = struct.unpack("<HH", mapped[offset + 26:offset + 30])
+    start = offset + 30 + name_len + extra_len
+    with memoryview(mapped)[start:start + info.compress_size] as data:
+        if info.compress_type == zipfile.ZIP_STORED:
+            return str(data, "utf-8", errors="replace")
+        if info.compress_type == zipfile.ZIP_DEFLATED:
+            return str(zlib.decompress(data, -15), "utf-8", errors="replace")
+    debug_log(f"Compressão não suportada no archive para {file_path}: {info.compress_type}")
+    return None
+
+def get_context_file_content(project_id, file_path, ref):
+    """
+    Conteúdo de arquivo para o contexto da IA: usa o snapshot do repositório quando
+    MR_REVIEW_USE_ARCHIVE está ativo, senão (ou em falha) busca o arquivo individualmente.
+    Retorna None se o arquivo não puder ser obtido.
+    """
+    if USE_REPOSITORY_ARCHIVE:
+        snapshot = get_repository_snapshot(project_id, ref)
+        if snapshot is not None:
+            content = read_snapshot_file(snapshot, file_path)
+            if content is not None:
+                return content
+    return get_file_content(project_id, file_path, ref)
+
 def render_file_with_line_numbers(file_text):
     """
     Renderiza arquivo completo com numeração de linha para dar contexto à IA.
@@ -98,18 +618,122 @@ def parse_mr_url(url):
     
     return project_path_encoded, mr_id
 
-def should_skip_file(file_path):
-    """Verifica se arquivo deve ser pulado na análise."""
-    for pattern in SKIP_FILES_PATTERNS:
-        if re.search(pattern, file_path):
-            return True
-    return False
+def gitignore_pattern_to_regex(pattern):
+    """
+    Converte um padrão .gitignore em regex ancorada no início do caminho: sem "/" no meio casa
+    em qualquer profundidade, "/" no fim restringe a diretórios e "**" atravessa diretórios.
+    """
+    directory_only = pattern.endswith("/")
+    pattern = pattern.rstrip("/")
+    anchored = "/" in pattern
+    pattern = pattern.lstrip("/")
+    parts = []
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if pattern.startswith("**/", i):
+            parts.append("(?:.*/)?")
+            i += 3
+            continue
+        if pattern.startswith("**", i):
+            parts.append(".*")
+            i += 2
+            continue
+        if char == "*":
+            parts.append("[^/]*")
+        elif char == "?":
+            parts.append("[^/]")
+        elif char == "[":
+            end = pattern.find("]", i + 2)
+            if end == -1:
+                parts.append(re.escape(char))
+            else:
+                klass = pattern[i + 1:end]
+                if klass.startswith("!"):
+                    klass = "^" + klass[1:]
+                parts.append("[" + klass.replace("\\", "\\\\") + "]")
+                i = end
+        elif char == "\\" and i + 1 < len(pattern):
+            i += 1
+            parts.append(re.escape(pattern[i]))
+        else:
+            parts.append(re.escape(char))
+        i += 1
+    prefix = "" if anchored else "(?:.*/)?"
+    # Diretório casa tudo que está dentro dele; um nome de arquivo também pode ser um diretório
+    suffix = "/.*" if directory_only else "(?:/.*)?"
+    return prefix + "".join(parts) + suffix + r"\Z"
+
+def parse_review_ignore(ignore_text):
+    """Lê as regras de um .mrreviewignore: lista de (regex, negada), na ordem do arquivo."""
+    rules = []
+    for line in ignore_text.splitlines():
+        line = line.rstrip()
+        if line.endswith("\\"):
+            line += " "
+        if not line or line.startswith("#"):
+            continue
+        negated = line.startswith("!")
+        if negated:
+            line = line[1:]
+        if line.startswith(("\\#", "\\!")):
+            line = line[1:]
+        if line.strip("/"):
+            rules.append((gitignore_pattern_to_regex(line), negated))
+    return rules
+
+def build_path_filter(ignore_text=""):
+    """
+    Compila os padrões embutidos e as regras do projeto em uma única regex. As alternativas ficam
+    em ordem inversa: a primeira que casa é a última regra aplicável, como no .gitignore (e um
+    "!padrão" do projeto pode reincluir algo dos padrões embutidos). Resultados memoizados por caminho.
+    """
+    rules = [(f".*?(?:{pattern})", False) for pattern in SKIP_FILES_PATTERNS]
+    rules.extend(parse_review_ignore(ignore_text))
+    alternatives = []
+    negated_groups = set()
+    for index in reversed(range(len(rules))):
+        regex, negated = rules[index]
+        alternatives.append(f"(?P<r{index}>{regex})")
+        if negated:
+            negated_groups.add(f"r{index}")
+    return {
+        "regex": re.compile("|".join(alternatives)),
+        "negated": negated_groups,
+        "rules": len(rules) - len(SKIP_FILES_PATTERNS),
+        "matches": {},
+    }
+
+_default_path_filter = build_path_filter()
+
+def get_path_filter(project_id, ref):
+    """Filtro de caminhos do projeto no ref: o .mrreviewignore é buscado uma vez por head_sha."""
+    key = (project_id, ref)
+    if key not in _path_filters:
+        ignore_text = get_file_content(project_id, REVIEW_IGNORE_FILE, ref) if REVIEW_IGNORE_FILE else ""
+        _path_filters[key] = build_path_filter(ignore_text) if ignore_text else None
+        if ignore_text:
+            print(f"🙈 {REVIEW_IGNORE_FILE}: {_path_filters[key]['rules']} regra(s) do projeto")
+    return _path_filters[key] or _default_path_filter
+
+def should_skip_file(file_path, path_filter=None):
+    """Verifica se arquivo deve ser pulado na análise (padrões embutidos + regras do projeto)."""
+    if path_filter is None:
+        path_filter = _default_path_filter
+    matches = path_filter["matches"]
+    skip = matches.get(file_path)
+    if skip is None:
+        match = path_filter["regex"].match(file_path)
+        skip = match is not None and match.lastgroup not in path_filter["negated"]
+        matches[file_path] = skip
+    return skip
 
 def should_skip_by_size(change):
     """Verifica se mudança é muito pequena para revisar."""
     diff_size = len(change.get("diff", ""))
     return diff_size < MIN_DIFF_SIZE_TO_REVIEW
 
+@traced("http")
 def get_mr_metadata(project_id, mr_id):
     """Busca título e descrição do MR para contextualizar a revisão."""
     url = f"{GITLAB_API_URL}/projects/{project_id}/merge_requests/{mr_id}"
@@ -120,12 +744,80 @@ def get_mr_metadata(project_id, mr_id):
         return {
             "title": data.get("title", ""),
             "description": data.get("description", ""),
-            "labels": data.get("labels", [])
+            "labels": data.get("labels", []),
+            "diff_refs": data.get("diff_refs"),
+            "changes_count": data.get("changes_count", "")
         }
     except Exception as e:
         debug_log(f"Falha ao buscar metadata do MR: {e}")
-        return {"title": "", "description": "", "labels": []}
+        return {"title": "", "description": "", "labels": [], "diff_refs": None, "changes_count": ""}
+
+def get_mr_diff_page(project_id, mr_id, page, per_page=None):
+    """Busca uma página do endpoint paginado /diffs. Retorna (changes, próxima página ou None)."""
+    per_page = per_page or DIFFS_PAGE_SIZE
+    url = f"{GITLAB_API_URL}/projects/{project_id}/merge_requests/{mr_id}/diffs"
+    with trace_span("get_mr_diffs_page", "http", page=page) as span:
+        resp = requests.get(
+            url,
+            headers=HEADERS,
+            params={"page": page, "per_page": per_page},
+            timeout=GITLAB_TIMEOUT_SECONDS
+        )
+        resp.raise_for_status()
+        changes = resp.json()
+        span.update(files=len(changes), bytes=len(resp.content))
+    debug_log(f"Página {page} de diffs recebida com {len(changes)} arquivo(s)")
+    # X-Next-Page pode não vir em listas muito grandes; nesse caso segue enquanto a página vier cheia
+    next_page = resp.headers.get("X-Next-Page")
+    if next_page is not None:
+        next_page = int(next_page) if next_page.strip() else None
+    elif len(changes) >= per_page:
+        next_page = page + 1
+    return changes, next_page
+
+def iter_mr_diff_pages(project_id, mr_id, per_page=None):
+    """
+    Percorre os diffs do MR pelo endpoint paginado /diffs, uma página por vez.
+    Gera tuplas (page, changes); a página anterior é descartada antes da próxima requisição.
+    """
+    page = 1
+    while page:
+        changes, next_page = get_mr_diff_page(project_id, mr_id, page, per_page)
+        if not changes:
+            return
+        yield page, changes
+        page = next_page
+
+def build_diff_from_file_versions(old_text, new_text):
+    """Gera os hunks de um diff unificado (sem cabeçalhos ---/+++) a partir das duas versões do arquivo."""
+    diff_lines = unified_diff(old_text.splitlines(), new_text.splitlines(), lineterm="", n=3)
+    hunk_lines = [line for idx, line in enumerate(diff_lines) if idx >= 2]
+    if not hunk_lines:
+        return ""
+    return "\n".join(hunk_lines) + "\n"
 
+@traced("stage")
+def resolve_collapsed_diff(project_id, change, diff_refs):
+    """
+    O GitLab omite o diff de arquivos grandes (collapsed/too_large).
+    Nesses casos reconstrói o diff localmente comparando as versões base e head do arquivo.
+    Retorna None se alguma das versões não puder ser baixada: sem ela o diff sairia errado.
+    """
+    if change.get("diff") or not (change.get("collapsed") or change.get("too_large")):
+        return change
+    debug_log(f"Diff colapsado para {change['new_path']}; reconstruindo a partir de base/head")
+    old_text = "" if change.get("new_file") else get_file_content(project_id, change["old_path"], diff_refs["base_sha"])
+    new_text = "" if change.get("deleted_file") else get_context_file_content(project_id, change["new_path"], diff_refs["head_sha"])
+    if old_text is None or new_text is None:
+        print(f"⚠️  Não foi possível baixar base/head de {change['new_path']}; arquivo não será revisado")
+        return None
+    resolved = dict(change)
+    resolved["diff"] = build_diff_from_file_versions(old_text, new_text)
+    if not resolved["diff"]:
+        print(f"⚠️  Não foi possível reconstruir o diff colapsado de {change['new_path']}")
+    return resolved
+
+@traced("http")
 def get_issue_metadata(project_id, issue_id):
     """Busca título e descrição da issue/história de usuário."""
     url = f"{GITLAB_API_URL}/projects/{project_id}/issues/{issue_id}"
@@ -160,19 +852,36 @@ def parse_issue_reference(issue_ref, project_path):
     
     return None, None
 
+def get_file_type(file_path):
+    """Classifica o arquivo pelo tipo usado nas regras específicas e no score de risco."""
+    if file_path.endswith("Test.java") or "/test/" in file_path:
+        return "test"
+    elif file_path.endswith("Controller.java"):
+        return "controller"
+    elif file_path.endswith("Service.java"):
+        return "service"
+    elif file_path.endswith("Repository.java"):
+        return "repository"
+    elif file_path.endswith(".yml") or file_path.endswith(".yaml"):
+        return "config"
+    elif file_path.endswith(".sql"):
+        return "sql"
+    return None
+
 def get_file_specific_rules(file_path):
     """Retorna regras específicas por tipo de arquivo."""
-    if file_path.endswith("Test.java") or "/test/" in file_path:
+    file_type = get_file_type(file_path)
+    if file_type == "test":
         return "\n🧪 ARQUIVO DE TESTE: Foque em cobertura adequada, assertions claros e específicos, nomes descritivos de testes."
-    elif file_path.endswith("Controller.java"):
+    elif file_type == "controller":
         return "\n🌐 CONTROLLER: Foque em validação de entrada, status HTTP corretos, uso adequado de DTOs, documentação de API."
-    elif file_path.endswith("Service.java"):
+    elif file_type == "service":
         return "\n⚙️ SERVICE: Foque em lógica de negócio, transações adequadas, tratamento de exceções, separação de responsabilidades."
-    elif file_path.endswith("Repository.java"):
+    elif file_type == "repository":
         return "\n💾 REPOSITORY: Foque em queries eficientes, uso de índices, prevenção de N+1 queries, paginação."
-    elif file_path.endswith(".yml") or file_path.endswith(".yaml"):
+    elif file_type == "config":
         return "\n⚙️ CONFIG: Foque em secrets expostos (senhas, tokens), valores default inadequados para produção."
-    elif file_path.endswith(".sql"):
+    elif file_type == "sql":
         return "\n🗄️ SQL: Foque em performance de queries, uso de índices, injeção SQL, transações."
     return ""
 
@@ -226,29 +935,122 @@ def get_reviewer_rules():
     
     return base_rules
 
+class OpenAICircuitOpen(Exception):
+    """A OpenAI está degradada e o circuit breaker está aberto: a chamada nem é feita."""
+
+def openai_circuit_allows():
+    """Indica se o circuito permite chamar a OpenAI (após o cooldown passa a half_open)."""
+    with _openai_circuit_lock:
+        if _openai_circuit["state"] != "open":
+            return True
+        if time.monotonic() - _openai_circuit["opened_at"] >= OPENAI_CIRCUIT_COOLDOWN_SECONDS:
+            _openai_circuit["state"] = "half_open"
+            debug_log("Circuit breaker da OpenAI em half_open: testando uma nova chamada")
+            return True
+        return False
+
+def record_openai_result(ok):
+    """
+    Atualiza o circuit breaker com o resultado de uma tentativa (429/5xx/timeout contam como falha).
+    Retorna True se o circuito ficou aberto, decidido sob o mesmo lock da atualização.
+    """
+    with _openai_circuit_lock:
+        if ok:
+            if _openai_circuit["state"] != "closed":
+                print("✅ OpenAI respondendo novamente; circuit breaker fechado")
+            _openai_circuit.update(state="closed", failures=0)
+            return False
+        _openai_circuit["failures"] += 1
+        if _openai_circuit["state"] == "half_open" or _openai_circuit["failures"] >= OPENAI_CIRCUIT_FAILURES:
+            if _openai_circuit["state"] != "open":
+                print(
+                    f"🔌 OpenAI degradada ({_openai_circuit['failures']} falha(s) seguida(s)); "
+                    f"pausando chamadas por {OPENAI_CIRCUIT_COOLDOWN_SECONDS}s"
+                )
+            _openai_circuit.update(state="open", opened_at=time.monotonic())
+        return _openai_circuit["state"] == "open"
+
+def record_openai_latency(seconds):
+    _openai_latencies.append(seconds)
+
+def get_openai_hedge_delay():
+    """p95 das latências observadas; até haver amostras suficientes usa o atraso padrão."""
+    if len(_openai_latencies) < OPENAI_HEDGE_MIN_SAMPLES:
+        return OPENAI_HEDGE_DEFAULT_DELAY_SECONDS
+    ordered = sorted(_openai_latencies)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+def post_openai(payload, backend=None, record_latency=True):
+    """
+    Uma requisição de chat ao backend do estágio (revisão por padrão); registra a latência das
+    respostas 200 para o hedge. O provider stub responde localmente, sem rede.
+    """
+    backend = backend or get_llm_backend("review")
+    if backend["provider"] == "stub":
+        return StubResponse(stub_completion(backend, payload))
+    started = time.monotonic()
+    prompt_chars = sum(len(message["content"]) for message in payload["messages"])
+    with trace_span("openai_request", "http", stage=backend["stage"], prompt_chars=prompt_chars) as span:
+        response = requests.post(
+            backend["chat_url"],
+            headers=llm_headers(backend),
+            json=payload,
+            timeout=OPENAI_TIMEOUT_SECONDS
+        )
+        span.update(status=response.status_code, response_bytes=len(response.content))
+    if response.status_code == 200 and record_latency:
+        record_openai_latency(time.monotonic() - started)
+    return response
+
+def post_openai_hedged(payload):
+    """
+    Envia a requisição e, se ela passar do p95 observado, dispara uma cópia;
+    usa a primeira resposta 200 que chegar (a outra termina em segundo plano e é descartada).
+    """
+    first = _openai_hedge_executor.submit(post_openai, payload)
+    if not OPENAI_HEDGE_ENABLED:
+        return first.result()
+    hedge_delay = get_openai_hedge_delay()
+    done, _pending = wait([first], timeout=hedge_delay)
+    if done:
+        return first.result()
+
+    print(f"⏳ OpenAI acima do p95 ({hedge_delay:.1f}s); enviando requisição duplicada...")
+    pending = {first, _openai_hedge_executor.submit(post_openai, payload)}
+    last_future = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            last_future = future
+            if future.exception() is None and future.result().status_code == 200:
+                return future.result()
+    return last_future.result()
+
+@traced("stage")
 def openai_chat(messages, temperature=0.3):
-    """Chama OpenAI com retry simples (máximo 3 tentativas)"""
+    """Chama o LLM de revisão com retry simples (máximo 3 tentativas), hedge no p95 e circuit breaker"""
+    backend = get_llm_backend("review")
+    payload = {
+        "model": backend["model"],
+        "messages": messages,
+        "temperature": temperature
+    }
     for attempt in range(1, OPENAI_MAX_RETRIES + 1):
+        if not openai_circuit_allows():
+            raise OpenAICircuitOpen("Circuit breaker da OpenAI aberto")
         try:
-            print(f"🤖 Chamando OpenAI (tentativa {attempt}/{OPENAI_MAX_RETRIES})...")
-            response = requests.post(
-                "https://api.openai.com/v1/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {OPENAI_API_KEY}",
-                    "Content-Type": "application/json"
-                },
-                json={
-                    "model": "gpt-4o",
-                    "messages": messages,
-                    "temperature": temperature
-                },
-                timeout=OPENAI_TIMEOUT_SECONDS
-            )
+            print(f"🤖 Chamando {backend['model']} (tentativa {attempt}/{OPENAI_MAX_RETRIES})...")
+            response = post_openai_hedged(payload)
             
             if response.status_code == 200:
+                record_openai_result(True)
                 print("✅ Resposta recebida")
                 return response.json()["choices"][0]["message"]["content"]
             
+            if response.status_code == 429 or response.status_code >= 500:
+                if record_openai_result(False):
+                    raise OpenAICircuitOpen(f"OpenAI retornou {response.status_code}; circuit breaker aberto")
+            
             # Rate limit - aguarda e tenta novamente
             if response.status_code == 429 and attempt < OPENAI_MAX_RETRIES:
                 print(f"⚠️  Rate limit (429). Aguardando {OPENAI_RETRY_WAIT_SECONDS}s...")
@@ -261,12 +1063,17 @@ def openai_chat(messages, temperature=0.3):
             
         except requests.Timeout:
             print(f"⏱️  Timeout na tentativa {attempt}")
+            if record_openai_result(False):
+                raise OpenAICircuitOpen("Timeout da OpenAI; circuit breaker aberto")
             if attempt < OPENAI_MAX_RETRIES:
                 time.sleep(OPENAI_RETRY_WAIT_SECONDS)
             else:
                 raise
         except requests.RequestException as e:
             print(f"❌ Erro: {str(e)[:200]}")
+            if not isinstance(e, requests.HTTPError):
+                if record_openai_result(False):
+                    raise OpenAICircuitOpen("OpenAI indisponível; circuit breaker aberto") from e
             if attempt < OPENAI_MAX_RETRIES:
                 time.sleep(OPENAI_RETRY_WAIT_SECONDS)
             else:
@@ -274,18 +1081,302 @@ def openai_chat(messages, temperature=0.3):
     
     raise RuntimeError(f"❌ Falha após {OPENAI_MAX_RETRIES} tentativas")
 
+@traced("stage")
+def build_file_context(project_id, change, head_sha):
+    """Busca e renderiza o conteúdo de um único arquivo do MR para contexto da IA."""
+    if change.get("deleted_file", False):
+        return ""
+    file_content = get_context_file_content(project_id, change["new_path"], head_sha)
+    rendered = render_file_with_line_numbers(file_content)
+    if rendered and len(rendered) > MAX_FILE_CONTEXT_CHARS:
+        rendered = rendered[:MAX_FILE_CONTEXT_CHARS] + "\n...[arquivo truncado por limite de contexto]..."
+    return rendered
+
 def build_file_context_map(project_id, changes, head_sha):
     context_map = {}
     for change in changes:
         if change.get("deleted_file", False):
             continue
-        file_content = get_file_content(project_id, change["new_path"], head_sha)
-        rendered = render_file_with_line_numbers(file_content)
-        if rendered and len(rendered) > MAX_FILE_CONTEXT_CHARS:
-            rendered = rendered[:MAX_FILE_CONTEXT_CHARS] + "\n...[arquivo truncado por limite de contexto]..."
-        context_map[change["new_path"]] = rendered
+        context_map[change["new_path"]] = build_file_context(project_id, change, head_sha)
     return context_map
 
+def get_token_encoder():
+    """Carrega o encoder do tiktoken uma vez; se não estiver instalado (ou sem o arquivo BPE) retorna None."""
+    global _token_encoder
+    if _token_encoder is None:
+        _token_encoder = False
+        if tiktoken is not None:
+            _token_encoder = load_token_encoder() or False
+    return _token_encoder or None
+
+def load_token_encoder():
+    """
+    tiktoken.get_encoding numa thread com prazo: no primeiro uso ele baixa o arquivo BPE, o que
+    falha ou trava sem rede (CI, nós isolados). Nesses casos retorna None e vale a estimativa local.
+    """
+    loaded = {}
+
+    def load():
+        try:
+            loaded["encoder"] = tiktoken.get_encoding(TOKENIZER_ENCODING)
+        except Exception as e:
+            loaded["error"] = e
+
+    thread = threading.Thread(target=load, name="tiktoken-load", daemon=True)
+    thread.start()
+    thread.join(TOKENIZER_LOAD_TIMEOUT_SECONDS)
+    if thread.is_alive():
+        loaded["error"] = f"download do arquivo BPE excedeu {TOKENIZER_LOAD_TIMEOUT_SECONDS:g}s"
+    if "encoder" in loaded:
+        return loaded["encoder"]
+    print(
+        f"⚠️  tiktoken indisponível ({loaded.get('error')}); usando estimativa local de tokens. "
+        "Para uso offline, aponte TIKTOKEN_CACHE_DIR para um cache com o arquivo BPE"
+    )
+    return None
+
+def estimate_tokens(text):
+    """
+    Tokens de um texto: exato com tiktoken; senão aproxima o BPE localmente
+    (palavras em pedaços de ~4 letras, números de até 3 dígitos, pontuação e quebras de linha).
+    """
+    if not text:
+        return 0
+    encoder = get_token_encoder()
+    if encoder is not None:
+        return len(encoder.encode(text, disallowed_special=()))
+    tokens = 0
+    for piece in TOKEN_PIECE_RE.findall(text):
+        first = piece[0]
+        if first.isspace():
+            # Espaço simples é absorvido pela palavra seguinte; quebras e indentação custam ~1
+            if piece != " ":
+                tokens += 1 + piece.count("\n") // 2
+        elif first.isascii() and first.isalpha():
+            tokens += (len(piece) + 3) // 4
+        elif first.isdigit() or first == "_":
+            tokens += 1
+        elif first.isalpha():
+            # Letras acentuadas/não latinas: pedaços menores
+            tokens += (len(piece) + 1) // 2
+        else:
+            tokens += (len(piece) + 1) // 2
+    return tokens
+
+def estimate_messages_tokens(messages):
+    """Tokens de uma lista de mensagens de chat (+4 por mensagem de overhead do formato)."""
+    return sum(estimate_tokens(message["content"]) + 4 for message in messages) + 3
+
+def estimate_cost_usd(input_tokens, output_tokens):
+    return input_tokens * PRICE_INPUT_PER_MTOK / 1_000_000 + output_tokens * PRICE_OUTPUT_PER_MTOK / 1_000_000
+
+def strip_java_annotations(header):
+    return re.sub(r"^(?:@[\w.]+(?:\s*\([^()]*(?:\([^()]*\)[^()]*)*\))?\s*)+", "", header).strip()
+
+def parse_java_symbols(source):
+    """
+    Extrai de um fonte Java o package, os imports e os tipos declarados com
+    assinaturas de métodos e campos. Parser leve por profundidade de chaves (sem AST).
+    """
+    package_match = re.search(r"^\s*package\s+([\w.]+)\s*;", source, re.MULTILINE)
+    imports = re.findall(r"^\s*import\s+(?!static\s)([\w.]+)\s*;", source, re.MULTILINE)
+    symbols = {
+        "package": package_match.group(1) if package_match else "",
+        "imports": imports,
+        "types": []
+    }
+
+    type_stack = []  # (profundidade do corpo, tipo)
+    depth = 0
+    buf = []
+    i = 0
+    n = len(source)
+    while i < n:
+        ch = source[i]
+        # Comentários e literais não contam chaves nem entram nas assinaturas
+        if ch == "/" and source.startswith("//", i):
+            end = source.find("\n", i)
+            i = n if end == -1 else end
+            continue
+        if ch == "/" and source.startswith("/*", i):
+            end = source.find("*/", i + 2)
+            i = n if end == -1 else end + 2
+            buf.append(" ")
+            continue
+        if ch in "\"'":
+            j = i + 1
+            while j < n and source[j] != ch:
+                j += 2 if source[j] == "\\" else 1
+            buf.append(source[i:j + 1])
+            i = j + 1
+            continue
+        if ch not in "{};":
+            buf.append(ch)
+            i += 1
+            continue
+
+        header = " ".join("".join(buf).split())
+        buf = []
+        i += 1
+        if ch == "}":
+            depth = max(0, depth - 1)
+            while type_stack and type_stack[-1][0] > depth:
+                type_stack.pop()
+            continue
+
+        header = strip_java_annotations(header)
+        type_match = JAVA_TYPE_RE.search(header) if ch == "{" else None
+        if type_match and "=" not in header.split(type_match.group(0))[0]:
+            java_type = {
+                "name": type_match.group(2),
+                "kind": type_match.group(1),
+                "signature": header[:200],
+                "methods": [],
+                "fields": []
+            }
+            symbols["types"].append(java_type)
+            type_stack.append((depth + 1, java_type))
+        elif type_stack and type_stack[-1][0] == depth and header:
+            add_java_member(type_stack[-1][1], header, ch)
+        if ch == "{":
+            depth += 1
+    return symbols
+
+def add_java_member(java_type, header, terminator):
+    """Classifica um cabeçalho no corpo de um tipo como método ou campo."""
+    paren = header.find("(")
+    equals = header.find("=")
+    if paren != -1 and (equals == -1 or paren < equals):
+        method_match = JAVA_METHOD_RE.match(header)
+        if not method_match:
+            return
+        prefix_words = set(header[:method_match.start(1)].split())
+        name = method_match.group(1)
+        if name in JAVA_NON_MEMBER_WORDS or prefix_words & JAVA_NON_MEMBER_WORDS:
+            return
+        java_type["methods"].append((name, header[:200]))
+    elif terminator == ";":
+        declaration = header.split("=", 1)[0].strip()
+        field_match = JAVA_FIELD_RE.match(declaration)
+        if not field_match or set(declaration.split()) & JAVA_NON_MEMBER_WORDS:
+            return
+        # Vírgula fora de generics indica lista de constantes de enum, não um campo
+        if "," in re.sub(r"<[^<>]*>", "", field_match.group(1)):
+            return
+        java_type["fields"].append((field_match.group(2), declaration[:200]))
+
+def get_symbol_index(project_id, ref):
+    """Índice de símbolos Java por (projeto, head_sha), preenchido sob demanda ao longo da execução."""
+    key = (project_id, ref)
+    if key not in _java_symbol_indexes:
+        _java_symbol_indexes[key] = {"files": {}, "types": {}}
+    return _java_symbol_indexes[key]
+
+def get_java_file_symbols(project_id, ref, file_path):
+    """Parseia (uma vez) um arquivo Java do ref e registra seus tipos no índice."""
+    index = get_symbol_index(project_id, ref)
+    if file_path in index["files"]:
+        return index["files"][file_path]
+    content = get_context_file_content(project_id, file_path, ref)
+    symbols = parse_java_symbols(content) if content else None
+    index["files"][file_path] = symbols
+    if symbols:
+        for java_type in symbols["types"]:
+            index["types"].setdefault(java_type["name"], (file_path, java_type))
+    return symbols
+
+def java_path_exists(project_id, ref, file_path):
+    """Verifica se um arquivo existe no ref sem baixá-lo (snapshot ou listagem de tree)."""
+    if USE_REPOSITORY_ARCHIVE:
+        snapshot = get_repository_snapshot(project_id, ref)
+        if snapshot is not None:
+            return file_path in snapshot["entries"]
+    return get_blob_id(project_id, file_path, ref) is not None
+
+def resolve_java_type(project_id, ref, type_name, file_path, file_symbols):
+    """
+    Localiza a definição de um tipo referenciado: índice já carregado, imports explícitos
+    do arquivo (mesmo pacote raiz) ou classes do mesmo pacote.
+    """
+    index = get_symbol_index(project_id, ref)
+    if type_name in index["types"]:
+        return index["types"][type_name]
+
+    package = file_symbols["package"]
+    package_dir = package.replace(".", "/")
+    file_dir = posixpath.dirname(file_path)
+    if not package_dir or not file_dir.endswith(package_dir):
+        return None
+    source_root = file_dir[:len(file_dir) - len(package_dir)]
+    root_package = package.split(".")[0]
+
+    candidates = [
+        imported for imported in file_symbols["imports"]
+        if imported.endswith(f".{type_name}") and imported.split(".")[0] == root_package
+    ]
+    candidates.append(f"{package}.{type_name}")
+    for qualified_name in candidates:
+        candidate_path = f"{source_root}{qualified_name.replace('.', '/')}.java"
+        if candidate_path == file_path or candidate_path in index["files"]:
+            continue
+        if not java_path_exists(project_id, ref, candidate_path):
+            continue
+        get_java_file_symbols(project_id, ref, candidate_path)
+        if type_name in index["types"]:
+            return index["types"][type_name]
+    return None
+
+@traced("stage")
+def build_symbol_context(project_id, ref, change):
+    """
+    Monta, dentro de SYMBOL_CONTEXT_MAX_TOKENS, as assinaturas de outros arquivos
+    (classes, métodos e campos) efetivamente referenciadas nas linhas do diff.
+    """
+    file_path = change["new_path"]
+    if not file_path.endswith(".java") or change.get("deleted_file"):
+        return ""
+    file_symbols = get_java_file_symbols(project_id, ref, file_path)
+    if not file_symbols:
+        return ""
+
+    diff_code = "\n".join(
+        line[1:] for line in change.get("diff", "").splitlines()
+        if line[:1] in ("+", "-", " ")
+    )
+    type_names = set(re.findall(r"\b([A-Z][A-Za-z0-9_]*)\b", diff_code))
+    called_methods = set(re.findall(r"\.\s*(\w+)\s*\(", diff_code))
+    accessed_members = called_methods | set(re.findall(r"\.\s*([a-z]\w*)\b", diff_code))
+
+    # Chamadas em campos do próprio arquivo (ex.: repository.save) apontam para o tipo do campo
+    own_types = {java_type["name"] for java_type in file_symbols["types"]}
+    for java_type in file_symbols["types"]:
+        for field_name, declaration in java_type["fields"]:
+            if re.search(rf"\b{re.escape(field_name)}\s*\.", diff_code):
+                field_type = re.search(r"([A-Z]\w*)(?:<[^>]*>)?(?:\[\])*\s+\w+$", declaration)
+                if field_type:
+                    type_names.add(field_type.group(1))
+
+    blocks = []
+    used_tokens = 0
+    for type_name in sorted(type_names - own_types):
+        resolved = resolve_java_type(project_id, ref, type_name, file_path, file_symbols)
+        if not resolved:
+            continue
+        type_path, java_type = resolved
+        lines = [f"// {type_path}", java_type["signature"]]
+        lines += [f"    {sig}" for name, sig in java_type["methods"] if name in accessed_members]
+        lines += [f"    {sig}" for name, sig in java_type["fields"] if name in accessed_members]
+        block = "\n".join(lines)
+        block_tokens = estimate_tokens(block)
+        if used_tokens + block_tokens > SYMBOL_CONTEXT_MAX_TOKENS:
+            debug_log(f"Orçamento de símbolos atingido; {type_name} não incluído")
+            continue
+        blocks.append(block)
+        used_tokens += block_tokens
+
+    debug_log(f"Contexto de símbolos para {file_path}: {len(blocks)} tipo(s), ~{used_tokens} tokens")
+    return "\n\n".join(blocks)
+
 def detect_duplicate_suggestion(new_suggestion, previous_suggestions, threshold=0.75):
     """Verifica se sugestão é muito similar a uma já feita."""
     new_norm = normalize_text(new_suggestion)
@@ -302,29 +1393,134 @@ def detect_duplicate_suggestion(new_suggestion, previous_suggestions, threshold=
             return True
     return False
 
+def score_change_risk(change):
+    """
+    Score de risco de um arquivo: peso do tipo (regras específicas) x churn (log das linhas
+    alteradas) + bônus por linhas adicionadas com SQL ou trechos sensíveis de segurança.
+    """
+    path = change["new_path"]
+    if should_skip_file(path):
+        return 0.0
+    type_weight = FILE_TYPE_RISK.get(get_file_type(path), 1.0)
+    churn = 0
+    sql_hits = 0
+    security_hits = 0
+    for line in change.get("diff", "").splitlines():
+        if line.startswith(("+++", "---")) or not line.startswith(("+", "-")):
+            continue
+        churn += 1
+        if line.startswith("+"):
+            if SQL_RISK_RE.search(line):
+                sql_hits += 1
+            if SECURITY_RISK_RE.search(line):
+                security_hits += 1
+    return type_weight * math.log1p(churn) + 1.5 * min(sql_hits, 4) + 2.0 * min(security_hits, 4)
+
 def prioritize_changes(changes):
-    """Ordena arquivos: primeiro os menores, depois testes, depois configs."""
-    def sort_key(change):
-        path = change["new_path"]
-        diff_size = len(change.get("diff", ""))
-        
-        # Prioridade por tipo (menor número = maior prioridade)
-        if should_skip_file(path):
-            priority = 99  # Último na fila (mas será pulado mesmo)
-        elif "/test/" in path or path.endswith("Test.java"):
-            priority = 2
-        elif path.endswith((".yml", ".yaml", ".properties", ".xml")):
-            priority = 3
-        else:
-            priority = 1
-        
-        return (priority, diff_size)
-    
-    return sorted(changes, key=sort_key)
+    """Ordena arquivos (metadados de describe_review_change) pelo risco: os de maior risco primeiro."""
+    return sorted(changes, key=lambda entry: entry["risk"], reverse=True)
+
+def create_review_budget(deadline_seconds=None, token_budget=None):
+    """Orçamento da revisão: prazo total (deadline) e tokens estimados. 0 desativa cada limite."""
+    deadline_seconds = REVIEW_DEADLINE_SECONDS if deadline_seconds is None else deadline_seconds
+    token_budget = REVIEW_TOKEN_BUDGET if token_budget is None else token_budget
+    return {
+        "deadline_at": time.monotonic() + deadline_seconds if deadline_seconds > 0 else None,
+        "token_budget": token_budget,
+        "tokens_used": 0,
+        "file_seconds": None,  # Média móvel do tempo por arquivo
+    }
+
+def estimate_diff_prompt_tokens(change):
+    """Tokens do diff numerado: o texto do diff + o prefixo "NEW nnn OLD nnn |" de cada linha."""
+    diff = change.get("diff", "")
+    return estimate_tokens(diff) + 6 * diff.count("\n") + REVIEW_PROMPT_OVERHEAD_TOKENS
+
+def estimate_context_tokens_before_fetch(change):
+    """
+    Estimativa do contexto do arquivo antes de baixá-lo: o arquivo tem pelo menos até a última
+    linha tocada pelos hunks; limitada por MAX_FILE_CONTEXT_CHARS.
+    """
+    if change.get("deleted_file"):
+        return 0
+    file_lines = 0
+    for match in HUNK_HEADER_RE.finditer(change.get("diff", "")):
+        file_lines = max(file_lines, int(match.group(1)) + int(match.group(2) or 1))
+    return min(file_lines * ESTIMATED_TOKENS_PER_FILE_LINE, MAX_FILE_CONTEXT_CHARS // 3)
+
+def estimate_review_tokens(review_messages, change, full_file_context=""):
+    """Tokens estimados de uma revisão: sessão + diff numerado + contexto do arquivo + resposta."""
+    return (
+        estimate_messages_tokens(review_messages)
+        + estimate_diff_prompt_tokens(change)
+        + estimate_tokens(full_file_context[:MAX_FILE_CONTEXT_CHARS])
+        + REVIEW_RESPONSE_TOKENS_ESTIMATE
+    )
+
+def estimate_entry_tokens(session_tokens, entry):
+    """Chamadas e tokens de entrada previstos para um arquivo, a partir dos seus metadados: (calls, input_tokens)."""
+    diff_tokens = entry["diff_tokens"]
+    groups = max(1, -(-diff_tokens // (CHUNK_MAX_LINES * 12))) if CHUNK_MAX_LINES > 0 else 1
+    limit = MODEL_CONTEXT_TOKENS - RESPONSE_TOKENS_RESERVE
+    return groups, min(limit, session_tokens * groups + diff_tokens + entry["context_tokens"])
+
+def print_review_estimate(review_messages, changes):
+    """Estimativa pré-execução de tokens e custo, a partir dos metadados dos arquivos selecionados."""
+    session_tokens = estimate_messages_tokens(review_messages)
+    input_tokens = 0
+    calls = 0
+    for change in changes:
+        groups, tokens = estimate_entry_tokens(session_tokens, change)
+        input_tokens += tokens
+        calls += groups
+    output_tokens = calls * REVIEW_RESPONSE_TOKENS_ESTIMATE
+    print(
+        f"🧮 Estimativa: {len(changes)} arquivo(s), ~{calls} chamada(s), ~{input_tokens:,} tokens de entrada "
+        f"+ ~{output_tokens:,} de saída ≈ US$ {estimate_cost_usd(input_tokens, output_tokens):.2f}\n"
+    )
+    return {"calls": calls, "input_tokens": input_tokens, "output_tokens": output_tokens}
+
+def get_budget_stop_reason(budget, estimated_tokens=0):
+    """Motivo para não começar o próximo arquivo ("prazo" ou "tokens"), ou None se ainda cabe."""
+    if budget["deadline_at"] is not None:
+        expected_seconds = budget["file_seconds"] or 0
+        if time.monotonic() + expected_seconds > budget["deadline_at"]:
+            return "prazo"
+    if budget["token_budget"] > 0 and budget["tokens_used"] + estimated_tokens > budget["token_budget"]:
+        return "tokens"
+    return None
+
+def record_budget_usage(budget, tokens, seconds):
+    budget["tokens_used"] += tokens
+    previous = budget["file_seconds"]
+    budget["file_seconds"] = seconds if previous is None else previous + 0.3 * (seconds - previous)
 
 def validate_suggestion_relevance(suggestion_text, review_messages):
-    """Validação simplificada - sempre aceita sugestões"""
-    return True  # Simplificado - confia na análise inicial
+    """
+    Triagem da sugestão antes de postar, pelo backend do estágio "triage" (pensado para um modelo
+    local de baixa latência). Sem triagem configurada, ou se ela falhar, aceita a sugestão.
+    """
+    if not llm_stage_enabled("triage"):
+        return True
+    backend = get_llm_backend("triage")
+    payload = {
+        "model": backend["model"],
+        "messages": [
+            {"role": "system", "content": TRIAGE_SYSTEM_PROMPT},
+            {"role": "user", "content": suggestion_text[:4000]}
+        ],
+        "temperature": 0,
+        "max_tokens": 3
+    }
+    try:
+        with trace_span("triage", "stage"):
+            response = post_openai(payload, backend, record_latency=False)
+        response.raise_for_status()
+        answer = response.json()["choices"][0]["message"]["content"]
+    except (requests.RequestException, ValueError, KeyError, IndexError) as e:
+        debug_log(f"Triagem indisponível ({e}); sugestão aceita")
+        return True
+    return not answer.strip().upper().startswith("N")
 
 def generate_changes_summary(changes):
     """Gera resumo executivo das mudanças para contextualizar a IA."""
@@ -347,6 +1543,14 @@ def generate_changes_summary(changes):
     
     return "\n".join(summary_lines)
 
+def generate_streaming_summary(mr_metadata):
+    """Resumo usado quando os diffs são processados em streaming (sem a lista completa em memória)."""
+    summary_lines = ["📊 RESUMO DAS MUDANÇAS NO MR:"]
+    if mr_metadata.get("changes_count"):
+        summary_lines.append(f"  - {mr_metadata['changes_count']} arquivo(s) alterado(s)")
+    summary_lines.append("\nOs arquivos serão enviados um a um, em lotes paginados.")
+    return "\n".join(summary_lines)
+
 def create_review_session(observacoes_usuario="", mr_metadata=None, issue_metadata=None):
     base_prompt = get_reviewer_rules()
     
@@ -382,18 +1586,22 @@ def create_review_session(observacoes_usuario="", mr_metadata=None, issue_metada
         {"role": "user", "content": base_prompt}
     ]
 
-def ask_chatgpt(review_messages, file_path, file_diff, full_file_context=""):
-    """Analisa um arquivo e retorna sugestões com código aplicável"""
+def build_review_prompt(file_path, file_diff, full_file_context="", symbol_context=""):
+    """Monta a mensagem de revisão de um arquivo (diff numerado + contextos)."""
     full_file_block = ""
     if full_file_context:
         if len(full_file_context) > MAX_FILE_CONTEXT_CHARS:
             full_file_context = full_file_context[:MAX_FILE_CONTEXT_CHARS] + "\n... (truncado)"
         full_file_block = f"\n\nContexto do arquivo:\n{full_file_context}\n"
+    symbol_block = ""
+    if symbol_context:
+        symbol_block = f"\nDefinições referenciadas no diff (outros arquivos):\n{symbol_context}\n"
     
     prompt = (
         f"Arquivo: {file_path}\n\n"
         f"Diff:\n{file_diff}\n"
-        f"{full_file_block}\n"
+        f"{full_file_block}"
+        f"{symbol_block}\n"
         "Analise e retorne sugestões APLICÁVEIS.\n\n"
         "FORMATO OBRIGATÓRIO por sugestão:\n"
         "Linha X: [título breve do problema]\n"
@@ -412,12 +1620,212 @@ def ask_chatgpt(review_messages, file_path, file_diff, full_file_context=""):
         "Código corrigido: if (user != null) {\n    user.getName();\n}\n"
         "Motivo: Previne crash se user for null\n"
     )
-    user_msg = {"role": "user", "content": prompt}
+    return {"role": "user", "content": prompt}
+
+def find_enclosing_block(numbered_lines, line_no):
+    """
+    Limites (início, fim) do método que envolve a linha: sobe até a declaração com indentação
+    menor terminada em "{" (ignorando if/for/try...) e desce até o "}" com essa mesma indentação.
+    """
+    def indent_of(text):
+        return len(text) - len(text.lstrip())
+
+    text = numbered_lines.get(line_no, "")
+    target_indent = indent_of(text) if text.strip() else None
+    start = line_no
+    for candidate in range(line_no - 1, max(0, line_no - METHOD_SLICE_MAX_LINES), -1):
+        candidate_text = numbered_lines.get(candidate)
+        if candidate_text is None:
+            break
+        stripped = candidate_text.strip()
+        if not stripped:
+            continue
+        if target_indent is None or indent_of(candidate_text) < target_indent:
+            start = candidate
+            # Blocos de controle (if/for/try...) não bastam: sobe até a declaração do método
+            if stripped.endswith("{") and not CONTROL_BLOCK_RE.match(candidate_text):
+                break
+            target_indent = indent_of(candidate_text)
+    block_indent = indent_of(numbered_lines.get(start, ""))
+    end = line_no
+    for candidate in range(line_no + 1, line_no + METHOD_SLICE_MAX_LINES):
+        candidate_text = numbered_lines.get(candidate)
+        if candidate_text is None:
+            break
+        end = candidate
+        if candidate_text.strip().startswith("}") and indent_of(candidate_text) <= block_indent:
+            break
+    return start, end
+
+def build_method_slices(full_file_context, file_diff):
+    """
+    Contexto reduzido: só os métodos/blocos do arquivo que contêm linhas alteradas no diff.
+    Usa a numeração "Lnnnn |" do contexto renderizado e "NEW nnn |" do diff numerado.
+    """
+    header_lines = []
+    numbered_lines = {}
+    for line in full_file_context.splitlines():
+        match = CONTEXT_LINE_RE.match(line)
+        if match:
+            numbered_lines[int(match.group(1))] = line[match.end():]
+        elif not numbered_lines:
+            header_lines.append(line)
+    if not numbered_lines:
+        return ""
+
+    changed = sorted({
+        int(match.group(1)) for match in map(DIFF_ADDED_LINE_RE.match, file_diff.splitlines()) if match
+    })
+    if not changed:
+        # Só remoções: usa as linhas de contexto ao redor
+        changed = sorted({
+            int(match.group(1)) for match in map(DIFF_NEW_LINE_RE.match, file_diff.splitlines()) if match
+        })
+    ranges = []
+    for line_no in changed:
+        if line_no not in numbered_lines:
+            continue
+        if ranges and ranges[-1][0] <= line_no <= ranges[-1][1]:
+            continue
+        start, end = find_enclosing_block(numbered_lines, line_no)
+        if ranges and start <= ranges[-1][1] + 1:
+            ranges[-1] = (ranges[-1][0], max(ranges[-1][1], end))
+        else:
+            ranges.append((start, end))
+
+    width = max(4, len(str(max(numbered_lines))))
+    output = list(header_lines)
+    for start, end in ranges:
+        output.append("...")
+        output.extend(
+            f"L{str(line_no).rjust(width, '0')} | {numbered_lines[line_no]}"
+            for line_no in range(start, end + 1)
+            if line_no in numbered_lines
+        )
+    output.append("...")
+    return "\n".join(output)
+
+def get_context_header(full_file_context):
+    """Texto antes da primeira linha numerada do contexto (as regras específicas do tipo de arquivo)."""
+    header_lines = []
+    for line in full_file_context.splitlines():
+        if CONTEXT_LINE_RE.match(line):
+            break
+        header_lines.append(line)
+    return "\n".join(header_lines).strip()
+
+@traced("cpu")
+def fit_review_prompt(review_messages, file_path, file_diff, full_file_context="", symbol_context=""):
+    """
+    Monta o prompt de revisão que cabe na janela do modelo, reduzindo o contexto em camadas:
+    arquivo completo -> trechos dos métodos alterados -> somente o diff.
+    """
+    limit = MODEL_CONTEXT_TOKENS - RESPONSE_TOKENS_RESERVE
+    session_tokens = estimate_messages_tokens(review_messages)
+    tiers = [("arquivo completo", lambda: (full_file_context, symbol_context))]
+    if full_file_context:
+        tiers.append(("trechos dos métodos", lambda: (build_method_slices(full_file_context, file_diff), symbol_context)))
+    tiers.append(("somente diff", lambda: (get_context_header(full_file_context), "")))
+
+    for idx, (tier_name, build_tier) in enumerate(tiers):
+        context, symbols = build_tier()
+        user_msg = build_review_prompt(file_path, file_diff, context, symbols)
+        prompt_tokens = session_tokens + estimate_tokens(user_msg["content"]) + 4
+        if prompt_tokens <= limit:
+            if idx > 0:
+                print(f"   📐 Contexto reduzido para '{tier_name}' (~{prompt_tokens} tokens) para caber na janela do modelo")
+            return user_msg
+    print(f"   ⚠️  Mesmo só com o diff o prompt tem ~{prompt_tokens} tokens (janela: {limit})")
+    return user_msg
+
+@traced("stage")
+def ask_chatgpt(review_messages, file_path, file_diff, full_file_context="", symbol_context=""):
+    """Analisa um arquivo e retorna sugestões com código aplicável"""
+    user_msg = fit_review_prompt(review_messages, file_path, file_diff, full_file_context, symbol_context)
     response = openai_chat(review_messages + [user_msg], temperature=0.3)
     
-    time.sleep(DELAY_BETWEEN_CALLS)
+    if get_llm_backend("review")["provider"] != "stub":
+        time.sleep(DELAY_BETWEEN_CALLS)
     return response
 
+TRIAGE_SYSTEM_PROMPT = (
+    "Você faz a triagem de comentários de code review. Responda apenas SIM se o comentário aponta "
+    "um problema real e acionável (bug, segurança, performance, erro de lógica) ou NAO se é "
+    "irrelevante, genérico ou apenas estilo."
+)
+
+UNREVIEWED_REASONS = {
+    "prazo": "prazo da revisão esgotado",
+    "tokens": "orçamento de tokens esgotado",
+    "openai": "OpenAI indisponível (circuit breaker aberto)",
+    "falha": "falha na revisão (tentativas esgotadas)",
+    "download": "não foi possível baixar o diff ou as versões do arquivo",
+}
+
+def collect_unreviewed(review_state):
+    """Arquivos selecionados que não foram revisados: [(path, motivo)]."""
+    unreviewed = list(review_state["unreviewed"])
+    unreviewed.extend((path, "openai") for path in review_state["deferred"])
+    return unreviewed
+
+def format_unreviewed_summary(unreviewed, marker=None):
+    lines = [] if marker is None else [marker]
+    lines += [
+        "🤖 **Revisão automática parcial**",
+        "",
+        f"{len(unreviewed)} arquivo(s) não foram revisados nesta execução:",
+        "",
+    ]
+    for path, reason in unreviewed:
+        lines.append(f"- `{path}` — {UNREVIEWED_REASONS.get(reason, reason)}")
+    return "\n".join(lines)
+
+def unreviewed_summary_marker(run_key):
+    """Comentário HTML invisível que identifica a nota de não revisados de uma execução."""
+    return f"<!-- ai-mr-review:nao-revisados {run_key} -->"
+
+def has_note_with_marker(project_id, mr_id, marker):
+    """Verifica se alguma nota do MR já contém o marcador (mais recentes primeiro)."""
+    url = f"{GITLAB_API_URL}/projects/{project_id}/merge_requests/{mr_id}/notes"
+    page = 1
+    while page:
+        resp = requests.get(
+            url,
+            headers=HEADERS,
+            params={"sort": "desc", "order_by": "created_at", "per_page": 100, "page": page},
+            timeout=GITLAB_TIMEOUT_SECONDS
+        )
+        resp.raise_for_status()
+        if any(marker in (note.get("body") or "") for note in resp.json()):
+            return True
+        next_page = resp.headers.get("X-Next-Page", "")
+        page = int(next_page) if next_page.strip() else None
+    return False
+
+@traced("http")
+def post_unreviewed_summary(project_id, mr_id, unreviewed, run_key=None):
+    """
+    Posta no MR uma nota geral listando os arquivos que ficaram sem revisão. Com run_key a nota
+    leva um marcador e não é postada de novo se já existir (reentrega de tarefa na fila).
+    """
+    url = f"{GITLAB_API_URL}/projects/{project_id}/merge_requests/{mr_id}/notes"
+    marker = unreviewed_summary_marker(run_key) if run_key is not None else None
+    try:
+        if marker is not None and has_note_with_marker(project_id, mr_id, marker):
+            print("⏭️  Resumo dos arquivos não revisados já postado nesta execução")
+            return
+        resp = requests.post(
+            url,
+            headers=HEADERS,
+            json={"body": format_unreviewed_summary(unreviewed, marker)},
+            timeout=GITLAB_TIMEOUT_SECONDS
+        )
+        resp.raise_for_status()
+        print("📝 Resumo dos arquivos não revisados postado no MR")
+    except requests.RequestException as e:
+        print(f"⚠️  Não foi possível postar o resumo de arquivos não revisados: {e}")
+
+@traced("http")
 def get_existing_comments(project_id, mr_id):
     """
     Busca todos os comentários/discussions existentes no MR.
@@ -462,7 +1870,28 @@ def comment_on_mr(project_id, mr_id, old_path, new_path, line, body, diff_refs,
             return {"skipped": True, "reason": "duplicate"}
     
     url = f"{GITLAB_API_URL}/projects/{project_id}/merge_requests/{mr_id}/discussions"
-    base_position = {
+    data = {"body": body, "position": build_comment_position(old_path, new_path, line, diff_refs, line_type)}
+    debug_log(f"Enviando comentário: {data}")
+    with trace_span("comment_on_mr", "http", path=new_path, line=line) as span:
+        resp = requests.post(url, headers=HEADERS, json=data, timeout=GITLAB_TIMEOUT_SECONDS)
+        span["status"] = resp.status_code
+    if resp.status_code == 201:
+        return resp.json()
+    print(f"Resposta da API: {resp.text}")
+    resp.raise_for_status()
+    raise RuntimeError(f"GitLab retornou {resp.status_code} ao comentar")
+
+def gitlab_line_code(file_path, old_line, new_line):
+    """line_code do GitLab para uma linha do diff: sha1(path)_old_new."""
+    return f"{hashlib.sha1(file_path.encode('utf-8')).hexdigest()}_{old_line}_{new_line}"
+
+def build_comment_position(old_path, new_path, line, diff_refs, line_type="new"):
+    """
+    Posição do comentário calculada localmente a partir do diff: linha de contexto vai com
+    old_line e new_line pareadas e o line_range leva o line_code no formato do GitLab, então o
+    primeiro POST já é aceito (sem a ida e volta do 400 "line_code").
+    """
+    position = {
         "position_type": "text",
         "old_path": old_path,
         "new_path": new_path,
@@ -470,48 +1899,23 @@ def comment_on_mr(project_id, mr_id, old_path, new_path, line, body, diff_refs,
         "start_sha": diff_refs["start_sha"],
         "head_sha": diff_refs["head_sha"]
     }
-    line_pairs = diff_refs.get("line_pairs", {})
-    new_to_old = line_pairs.get("new_to_old", {})
-    old_to_new = line_pairs.get("old_to_new", {})
-
-    attempts = []
-    if line_type == "old":
-        position = dict(base_position)
-        position["old_line"] = line
-        attempts.append(position)
-        paired_new = old_to_new.get(line)
-        if paired_new is not None:
-            position_ctx = dict(position)
-            position_ctx["new_line"] = paired_new
-            attempts.append(position_ctx)
-    else:
-        position = dict(base_position)
-        position["new_line"] = line
-        attempts.append(position)
-        paired_old = new_to_old.get(line)
-        if paired_old is not None:
-            position_ctx = dict(position)
-            position_ctx["old_line"] = paired_old
-            attempts.append(position_ctx)
-
-    last_resp = None
-    for idx, position in enumerate(attempts, start=1):
-        data = {"body": body, "position": position}
-        debug_log(f"Enviando comentário tentativa {idx}/{len(attempts)}: {data}")
-        resp = requests.post(url, headers=HEADERS, json=data, timeout=GITLAB_TIMEOUT_SECONDS)
-        last_resp = resp
-        if resp.status_code == 201:
-            return resp.json()
-        if resp.status_code == 400 and "line_code" in resp.text and idx < len(attempts):
-            debug_log("GitLab retornou line_code inválido. Tentando fallback de posição com linha pareada.")
-            continue
-        print(f"Resposta da API: {resp.text}")
-        resp.raise_for_status()
-
-    if last_resp is not None:
-        print(f"Resposta da API: {last_resp.text}")
-        last_resp.raise_for_status()
-    raise RuntimeError("Falha ao enviar comentário para o GitLab.")
+    line_position = diff_refs.get("line_positions", {}).get(line_type, {}).get(line)
+    if line_position is None:
+        # Linha fora do diff: envia só o número e deixa o GitLab validar
+        position["old_line" if line_type == "old" else "new_line"] = line
+        return position
+    if line_position["old_line"] is not None:
+        position["old_line"] = line_position["old_line"]
+    if line_position["new_line"] is not None:
+        position["new_line"] = line_position["new_line"]
+    range_point = {
+        "line_code": line_position["line_code"],
+        "type": line_position["type"],
+        "old_line": line_position["old_line"],
+        "new_line": line_position["new_line"]
+    }
+    position["line_range"] = {"start": range_point, "end": dict(range_point)}
+    return position
 
 def build_full_diff(change):
     return (
@@ -583,20 +1987,41 @@ def get_line_maps(diff_text):
     debug_log(f"Mapas de linha montados: new={len(new_lines)} old={len(old_lines)}")
     return new_lines, old_lines
 
-def get_line_pair_maps(diff_text):
+def get_line_positions(diff_text, file_path):
     """
-    Mapeia linhas de contexto do diff (new <-> old), útil para montar position completo no GitLab.
+    Posições comentáveis do diff, indexadas por linha nova ("new") e antiga ("old"). Os contadores
+    seguem o parser de diff do GitLab: linha adicionada leva o número antigo corrente e removida o
+    novo corrente no line_code; só linhas de contexto vão com old_line e new_line na posição.
     """
     patch = PatchSet(diff_text)
-    new_to_old = {}
-    old_to_new = {}
+    positions = {"new": {}, "old": {}}
     for patched_file in patch:
         for hunk in patched_file:
+            old_pos = hunk.source_start
+            new_pos = hunk.target_start
             for line in hunk:
-                if line.is_context and line.target_line_no is not None and line.source_line_no is not None:
-                    new_to_old[line.target_line_no] = line.source_line_no
-                    old_to_new[line.source_line_no] = line.target_line_no
-    return new_to_old, old_to_new
+                if line.is_added:
+                    line_position = {"old_line": None, "new_line": new_pos, "type": "new"}
+                    positions["new"][new_pos] = line_position
+                    line_code = gitlab_line_code(file_path, old_pos, new_pos)
+                    new_pos += 1
+                elif line.is_removed:
+                    line_position = {"old_line": old_pos, "new_line": None, "type": "old"}
+                    positions["old"][old_pos] = line_position
+                    line_code = gitlab_line_code(file_path, old_pos, new_pos)
+                    old_pos += 1
+                elif line.is_context:
+                    line_position = {"old_line": old_pos, "new_line": new_pos, "type": None}
+                    positions["new"][new_pos] = line_position
+                    positions["old"][old_pos] = line_position
+                    line_code = gitlab_line_code(file_path, old_pos, new_pos)
+                    old_pos += 1
+                    new_pos += 1
+                else:
+                    # "\ No newline at end of file" não avança os contadores
+                    continue
+                line_position["line_code"] = line_code
+    return positions
 
 def normalize_text(text):
     return " ".join(text.split())
@@ -773,6 +2198,7 @@ def extract_method_names(text):
             seen.add(name)
     return result
 
+@traced("cpu")
 def choose_target_line(line_number, line_hint, snippet, suggestion_text, new_line_map, old_line_map):
     debug_log(
         f"Escolhendo linha: requested_line={line_number} hint={line_hint} "
@@ -867,6 +2293,526 @@ def choose_target_line(line_number, line_hint, snippet, suggestion_text, new_lin
     debug_log("Nenhuma linha candidata encontrada.")
     return None, None, False
 
+@traced("cpu")
+def prepare_file_review(change, diff_refs):
+    """
+    Prepara o diff de um arquivo para revisão: diff numerado para a IA, mapas de linhas
+    válidas (new/old) e diff_refs com as posições (e line_codes) de cada linha.
+    """
+    full_diff = build_full_diff(change)
+    new_line_map, old_line_map = get_line_maps(full_diff)
+    diff_refs_for_file = dict(diff_refs)
+    diff_refs_for_file["line_positions"] = get_line_positions(full_diff, change["new_path"])
+
+    diff_for_ai = render_diff_with_line_numbers(full_diff)
+    debug_log(f"Diff numerado gerado com {len(diff_for_ai.splitlines())} linhas")
+    return {
+        "diff_for_ai": diff_for_ai,
+        "new_line_map": new_line_map,
+        "old_line_map": old_line_map,
+        "diff_refs": diff_refs_for_file
+    }
+
+@traced("cpu")
+def parse_analysis_suggestions(analysis):
+    """Extrai da resposta da IA as sugestões no formato "Linha X: ..." já formatadas para o GitLab."""
+    suggestions = []
+    analysis_lines = analysis.split('\n')
+    for idx, line in enumerate(analysis_lines):
+        match = re.search(r"Linha (\d+)(?:\s*\((antiga|antigo|old|nova|novo|new)\))?:", line, re.IGNORECASE)
+        if not match:
+            continue
+        line_number = int(match.group(1))
+        raw_hint = (match.group(2) or "").lower()
+        if raw_hint in ("antiga", "antigo", "old"):
+            line_hint = "old"
+        elif raw_hint in ("nova", "novo", "new"):
+            line_hint = "new"
+        else:
+            line_hint = None
+
+        # Coletar todas as linhas da sugestão
+        suggestion_lines = []
+        suggestion = line.split(":", 1)[1].strip()
+        if suggestion:
+            suggestion_lines.append(suggestion)
+        for next_line in analysis_lines[idx+1:]:
+            if re.search(r"Linha \d+(?:\s*\((?:antiga|antigo|old|nova|novo|new)\))?:", next_line, re.IGNORECASE):
+                break
+            suggestion_lines.append(next_line)
+
+        suggestion_text = "\n".join(suggestion_lines).strip()
+
+        # Extrair partes da sugestão
+        codigo_atual = extract_code_block(suggestion_text, "Código atual problemático")
+        codigo_corrigido = extract_code_block(suggestion_text, "Código corrigido")
+        motivo = extract_reason(suggestion_text)
+
+        debug_log(
+            f"Sugestão parseada linha={line_number} hint={line_hint} "
+            f"tem_codigo_atual={'SIM' if codigo_atual else 'NAO'} "
+            f"tem_corrigido={'SIM' if codigo_corrigido else 'NAO'}"
+        )
+
+        # Montar comentário com GitLab suggestion
+        suggestion_block = format_gitlab_suggestion(
+            line.split(":", 1)[1].strip() if ":" in line else "Melhoria sugerida",
+            codigo_atual,
+            codigo_corrigido,
+            motivo
+        )
+        suggestions.append({
+            "line_number": line_number,
+            "line_hint": line_hint,
+            "text": suggestion_text,
+            "codigo_atual": codigo_atual,
+            "block": suggestion_block
+        })
+    return suggestions
+
+def split_diff_into_hunk_groups(change, max_lines=None):
+    """
+    Divide o diff de um arquivo em grupos de hunks consecutivos (limites de hunk do unidiff)
+    com até max_lines linhas cada. Um hunk maior que o limite (ex.: arquivo novo inteiro) é
+    quebrado antes em sub-hunks (split_oversized_hunk).
+    """
+    max_lines = max_lines or CHUNK_MAX_LINES
+    groups = []
+    current = []
+    current_lines = 0
+    for patched_file in PatchSet(build_full_diff(change)):
+        for hunk in patched_file:
+            for piece in split_oversized_hunk(hunk, max_lines):
+                if current and current_lines + piece["lines"] > max_lines:
+                    groups.append(current)
+                    current = []
+                    current_lines = 0
+                current.append(piece)
+                current_lines += piece["lines"]
+    if current:
+        groups.append(current)
+    return [
+        {
+            "diff": "".join(piece["text"] for piece in group),
+            "new_start": group[0]["target_start"],
+            "new_end": group[-1]["target_start"] + max(group[-1]["target_length"], 1) - 1,
+        }
+        for group in groups
+    ]
+
+def split_oversized_hunk(hunk, max_lines):
+    """
+    Quebra um hunk do unidiff em sub-hunks de até max_lines linhas (contando o cabeçalho), em
+    limites de linha, cada um com cabeçalho @@ próprio e numeração de base/head correta.
+    Hunks que já cabem voltam inteiros. Retorna [{"text", "target_start", "target_length", "lines"}].
+    """
+    if len(hunk) + 1 <= max_lines:
+        return [{
+            "text": str(hunk),
+            "target_start": hunk.target_start,
+            "target_length": hunk.target_length,
+            "lines": len(hunk) + 1,
+        }]
+    per_piece = max(max_lines - 1, 1)
+    pieces = []
+    source_line = hunk.source_start if hunk.source_length else hunk.source_start + 1
+    target_line = hunk.target_start if hunk.target_length else hunk.target_start + 1
+    lines = list(hunk)
+    start = 0
+    while start < len(lines):
+        end = min(start + per_piece, len(lines))
+        # "\ No newline at end of file" fica junto da linha a que se refere
+        while end < len(lines) and lines[end].line_type == "\\":
+            end += 1
+        piece_lines = lines[start:end]
+        source_length = sum(1 for line in piece_lines if line.line_type in (" ", "-"))
+        target_length = sum(1 for line in piece_lines if line.line_type in (" ", "+"))
+        # Lado vazio: o GitLab/unidiff numeram a partir da linha anterior (ex.: "-0,0" em arquivo novo)
+        source_start = source_line if source_length else source_line - 1
+        target_start = target_line if target_length else target_line - 1
+        header = f"@@ -{source_start},{source_length} +{target_start},{target_length} @@"
+        if not pieces and hunk.section_header:
+            header += f" {hunk.section_header}"
+        pieces.append({
+            "text": header + "\n" + "".join(str(line) for line in piece_lines),
+            "target_start": target_start,
+            "target_length": target_length,
+            "lines": len(piece_lines) + 1,
+        })
+        source_line += source_length
+        target_line += target_length
+        start = end
+    return pieces
+
+def slice_file_context(full_file_context, start, end, radius=None):
+    """Recorta do contexto renderizado (uma linha do arquivo por linha) a janela ao redor de um grupo de hunks."""
+    if not full_file_context:
+        return ""
+    radius = CHUNK_CONTEXT_LINES if radius is None else radius
+    lines = full_file_context.splitlines()
+    first = max(0, start - 1 - radius)
+    last = min(len(lines), end + radius)
+    return "\n".join(lines[first:last])
+
+@traced("stage")
+def review_hunk_group(review_messages, change, group, diff_refs, full_file_context, file_specific_rules, symbol_context):
+    """Revisa um grupo de hunks com o contexto local do arquivo. Retorna (analysis, prepared)."""
+    group_change = dict(change)
+    group_change["diff"] = group["diff"]
+    prepared = prepare_file_review(group_change, diff_refs)
+    local_context = slice_file_context(full_file_context, group["new_start"], group["new_end"])
+    if file_specific_rules:
+        local_context = file_specific_rules + "\n\n" + local_context
+    analysis = ask_chatgpt(review_messages, change["new_path"], prepared["diff_for_ai"], local_context, symbol_context)
+    return analysis, prepared
+
+def review_hunk_groups(review_messages, change, groups, diff_refs, full_file_context, file_specific_rules, symbol_context):
+    """
+    Revisa os grupos de hunks em paralelo. Retorna [(analysis, prepared)] dos grupos que responderam;
+    se a OpenAI estiver degradada para todos, propaga OpenAICircuitOpen.
+    """
+    futures = [
+        _chunk_executor.submit(
+            review_hunk_group, review_messages, change, group, diff_refs,
+            full_file_context, file_specific_rules, symbol_context
+        )
+        for group in groups
+    ]
+    reviews = []
+    circuit_error = None
+    for idx, future in enumerate(futures, start=1):
+        try:
+            reviews.append(future.result())
+        except OpenAICircuitOpen as e:
+            circuit_error = e
+        except Exception as e:
+            print(f"   ⚠️  Erro ao analisar o grupo {idx}/{len(groups)} de {change['new_path']}: {e}")
+    if not reviews and circuit_error is not None:
+        raise circuit_error
+    return reviews
+
+@traced("cpu")
+def merge_review_suggestions(reviews):
+    """
+    Junta as sugestões de todos os grupos (cada uma com o prepared do seu grupo, cujas linhas
+    NEW/OLD já são as do arquivo), removendo repetições entre grupos. Ordena pela linha.
+    """
+    merged = []
+    seen = set()
+    for analysis, prepared in reviews:
+        if not analysis or not analysis.strip():
+            continue
+        for suggestion in parse_analysis_suggestions(analysis):
+            key = (
+                suggestion["line_number"],
+                suggestion["line_hint"],
+                normalize_text(suggestion["codigo_atual"] or suggestion["text"])
+            )
+            if key in seen:
+                continue
+            seen.add(key)
+            merged.append((suggestion, prepared))
+    merged.sort(key=lambda item: item[0]["line_number"])
+    return merged
+
+def hunk_fingerprint(file_path, hunk):
+    """
+    Fingerprint do conteúdo de um hunk, independente dos números de linha do cabeçalho: tipo
+    de cada linha (+/-/contexto) e texto com espaços normalizados, mais arquivo, modo e modelo de revisão.
+    """
+    digest = hashlib.sha256(f"{REVIEW_MODE}\0{get_llm_backend('review')['model']}\0{file_path}\0".encode("utf-8"))
+    for line in hunk:
+        digest.update(f"{line.line_type}{normalize_text(line.value)}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+def suggestion_store_path(fingerprint):
+    return os.path.join(SUGGESTION_STORE_DIR, fingerprint[:2], f"{fingerprint}.json")
+
+def load_hunk_suggestions(fingerprint):
+    """Sugestões gravadas para um hunk, ou None se ele ainda não foi revisado."""
+    try:
+        with open(suggestion_store_path(fingerprint), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        debug_log(f"Falha ao ler sugestões do hunk {fingerprint[:12]}: {e}")
+        return None
+
+def store_hunk_suggestions(fingerprint, suggestions):
+    """Grava as sugestões de um hunk (lista vazia = revisado sem sugestões), com escrita atômica."""
+    path = suggestion_store_path(fingerprint)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(suggestions, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        debug_log(f"Falha ao gravar sugestões do hunk {fingerprint[:12]}: {e}")
+
+def hunk_contains_line(hunk, line_type, line):
+    if line_type == "old":
+        return hunk.source_start <= line < hunk.source_start + hunk.source_length
+    return hunk.target_start <= line < hunk.target_start + hunk.target_length
+
+def hunk_anchor(hunk):
+    """Primeira linha do hunk no diff: a nova, ou a antiga quando o hunk só remove linhas."""
+    if hunk.target_length:
+        return "new", hunk.target_start
+    return "old", hunk.source_start
+
+@traced("cpu")
+def split_reusable_hunks(change, diff_refs):
+    """
+    Separa os hunks do arquivo entre os já revisados (mesmo fingerprint no store) e os pendentes.
+    As sugestões reaproveitadas são remapeadas para os números de linha atuais a partir do
+    deslocamento dentro do hunk. Retorna None com o reaproveitamento desativado.
+    """
+    if not REUSE_HUNK_SUGGESTIONS:
+        return None
+    hunks = [hunk for patched_file in PatchSet(build_full_diff(change)) for hunk in patched_file]
+    reused_targets = []
+    reused_hunks = 0
+    pending = []
+    for hunk in hunks:
+        fingerprint = hunk_fingerprint(change["new_path"], hunk)
+        stored = load_hunk_suggestions(fingerprint)
+        if stored is None:
+            pending.append((fingerprint, hunk))
+            continue
+        reused_hunks += 1
+        for item in stored:
+            base = hunk.source_start if item["line_type"] == "old" else hunk.target_start
+            reused_targets.append({
+                "suggestion": item["suggestion"],
+                "line_type": item["line_type"],
+                "line": base + item["offset"],
+                "diff_refs": diff_refs,
+            })
+    return {
+        "hunks": len(hunks),
+        "reused_hunks": reused_hunks,
+        "reused_targets": reused_targets,
+        "pending": pending,
+        "pending_diff": "".join(str(hunk) for _fingerprint, hunk in pending),
+    }
+
+def remember_hunk_suggestions(pending, targets, reviews):
+    """
+    Grava no store as sugestões de cada hunk pendente que foi revisado com sucesso (inclusive os
+    sem sugestão), com a linha como deslocamento dentro do hunk.
+    """
+    reviewed_positions = [prepared["diff_refs"]["line_positions"] for _analysis, prepared in reviews]
+    for fingerprint, hunk in pending:
+        anchor_type, anchor_line = hunk_anchor(hunk)
+        if not any(anchor_line in positions[anchor_type] for positions in reviewed_positions):
+            continue
+        stored = []
+        for target in targets:
+            if not hunk_contains_line(hunk, target["line_type"], target["line"]):
+                continue
+            base = hunk.source_start if target["line_type"] == "old" else hunk.target_start
+            stored.append({
+                "suggestion": target["suggestion"],
+                "line_type": target["line_type"],
+                "offset": target["line"] - base,
+            })
+        store_hunk_suggestions(fingerprint, stored)
+
+def resolve_suggestion_targets(suggestions):
+    """
+    Escolhe a linha do diff de cada sugestão da IA. Retorna (targets, linhas não localizadas),
+    cada target com a sugestão, o tipo/número da linha e os diff_refs do seu grupo.
+    """
+    targets = []
+    missing = []
+    for suggestion, suggestion_prepared in suggestions:
+        target_line_type, target_line, ok = choose_target_line(
+            suggestion["line_number"],
+            suggestion["line_hint"],
+            suggestion["codigo_atual"],  # Usar código atual para localizar a linha
+            suggestion["text"],
+            suggestion_prepared["new_line_map"],
+            suggestion_prepared["old_line_map"]
+        )
+        if not ok:
+            missing.append(suggestion["line_number"])
+            continue
+        debug_log(
+            f"Comentário mapeado de linha solicitada={suggestion['line_number']} para linha final="
+            f"{target_line_type}:{target_line}"
+        )
+        targets.append({
+            "suggestion": suggestion,
+            "line_type": target_line_type,
+            "line": target_line,
+            "diff_refs": suggestion_prepared["diff_refs"],
+        })
+    return targets, missing
+
+def review_change(review_state, change, full_file_context=""):
+    """
+    Revisa um único arquivo do MR: monta o diff numerado, consulta a IA e posta os comentários.
+    Atualiza os totais em review_state["totals"]. Retorna False se o arquivo foi adiado ou falhou.
+    """
+    analyzed = analyze_change(review_state, change, full_file_context)
+    if analyzed is None:
+        return False
+    targets, missing = analyzed
+    post_review_targets(review_state, change, targets, missing)
+    return True
+
+def analyze_change(review_state, change, full_file_context=""):
+    """
+    Análise de um arquivo sem postar nada: diff numerado, sugestões reaproveitadas dos hunks sem
+    mudança, IA para o resto e escolha da linha de cada sugestão. Retorna (targets, linhas não
+    localizadas), ou None se o arquivo foi adiado (OpenAI degradada, em review_state["deferred"])
+    ou falhou (em review_state["unreviewed"] com motivo "falha").
+    """
+    project_id = review_state["project_id"]
+    review_messages = review_state["review_messages"]
+
+    file_path = change["new_path"]
+    print(f"➡️ Analisando arquivo: {file_path}")
+
+    # Adicionar regras específicas do tipo de arquivo
+    file_specific_rules = get_file_specific_rules(file_path)
+    if file_specific_rules:
+        debug_log(f"Aplicando regras específicas para {file_path}")
+    debug_log(
+        f"Arquivo atual old_path={change['old_path']} new_path={change['new_path']} "
+        f"diff_chars={len(change.get('diff', ''))}"
+    )
+
+    prepared = prepare_file_review(change, review_state["diff_refs"])
+    debug_log(
+        f"Contexto de arquivo recuperado para IA: lines={len(full_file_context.splitlines()) if full_file_context else 0}"
+    )
+
+    # Hunks idênticos a outros já revisados (rebase/force-push) reaproveitam as sugestões
+    reusable = split_reusable_hunks(change, prepared["diff_refs"])
+    review_target = change
+    reused_targets = []
+    if reusable and reusable["reused_hunks"]:
+        reused_targets = reusable["reused_targets"]
+        print(
+            f"   ♻️  {reusable['reused_hunks']}/{reusable['hunks']} hunk(s) sem mudança: "
+            f"{len(reused_targets)} sugestão(ões) reaproveitada(s)"
+        )
+        if reusable["pending"]:
+            review_target = dict(change)
+            review_target["diff"] = reusable["pending_diff"]
+            prepared = prepare_file_review(review_target, review_state["diff_refs"])
+
+    reviews = []
+    if not reusable or reusable["pending"]:
+        symbol_context = ""
+        if SYMBOL_CONTEXT_ENABLED:
+            try:
+                symbol_context = build_symbol_context(project_id, review_state["diff_refs"]["head_sha"], review_target)
+            except Exception as e:
+                debug_log(f"Falha ao montar contexto de símbolos para {file_path}: {e}")
+
+        # Diffs muito grandes: grupos de hunks revisados em paralelo, cada um com contexto local
+        groups = []
+        if CHUNK_MAX_LINES > 0 and len(prepared["diff_for_ai"].splitlines()) > CHUNK_MAX_LINES:
+            groups = split_diff_into_hunk_groups(review_target)
+
+        # Analisar arquivo
+        try:
+            if len(groups) > 1:
+                print(f"   ✂️  Diff grande: revisando {len(groups)} grupos de hunks em paralelo")
+                reviews = review_hunk_groups(
+                    review_messages, review_target, groups, review_state["diff_refs"],
+                    full_file_context, file_specific_rules, symbol_context
+                )
+            else:
+                # Adicionar contexto específico do tipo de arquivo ao prompt
+                if file_specific_rules:
+                    full_file_context = file_specific_rules + "\n\n" + full_file_context
+                analysis = ask_chatgpt(review_messages, file_path, prepared["diff_for_ai"], full_file_context, symbol_context)
+                reviews = [(analysis, prepared)]
+        except OpenAICircuitOpen:
+            print(f"   ⏸️  OpenAI degradada; {file_path} adiado\n")
+            review_state["deferred"].append(file_path)
+            return None
+        except Exception as e:
+            print(f"   ⚠️  Erro ao analisar {file_path}: {e}")
+            print("   ⏭️  Pulando arquivo...\n")
+            review_state["unreviewed"].append((file_path, "falha"))
+            return None
+        debug_log(f"Resposta IA recebida de {len(reviews)} chamada(s)")
+
+    targets, missing = resolve_suggestion_targets(merge_review_suggestions(reviews))
+    if reusable:
+        remember_hunk_suggestions(reusable["pending"], targets, reviews)
+    return sorted(reused_targets + targets, key=lambda target: target["line"]), missing
+
+def post_review_targets(review_state, change, targets, missing):
+    """Posta, na ordem das linhas, as sugestões já localizadas no diff e atualiza os totais."""
+    project_id = review_state["project_id"]
+    mr_id = review_state["mr_id"]
+    review_messages = review_state["review_messages"]
+    existing_comments = review_state["existing_comments"]
+    previous_suggestions = review_state["previous_suggestions"]
+    totals = review_state["totals"]
+    file_path = change["new_path"]
+
+    for line_number in missing:
+        # Só acontece se não houver nenhuma linha no diff.
+        print(f"   ⚠️ Não foi possível localizar uma linha válida no diff para a Linha {line_number}.")
+    if not targets and not missing:
+        print(f"   ✅ Nenhuma sugestão para {file_path}\n")
+        return
+    print(f"   🧠 Sugestões geradas pela IA para `{file_path}`:\n")
+
+    comentarios_postados = 0
+    linhas_encontradas = len(targets) + len(missing)
+
+    for target in targets:
+        target_line_type = target["line_type"]
+        target_line = target["line"]
+        suggestion_block = target["suggestion"]["block"]
+        try:
+            # Verificar se é duplicada
+            if detect_duplicate_suggestion(suggestion_block, previous_suggestions):
+                debug_log(f"Sugestão duplicada ignorada para linha {target_line}")
+                totals["duplicadas"] += 1
+                continue
+
+            # Validar relevância (se habilitado)
+            if not validate_suggestion_relevance(suggestion_block, review_messages):
+                debug_log(f"Sugestão considerada irrelevante para linha {target_line}")
+                totals["irrelevantes"] += 1
+                continue
+
+            comment_result = comment_on_mr(
+                project_id, mr_id,
+                change["old_path"],
+                change["new_path"],
+                target_line,
+                suggestion_block,
+                target["diff_refs"],
+                line_type=target_line_type,
+                existing_comments=existing_comments
+            )
+
+            if comment_result.get("skipped"):
+                debug_log(f"Comentário duplicado ignorado na linha {target_line}")
+            else:
+                # Adicionar ao cache para evitar duplicação na mesma execução
+                file_to_cache = change["new_path"] if target_line_type == "new" else change["old_path"]
+                existing_comments.add((file_to_cache, target_line))
+                previous_suggestions.append(suggestion_block)
+                comentarios_postados += 1
+        except Exception as e:
+            print(f"   ⚠️ Erro ao comentar: {e}")
+
+    totals["sugestoes"] += linhas_encontradas
+    totals["comentarios"] += comentarios_postados
+    print(f"   📊 Resumo: {comentarios_postados}/{linhas_encontradas} sugestões postadas para {file_path}\n")
+
 def main():
     # Solicita a URL do MR ao usuário
     mr_url = input("🔗 Cole a URL do Merge Request: ").strip()
@@ -905,237 +2851,219 @@ def main():
             print(f"   ⚠️ Formato de issue inválido: {issue_ref}")
         print()
 
+    try:
+        with trace_span("review_merge_request", "mr", mr_id=MR_ID):
+            review_merge_request(PROJECT_ID, MR_ID, observacoes, issue_metadata)
+    finally:
+        if TRACE_FILE:
+            write_trace()
+
+@contextmanager
+def open_diff_spool():
+    """
+    Arquivo temporário com os diffs dos arquivos selecionados, gravados uma vez na seleção (com os
+    colapsados já reconstruídos). A revisão em ordem de risco lê cada diff de volta sem rebuscar a
+    página de /diffs e sem manter os diffs do MR em memória. O arquivo é apagado ao sair.
+    """
+    spool = {"file": tempfile.TemporaryFile(), "size": 0, "lock": threading.Lock()}
+    try:
+        yield spool
+    finally:
+        spool["file"].close()
+
+def describe_review_change(change, spool):
+    """
+    Metadados leves de um arquivo selecionado: paths, flags, tamanho, risco e estimativas de
+    tokens. O diff vai para o spool (posição e tamanho nos metadados); load_review_change o lê
+    de volta quando o arquivo é agendado.
+    """
+    data = change.get("diff", "").encode("utf-8")
+    with spool["lock"]:
+        offset = spool["size"]
+        spool["file"].seek(offset)
+        spool["file"].write(data)
+        spool["size"] += len(data)
+    return {
+        "old_path": change["old_path"],
+        "new_path": change["new_path"],
+        "new_file": change.get("new_file", False),
+        "deleted_file": change.get("deleted_file", False),
+        "renamed_file": change.get("renamed_file", False),
+        "diff_offset": offset,
+        "diff_bytes": len(data),
+        "diff_chars": len(change.get("diff", "")),
+        "risk": score_change_risk(change),
+        "diff_tokens": estimate_diff_prompt_tokens(change),
+        "context_tokens": estimate_context_tokens_before_fetch(change),
+    }
+
+def load_review_change(spool, entry):
+    """Diff de um arquivo agendado, lido do spool gravado na seleção."""
+    with spool["lock"]:
+        spool["file"].seek(entry["diff_offset"])
+        data = spool["file"].read(entry["diff_bytes"])
+    return build_review_change(entry, str(data, "utf-8"))
+
+def build_review_change(entry, diff):
+    """Monta o change (formato de /diffs) a partir dos metadados da seleção e do diff."""
+    return {
+        "old_path": entry["old_path"],
+        "new_path": entry["new_path"],
+        "new_file": entry["new_file"],
+        "deleted_file": entry["deleted_file"],
+        "renamed_file": entry["renamed_file"],
+        "diff": diff,
+    }
+
+def select_review_changes(project_id, mr_id, diff_refs, totals, unreviewed, spool):
+    """
+    Arquivos do MR que serão revisados: diffs paginados, filtro de caminhos do projeto, diffs
+    colapsados resolvidos e mudanças pequenas descartadas (contadas em totals). Diffs colapsados
+    que não puderam ser reconstruídos entram em unreviewed. Só os metadados de cada arquivo
+    (describe_review_change) ficam em memória; o diff vai para o spool.
+    """
+    path_filter = get_path_filter(project_id, diff_refs["head_sha"])
+    selected = []
+    for page, page_changes in iter_mr_diff_pages(project_id, mr_id):
+        page_selected = 0
+        for change in page_changes:
+            if should_skip_file(change["new_path"], path_filter):
+                totals["ignorados_padrao"] += 1
+                continue
+            resolved = resolve_collapsed_diff(project_id, change, diff_refs)
+            if resolved is None:
+                unreviewed.append((change["new_path"], "download"))
+                continue
+            change = resolved
+            # Filtrar mudanças muito pequenas (economiza chamadas API)
+            if should_skip_by_size(change):
+                totals["ignorados_tamanho"] += 1
+                continue
+            selected.append(describe_review_change(change, spool))
+            page_selected += 1
+        del page_changes
+        debug_log(f"Página {page}: {page_selected} arquivo(s) selecionado(s)")
+    return selected
+
+def review_merge_request(project_id, mr_id, observacoes="", issue_metadata=None):
+    """Revisa um MR de ponta a ponta: metadata, diffs paginados, revisão por arquivo e totais."""
     # Buscar metadata do MR
     print("📋 Buscando informações do MR...")
-    mr_metadata = get_mr_metadata(PROJECT_ID, MR_ID)
+    mr_metadata = get_mr_metadata(project_id, mr_id)
     if mr_metadata.get('title'):
         print(f"   Título: {mr_metadata['title']}")
     if mr_metadata.get('labels'):
         print(f"   Labels: {', '.join(mr_metadata['labels'])}")
     print()
 
+    diff_refs = mr_metadata.get("diff_refs")
+    if not diff_refs:
+        print("❌ Erro: não foi possível obter os diff_refs do MR.")
+        return
+
     # Buscar comentários existentes para evitar duplicação
     print("📝 Verificando comentários existentes...")
-    existing_comments = get_existing_comments(PROJECT_ID, MR_ID)
+    existing_comments = get_existing_comments(project_id, mr_id)
     print()
 
-    url = f"{GITLAB_API_URL}/projects/{PROJECT_ID}/merge_requests/{MR_ID}/changes"
-    resp = requests.get(url, headers=HEADERS, timeout=GITLAB_TIMEOUT_SECONDS)
-    resp.raise_for_status()
-    mr_data = resp.json()
-    changes = mr_data["changes"]
-    diff_refs = mr_data["diff_refs"]
-
-    # Filtrar arquivos que devem ser ignorados
-    original_count = len(changes)
-    changes = [c for c in changes if not should_skip_file(c["new_path"])]
-    
-    # Filtrar mudanças muito pequenas (economiza chamadas API)
-    changes_before_size_filter = len(changes)
-    changes = [c for c in changes if not should_skip_by_size(c)]
-    
-    skipped_by_pattern = original_count - changes_before_size_filter
-    skipped_by_size = changes_before_size_filter - len(changes)
-    
-    if skipped_by_pattern > 0:
-        print(f"⏭️  {skipped_by_pattern} arquivo(s) ignorado(s) (lock files, generated files, etc.)")
-    if skipped_by_size > 0:
-        print(f"⏭️  {skipped_by_size} arquivo(s) ignorado(s) (mudanças < {MIN_DIFF_SIZE_TO_REVIEW} chars)")
-    print(f"📂 {len(changes)} arquivo(s) selecionado(s) para análise.\n")
-    
-    if len(changes) == 0:
-        print("✨ Nenhum arquivo relevante para revisar!\n")
-        return
-    
-    # Priorizar arquivos por tamanho e tipo
-    changes = prioritize_changes(changes)
-    
-    # Gerar sumário de mudanças
-    changes_summary = generate_changes_summary(changes)
+    # Sem o resumo completo: os diffs chegam em streaming, página a página
+    changes_summary = generate_streaming_summary(mr_metadata)
     print(changes_summary)
     print()
-    
-    file_context_map = build_file_context_map(PROJECT_ID, changes, diff_refs["head_sha"])
+
     review_messages = create_review_session(observacoes, mr_metadata, issue_metadata)
-    
+
     # Adicionar sumário de mudanças ao contexto
     review_messages.append({"role": "user", "content": changes_summary})
     review_messages.append({"role": "assistant", "content": "Resumo registrado. Pronto para análise."})
-    
-    print("✅ Contexto preparado\n")
 
-    total_sugestoes = 0
-    total_comentarios = 0
-    total_duplicadas = 0
-    total_irrelevantes = 0
-    previous_suggestions = []
-    
-    # Processar cada arquivo individualmente (SIMPLIFICADO)
-    print(f"📁 Processando {len(changes)} arquivo(s)...\n")
-    
-    for change in changes:
-        file_path = change["new_path"]
-        print(f"➡️ Analisando arquivo: {file_path}")
-        
-        # Adicionar regras específicas do tipo de arquivo
-        file_specific_rules = get_file_specific_rules(file_path)
-        if file_specific_rules:
-            debug_log(f"Aplicando regras específicas para {file_path}")
-        debug_log(
-            f"Arquivo atual old_path={change['old_path']} new_path={change['new_path']} "
-            f"diff_chars={len(change.get('diff', ''))}"
-        )
-
-        full_diff = build_full_diff(change)
-        new_line_map, old_line_map = get_line_maps(full_diff)
-        new_to_old, old_to_new = get_line_pair_maps(full_diff)
-        diff_refs_for_file = dict(diff_refs)
-        diff_refs_for_file["line_pairs"] = {
-            "new_to_old": new_to_old,
-            "old_to_new": old_to_new
-        }
-
-        diff_for_ai = render_diff_with_line_numbers(full_diff)
-        debug_log(f"Diff numerado gerado com {len(diff_for_ai.splitlines())} linhas")
-        full_file_context = file_context_map.get(change["new_path"], "")
-        debug_log(
-            f"Contexto de arquivo recuperado para IA: lines={len(full_file_context.splitlines()) if full_file_context else 0}"
-        )
-        
-        # Adicionar contexto específico do tipo de arquivo ao prompt
-        file_specific_context = get_file_specific_rules(file_path)
-        if file_specific_context:
-            full_file_context = file_specific_context + "\n\n" + full_file_context
-        
-        # Analisar arquivo
-        try:
-            analysis = ask_chatgpt(review_messages, file_path, diff_for_ai, full_file_context)
-        except Exception as e:
-            print(f"   ⚠️  Erro ao analisar {file_path}: {e}")
-            print("   ⏭️  Pulando arquivo...\n")
-            continue
-        
-        if not analysis or not analysis.strip():
-            print(f"   ✅ Nenhuma sugestão para {file_path}\n")
-            continue
-        debug_log(f"Resposta IA recebida com {len(analysis.splitlines())} linhas")
-        print(f"   🧠 Sugestões geradas pela IA para `{file_path}`:\n")
-
-        comentarios_postados = 0
-        linhas_encontradas = 0
-
-        analysis_lines = analysis.split('\n')
-        for idx, line in enumerate(analysis_lines):
-            match = re.search(r"Linha (\d+)(?:\s*\((antiga|antigo|old|nova|novo|new)\))?:", line, re.IGNORECASE)
-            if match:
-                linhas_encontradas += 1
-                try:
-                    line_number = int(match.group(1))
-                    raw_hint = (match.group(2) or "").lower()
-                    if raw_hint in ("antiga", "antigo", "old"):
-                        line_hint = "old"
-                    elif raw_hint in ("nova", "novo", "new"):
-                        line_hint = "new"
-                    else:
-                        line_hint = None
-                    
-                    # Coletar todas as linhas da sugestão
-                    suggestion_lines = []
-                    suggestion = line.split(":", 1)[1].strip()
-                    if suggestion:
-                        suggestion_lines.append(suggestion)
-                    for next_line in analysis_lines[idx+1:]:
-                        if re.search(r"Linha \d+(?:\s*\((?:antiga|antigo|old|nova|novo|new)\))?:", next_line, re.IGNORECASE):
-                            break
-                        suggestion_lines.append(next_line)
-                    
-                    suggestion_text = "\n".join(suggestion_lines).strip()
-                    
-                    # Extrair partes da sugestão
-                    codigo_atual = extract_code_block(suggestion_text, "Código atual problemático")
-                    codigo_corrigido = extract_code_block(suggestion_text, "Código corrigido")
-                    motivo = extract_reason(suggestion_text)
-                    
-                    debug_log(
-                        f"Sugestão parseada linha={line_number} hint={line_hint} "
-                        f"tem_codigo_atual={'SIM' if codigo_atual else 'NAO'} "
-                        f"tem_corrigido={'SIM' if codigo_corrigido else 'NAO'}"
-                    )
-                    
-                    # Montar comentário com GitLab suggestion
-                    suggestion_block = format_gitlab_suggestion(
-                        line.split(":", 1)[1].strip() if ":" in line else "Melhoria sugerida",
-                        codigo_atual,
-                        codigo_corrigido,
-                        motivo
-                    )
+    print("✅ Contexto preparado\n")
 
-                    target_line_type, target_line, ok = choose_target_line(
-                        line_number,
-                        line_hint,
-                        codigo_atual,  # Usar código atual para localizar a linha
-                        suggestion_text,
-                        new_line_map,
-                        old_line_map
-                    )
-                    if ok:
-                        # Verificar se é duplicada
-                        if detect_duplicate_suggestion(suggestion_block, previous_suggestions):
-                            debug_log(f"Sugestão duplicada ignorada para linha {line_number}")
-                            total_duplicadas += 1
-                            continue
-                        
-                        # Validar relevância (se habilitado)
-                        if not validate_suggestion_relevance(suggestion_block, review_messages):
-                            debug_log(f"Sugestão considerada irrelevante para linha {line_number}")
-                            total_irrelevantes += 1
-                            continue
-                        
-                        debug_log(
-                            f"Comentário mapeado de linha solicitada={line_number} para linha final="
-                            f"{target_line_type}:{target_line}"
-                        )
-                        comment_result = comment_on_mr(
-                            PROJECT_ID, MR_ID, 
-                            change["old_path"], 
-                            change["new_path"], 
-                            target_line, 
-                            suggestion_block, 
-                            diff_refs_for_file, 
-                            line_type=target_line_type,
-                            existing_comments=existing_comments
-                        )
-                        
-                        if comment_result.get("skipped"):
-                            debug_log(f"Comentário duplicado ignorado na linha {target_line}")
-                        else:
-                            # Adicionar ao cache para evitar duplicação na mesma execução
-                            file_to_cache = change["new_path"] if target_line_type == "new" else change["old_path"]
-                            existing_comments.add((file_to_cache, target_line))
-                            previous_suggestions.append(suggestion_block)
-                            comentarios_postados += 1
-                    else:
-                        # Só acontece se não houver nenhuma linha no diff.
-                        print(f"   ⚠️ Não foi possível localizar uma linha válida no diff para a Linha {line_number}.")
-                except Exception as e:
-                    print(f"   ⚠️ Erro ao comentar: {e}")
-
-        total_sugestoes += linhas_encontradas
-        total_comentarios += comentarios_postados
-
-        if linhas_encontradas == 0:
-            print(f"   ✅ Nenhuma sugestão para {file_path} - código está OK!\n")
-        else:
-            print(f"   📊 Resumo: {comentarios_postados}/{linhas_encontradas} sugestões postadas para {file_path}\n")
+    review_state = {
+        "project_id": project_id,
+        "mr_id": mr_id,
+        "diff_refs": diff_refs,
+        "review_messages": review_messages,
+        "existing_comments": existing_comments,
+        "previous_suggestions": [],
+        "deferred": [],
+        "unreviewed": [],
+        "budget": create_review_budget(),
+        "totals": {
+            "sugestoes": 0,
+            "comentarios": 0,
+            "duplicadas": 0,
+            "irrelevantes": 0,
+            "arquivos": 0,
+            "ignorados_padrao": 0,
+            "ignorados_tamanho": 0,
+        },
+    }
+    totals = review_state["totals"]
+
+    budget = review_state["budget"]
+    with open_diff_spool() as spool:
+        # Buscar os diffs página a página, descartando já na página o que não será revisado
+        print(f"📁 Buscando arquivos em lotes de {DIFFS_PAGE_SIZE}...\n")
+        selected = select_review_changes(project_id, mr_id, diff_refs, totals, review_state["unreviewed"], spool)
+
+        print_review_estimate(review_messages, selected)
+
+        # Revisar do maior para o menor risco, respeitando prazo e orçamento de tokens; o diff de
+        # cada arquivo só é lido do spool quando ele é agendado
+        for entry in prioritize_changes(selected):
+            # Com a OpenAI degradada (circuito aberto) não vale nem montar o contexto
+            if not openai_circuit_allows():
+                review_state["deferred"].append(entry["new_path"])
+                continue
+            stop_reason = get_budget_stop_reason(budget)
+            if stop_reason is None:
+                started = time.monotonic()
+                change = load_review_change(spool, entry)
+                full_file_context = build_file_context(project_id, change, diff_refs["head_sha"])
+                estimated_tokens = estimate_review_tokens(review_messages, change, full_file_context)
+                stop_reason = get_budget_stop_reason(budget, estimated_tokens)
+            if stop_reason is not None:
+                review_state["unreviewed"].append((entry["new_path"], stop_reason))
+                continue
+            with trace_span(
+                "review_change", "file", path=change["new_path"],
+                diff_chars=len(change["diff"]), context_chars=len(full_file_context)
+            ):
+                reviewed = review_change(review_state, change, full_file_context)
+            # Adiados e falhas já ficaram registrados em review_state e não contam no orçamento
+            if reviewed:
+                totals["arquivos"] += 1
+                record_budget_usage(budget, estimated_tokens, time.monotonic() - started)
+            # Libera diff e contexto antes do próximo arquivo
+            del change, full_file_context
+        del selected
+
+    if totals["ignorados_padrao"] > 0:
+        print(f"⏭️  {totals['ignorados_padrao']} arquivo(s) ignorado(s) (lock files, generated files, etc.)")
+    if totals["ignorados_tamanho"] > 0:
+        print(f"⏭️  {totals['ignorados_tamanho']} arquivo(s) ignorado(s) (mudanças < {MIN_DIFF_SIZE_TO_REVIEW} chars)")
+    unreviewed = collect_unreviewed(review_state)
+    if unreviewed:
+        print(f"⏸️  {len(unreviewed)} arquivo(s) não revisado(s):")
+        for path, reason in unreviewed:
+            print(f"   - {path} ({UNREVIEWED_REASONS.get(reason, reason)})")
+        if POST_UNREVIEWED_SUMMARY:
+            post_unreviewed_summary(project_id, mr_id, unreviewed)
+    if totals["arquivos"] == 0 and not unreviewed:
+        print("✨ Nenhum arquivo relevante para revisar!\n")
+        return totals
 
     print("\n✨ Análise concluída!")
-    print(f"📊 Total de sugestões geradas: {total_sugestoes}")
-    print(f"💬 Total de comentários postados: {total_comentarios}")
-    if total_duplicadas > 0:
-        print(f"🔄 Sugestões duplicadas filtradas: {total_duplicadas}")
-    if total_irrelevantes > 0:
-        print(f"⚖️  Sugestões irrelevantes filtradas: {total_irrelevantes}")
+    print(f"📂 Total de arquivos analisados: {totals['arquivos']}")
+    print(f"📊 Total de sugestões geradas: {totals['sugestoes']}")
+    print(f"💬 Total de comentários postados: {totals['comentarios']}")
+    if totals["duplicadas"] > 0:
+        print(f"🔄 Sugestões duplicadas filtradas: {totals['duplicadas']}")
+    if totals["irrelevantes"] > 0:
+        print(f"⚖️  Sugestões irrelevantes filtradas: {totals['irrelevantes']}")
     print()
+    return totals
 
 if __name__ == "__main__":
     main()
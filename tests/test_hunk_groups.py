@@ -0,0 +1,70 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+from unidiff import PatchSet
+
+
+def added_file_change(total_lines):
+    body = "".join(f"+linha {number}\n" for number in range(1, total_lines + 1))
+    return {
+        "old_path": "src/Novo.java", "new_path": "src/Novo.java", "new_file": True,
+        "deleted_file": False, "renamed_file": False,
+        "diff": f"@@ -0,0 +1,{total_lines} @@\n{body}",
+    }
+
+
+class HunkGroupsTest(unittest.TestCase):
+    def parse_group(self, change, group):
+        group_change = dict(change)
+        group_change["diff"] = group["diff"]
+        return PatchSet(main.build_full_diff(group_change))[0]
+
+    def test_arquivo_novo_grande_vira_varios_grupos(self):
+        change = added_file_change(3000)
+        groups = main.split_diff_into_hunk_groups(change, max_lines=100)
+        self.assertEqual(len(groups), 31)
+        next_line = 1
+        for group in groups:
+            self.assertLessEqual(len(group["diff"].splitlines()), 100)
+            self.assertEqual(group["new_start"], next_line)
+            # O cabeçalho de cada sub-hunk bate com as linhas: a linha N do head é "linha N"
+            for hunk in self.parse_group(change, group):
+                for line in hunk:
+                    self.assertEqual(line.value, f"linha {line.target_line_no}\n")
+            next_line = group["new_end"] + 1
+        self.assertEqual(next_line, 3001)
+
+    def test_hunk_grande_com_remocoes_mantem_numeracao_da_base(self):
+        old_lines = [f"velha {number}\n" for number in range(1, 301)]
+        diff_lines = ["@@ -10,300 +10,300 @@ class A\n"]
+        for number, line in enumerate(old_lines, start=10):
+            diff_lines.append(f"-{line}")
+            diff_lines.append(f"+nova {number}\n")
+        change = {
+            "old_path": "A.java", "new_path": "A.java", "new_file": False,
+            "deleted_file": False, "renamed_file": False, "diff": "".join(diff_lines),
+        }
+        groups = main.split_diff_into_hunk_groups(change, max_lines=50)
+        self.assertGreater(len(groups), 1)
+        removed = []
+        added = []
+        for group in groups:
+            for hunk in self.parse_group(change, group):
+                removed += [(line.source_line_no, line.value) for line in hunk if line.is_removed]
+                added += [(line.target_line_no, line.value) for line in hunk if line.is_added]
+        self.assertEqual(removed, [(number, f"velha {number - 9}\n") for number in range(10, 310)])
+        self.assertEqual(added, [(number, f"nova {number}\n") for number in range(10, 310)])
+
+    def test_hunks_pequenos_ficam_inteiros(self):
+        change = added_file_change(10)
+        groups = main.split_diff_into_hunk_groups(change, max_lines=100)
+        self.assertEqual(len(groups), 1)
+        self.assertEqual((groups[0]["new_start"], groups[0]["new_end"]), (1, 10))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,169 @@
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import review_queue
+from review_queue import MR_SEQ_LEVELS, MemoryQueue, PostgresQueue, SQLiteQueue
+
+# Banco descartável para os testes do backend postgres (a tabela de tarefas é apagada a cada teste)
+TEST_QUEUE_DSN = os.getenv("MR_REVIEW_TEST_QUEUE_DSN", "")
+
+
+class QueueContract:
+    """Testes comuns a todos os backends; cada subclasse abre a fila e uma segunda conexão a ela."""
+
+    def setUp(self):
+        self.queue = self.open_queue()
+
+    def open_queue(self):
+        raise NotImplementedError
+
+    def open_second_connection(self):
+        raise NotImplementedError
+
+    def enqueue_mr(self, mr_key):
+        task_id = self.queue.enqueue("mr", mr_key, {}, mr_key, levels=MR_SEQ_LEVELS)
+        return self.queue.list_tasks(mr_key, kind="mr")[-1]["seq"], task_id
+
+    def test_enqueue_ignora_tarefa_repetida(self):
+        seq, _task_id = self.enqueue_mr("p!1")
+        self.assertIsNotNone(self.queue.enqueue("file", "a.py", {}, "p!1", seq=seq + 1))
+        self.assertIsNone(self.queue.enqueue("file", "a.py", {}, "p!1", seq=seq + 1))
+
+    def test_ordem_por_mr(self):
+        seq, mr_task = self.enqueue_mr("p!1")
+        self.queue.enqueue("file", "a.py", {}, "p!1", seq=seq + 1)
+        self.queue.enqueue("file", "b.py", {}, "p!1", seq=seq + 1)
+        self.queue.enqueue("post", "comentarios", {}, "p!1", seq=seq + 2)
+
+        task = self.queue.claim("w1")
+        self.assertEqual(task["id"], mr_task)
+        # Arquivos esperam a tarefa "mr" terminar
+        self.assertIsNone(self.queue.claim("w2"))
+        self.assertTrue(self.queue.complete(task["id"], "w1", {}))
+
+        first = self.queue.claim("w1")
+        second = self.queue.claim("w2")
+        self.assertEqual({first["name"], second["name"]}, {"a.py", "b.py"})
+        # A postagem só sai depois de todos os arquivos
+        self.assertIsNone(self.queue.claim("w3"))
+        self.queue.complete(first["id"], "w1", {})
+        self.assertIsNone(self.queue.claim("w3"))
+        self.queue.complete(second["id"], "w2", {})
+        self.assertEqual(self.queue.claim("w3")["kind"], "post")
+
+    def test_segunda_revisao_do_mesmo_mr_espera_a_primeira(self):
+        first_seq, first_task = self.enqueue_mr("p!1")
+        second_seq, _second_task = self.enqueue_mr("p!1")
+        self.assertEqual(second_seq, first_seq + MR_SEQ_LEVELS)
+        self.assertEqual(self.queue.claim("w1")["id"], first_task)
+        self.assertIsNone(self.queue.claim("w2"))
+
+    def test_mrs_diferentes_nao_se_bloqueiam(self):
+        _seq, first_task = self.enqueue_mr("p!1")
+        _seq, second_task = self.enqueue_mr("p!2")
+        self.assertEqual(self.queue.claim("w1")["id"], first_task)
+        self.assertEqual(self.queue.claim("w2")["id"], second_task)
+
+    def test_lease_expirada_volta_para_a_fila(self):
+        _seq, task_id = self.enqueue_mr("p!1")
+        dead = self.queue.claim("morto", lease_seconds=0.01)
+        time.sleep(0.02)
+        alive = self.queue.claim("vivo", lease_seconds=60)
+        self.assertEqual(alive["id"], task_id)
+        self.assertEqual(alive["attempts"], 2)
+        # O worker que perdeu a lease não renova nem conclui a tarefa
+        self.assertFalse(self.queue.heartbeat(dead["id"], "morto"))
+        self.assertFalse(self.queue.complete(dead["id"], "morto", {"resultado": "antigo"}))
+        self.assertTrue(self.queue.complete(alive["id"], "vivo", {"resultado": "novo"}))
+        self.assertEqual(self.queue.list_tasks("p!1")[0]["result"], {"resultado": "novo"})
+
+    def test_heartbeat_mantem_a_lease(self):
+        self.enqueue_mr("p!1")
+        task = self.queue.claim("w1", lease_seconds=0.05)
+        for _beat in range(3):
+            time.sleep(0.02)
+            self.assertTrue(self.queue.heartbeat(task["id"], "w1", lease_seconds=0.05))
+        self.assertIsNone(self.queue.claim("w2"))
+
+    def test_lease_expirada_esgota_tentativas(self):
+        self.enqueue_mr("p!1")
+        for _attempt in range(review_queue.MAX_ATTEMPTS):
+            self.assertIsNotNone(self.queue.claim("morto", lease_seconds=0.01))
+            time.sleep(0.02)
+        self.assertIsNone(self.queue.claim("vivo"))
+        self.assertEqual(self.queue.stats(), {("mr", "failed"): 1})
+
+    def test_falha_com_atraso(self):
+        _seq, task_id = self.enqueue_mr("p!1")
+        task = self.queue.claim("w1")
+        self.assertTrue(self.queue.fail(task["id"], "w1", "OpenAI degradada", delay_seconds=0.05))
+        self.assertIsNone(self.queue.claim("w1"))
+        time.sleep(0.06)
+        self.assertEqual(self.queue.claim("w1")["id"], task_id)
+
+    def test_duas_conexoes_disputando_a_fila_nao_pegam_a_mesma_tarefa(self):
+        task_ids = {self.enqueue_mr(f"p!{mr}")[1] for mr in range(20)}
+        queues = [self.queue, self.open_second_connection()]
+        claimed = [[], []]
+        start = threading.Barrier(2)
+
+        def worker(index):
+            start.wait()
+            while True:
+                task = queues[index].claim(f"w{index}")
+                if task is None:
+                    return
+                claimed[index].append(task["id"])
+
+        threads = [threading.Thread(target=worker, args=(index,)) for index in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(claimed[0] + claimed[1]), sorted(task_ids))
+
+
+class MemoryQueueTest(QueueContract, unittest.TestCase):
+    def open_queue(self):
+        return MemoryQueue()
+
+    def open_second_connection(self):
+        # Em memória não há conexão: a disputa é entre threads na mesma fila
+        return self.queue
+
+
+class SQLiteQueueTest(QueueContract, unittest.TestCase):
+    def open_queue(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "queue.sqlite3")
+        return SQLiteQueue(self.path)
+
+    def open_second_connection(self):
+        return SQLiteQueue(self.path)
+
+
+@unittest.skipUnless(
+    TEST_QUEUE_DSN and review_queue.psycopg is not None, "MR_REVIEW_TEST_QUEUE_DSN e psycopg necessários"
+)
+class PostgresQueueTest(QueueContract, unittest.TestCase):
+    def open_queue(self):
+        queue = PostgresQueue(TEST_QUEUE_DSN)
+        queue._conn.execute("TRUNCATE review_tasks RESTART IDENTITY")
+        self.addCleanup(queue._conn.close)
+        return queue
+
+    def open_second_connection(self):
+        queue = PostgresQueue(TEST_QUEUE_DSN)
+        self.addCleanup(queue._conn.close)
+        return queue
+
+
+if __name__ == "__main__":
+    unittest.main()
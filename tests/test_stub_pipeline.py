@@ -0,0 +1,124 @@
+import json
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import llm_backends
+import main
+
+OLD_FILE = "class A {\n  void foo() {\n    bar();\n  }\n}\n"
+NEW_FILE = "class A {\n  void foo() {\n    int x = 1;\n    bar();\n  }\n}\n"
+DIFF = "@@ -1,5 +1,6 @@\n class A {\n   void foo() {\n+    int x = 1;\n     bar();\n   }\n }\n"
+REVIEW_RESPONSE = (
+    "Linha 3: Variável não usada\n"
+    "Código atual problemático: int x = 1;\n"
+    "Código corrigido: \n"
+    "Motivo: x não é usado\n"
+)
+
+
+class FakeResponse:
+    def __init__(self, status_code=200, data=None, text=None, headers=None):
+        self.status_code = status_code
+        self._data = data
+        self.text = text if text is not None else json.dumps(data)
+        self.content = self.text.encode("utf-8")
+        self.headers = headers or {}
+
+    def json(self):
+        return self._data
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise main.requests.HTTPError(str(self.status_code))
+
+
+class FakeGitLab:
+    """GitLab mínimo para um MR com um arquivo Java alterado; registra o que é postado."""
+
+    def __init__(self):
+        self.calls = []
+        self.discussions = []
+        self.notes = []
+
+    def get(self, url, params=None, **kwargs):
+        self.calls.append(("GET", url))
+        if url.endswith("/merge_requests/5"):
+            return FakeResponse(data={
+                "title": "Ajusta foo", "description": "", "labels": [], "changes_count": "1",
+                "diff_refs": {"base_sha": "base", "start_sha": "base", "head_sha": "head"},
+            })
+        if url.endswith("/discussions"):
+            return FakeResponse(data=[])
+        if url.endswith("/diffs"):
+            return FakeResponse(data=[{
+                "old_path": "src/A.java", "new_path": "src/A.java", "diff": DIFF,
+                "new_file": False, "deleted_file": False, "renamed_file": False,
+            }], headers={"X-Next-Page": ""})
+        if url.endswith("/repository/files/src%2FA.java/raw"):
+            return FakeResponse(text=NEW_FILE if params["ref"] == "head" else OLD_FILE)
+        return FakeResponse(404, text="not found")
+
+    def post(self, url, json=None, **kwargs):
+        self.calls.append(("POST", url))
+        if url.endswith("/discussions"):
+            self.discussions.append(json)
+            return FakeResponse(201, data={"id": len(self.discussions)})
+        if url.endswith("/notes"):
+            self.notes.append(json["body"])
+        return FakeResponse(201, data={"id": 1})
+
+
+class StubPipelineTest(unittest.TestCase):
+    def run_review(self, env, **patches):
+        gitlab = FakeGitLab()
+        stub_env = {"LLM_REVIEW_PROVIDER": "stub", "LLM_REVIEW_STUB_RESPONSE": REVIEW_RESPONSE}
+        stub_env.update(env)
+        llm_backends._backends.clear()
+        with mock.patch.dict(os.environ, stub_env), \
+                mock.patch.object(main.requests, "get", gitlab.get), \
+                mock.patch.object(main.requests, "post", gitlab.post), \
+                mock.patch.multiple(
+                    main, DELAY_BETWEEN_CALLS=0, BLOB_CACHE_MAX_BYTES=0, REUSE_HUNK_SUGGESTIONS=False,
+                    SYMBOL_CONTEXT_ENABLED=False, USE_REPOSITORY_ARCHIVE=False, DEBUG_MODE=False, **patches
+                ):
+            try:
+                gitlab.totals = main.review_merge_request("g%2Fp", "5")
+            finally:
+                llm_backends._backends.clear()
+        # O stub responde localmente: nenhuma chamada sai para a API de LLM
+        self.assertFalse([call for call in gitlab.calls if "chat/completions" in call[1]])
+        return gitlab
+
+    def test_revisao_posta_sugestao_do_stub(self):
+        gitlab = self.run_review({})
+        self.assertEqual(len(gitlab.discussions), 1)
+        position = gitlab.discussions[0]["position"]
+        self.assertEqual((position["new_path"], position["new_line"]), ("src/A.java", 3))
+
+    def test_triagem_descarta_sugestao(self):
+        gitlab = self.run_review({
+            "LLM_TRIAGE_PROVIDER": "stub",
+            "LLM_TRIAGE_MODEL": "stub",
+            "LLM_TRIAGE_STUB_RESPONSE": "NAO",
+        })
+        self.assertEqual(gitlab.discussions, [])
+
+    def test_llm_model_global_nao_ativa_triagem(self):
+        gitlab = self.run_review({"LLM_MODEL": "modelo-global", "LLM_TRIAGE_STUB_RESPONSE": "NAO"})
+        self.assertEqual(len(gitlab.discussions), 1)
+
+    def test_falha_na_analise_entra_como_nao_revisado(self):
+        failing = mock.Mock(side_effect=ValueError("resposta inválida"))
+        gitlab = self.run_review({}, ask_chatgpt=failing, POST_UNREVIEWED_SUMMARY=True)
+        self.assertEqual(gitlab.totals["arquivos"], 0)
+        self.assertEqual(gitlab.discussions, [])
+        self.assertEqual(len(gitlab.notes), 1)
+        self.assertIn(f"`src/A.java` — {main.UNREVIEWED_REASONS['falha']}", gitlab.notes[0])
+
+
+if __name__ == "__main__":
+    unittest.main()